@@ -36,8 +36,8 @@ class Db:
     def __init__(self, connectionstring=None):
         "docstring"
         self.testsaver = None
-        if stringconnection:
-            pars = stringconnection.split(';')
+        if connectionstring:
+            pars = connectionstring.split(';')
             filename = pars.pop(0)
             parameters = {}
             for par in pars:
@@ -45,10 +45,10 @@ class Db:
                 if len(parameter) == 1:
                     parameters[parameter[0]] = True
                 else:
-                    parameter[parameter[0]] = parameter[1]
+                    parameters[parameter[0]] = parameter[1]
 
             createschema = parameters.get('createschema', False)
-            keepdata = parameters.get('keepdata', False)
+            keepdata = not parameters.get('cleardata', False)
 
             self.testsaver = TestSaver(filename, createschema,
                                         keepdata)
@@ -160,11 +160,19 @@ class PartRepo(Repository):
             if part.tracking == serialnumber:
                 return part
 
-    def getlastserialnumber(self, partmodel, batchnumber, pos):
+    def get_last_serial_number(self, partmodel, batchnumber, pos):
         """Retrieve the last serial number from database (if exists...)
         """
-        if hasattr(self.session.db, 'testsaver'):
-            return self.session.db.testsaver.getmaxpartsn(partmodel, batchnumber, pos)
+        if self.session.db.testsaver:
+            return self.session.db.testsaver.get_max_part_sn(
+                partmodel.key, batchnumber, pos)
+
+    def reserve_serial_numbers(self, partmodel, batchnumber, count=1,
+                               pos=None):
+        """Return range of the next count sequences of a batch
+        """
+        return self.session.db.testsaver.reserve_serial_numbers(
+            partmodel.key, batchnumber, count, pos)
 
 
 class ControlPlanRepo(Repository):
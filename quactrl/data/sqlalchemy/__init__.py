@@ -1,9 +1,12 @@
-from sqlalchemy import MetaData, create_engine, and_
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import (MetaData, create_engine, and_, or_, case, cast, func,
+                        select, Integer)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker, selectinload, joinedload
 from quactrl.models.core import Token
 from quactrl.models.hhrr import Person, Role
 from quactrl.models.operations import Operation, Step, Location
-from quactrl.models.quality import Mode, ControlPlan
+from quactrl.models.quality import Mode, ControlPlan, Control, FailureMode
 from quactrl.models.devices import Device, DeviceModel
 from quactrl.models.products import (Requirement, Element, Attribute,
                                      PartModel, PartGroup, Characteristic, Part)
@@ -13,7 +16,7 @@ metadata = MetaData()
 
 
 class Db:
-    def __init__(self, connection_string):
+    def __init__(self, connection_string, cache_ttl=60):
         if connection_string[:6] == 'sqlite':
             connect_args={'check_same_thread': False}
             kwargs = {}
@@ -29,12 +32,64 @@ class Db:
         from quactrl.data.sqlalchemy.mappers import load_all_mappers
         load_all_mappers()
 
+        # master data got by key is shared by sessions of all threads
+        from quactrl.data.sqlalchemy.cache import KeyCache
+        self.cache = KeyCache(cache_ttl) if cache_ttl else None
+        self._Session = sessionmaker(bind=self.engine, autoflush=False,
+                                     info={'cache': self.cache})
+        if self.cache:
+            event.listen(self._Session, 'after_flush', self.cache.on_flush)
+
+        # current stock is written on the same transaction as tokens
+        from quactrl.data.sqlalchemy import stock
+        self._stock = stock
+        event.listen(self._Session, 'after_flush', stock.update_stock)
+
+        # and sampling states on the same transaction as tests
+        from quactrl.data.sqlalchemy import sampling
+        event.listen(self._Session, 'after_flush',
+                     sampling.save_sampling_states)
+
+        self.migrate()
+
     @property
     def Session(self):
-        return sessionmaker(bind=self.engine, autoflush=False)
+        return self._Session
 
     def create_schema(self):
+        has_stock = self.engine.has_table('stock')
         metadata.create_all()
+        if not has_stock:  # Database of a previous version
+            self.rebuild_stock()
+
+    def migrate(self):
+        """Create tables missing on databases of previous versions,
+        a new stock is rebuilt from token history
+        """
+        if not self.engine.has_table('token'):  # Schema not created yet
+            return
+        from quactrl.data.sqlalchemy.tables import (sampling_state,
+                                                    serial_counter, journal)
+        for table in (serial_counter, sampling_state, journal):
+            table.create(self.engine, checkfirst=True)
+        if not self.engine.has_table('stock'):
+            self.rebuild_stock()
+
+    def rebuild_stock(self):
+        """Rebuild current stock from token history, creating its table if
+        missing
+        """
+        from quactrl.data.sqlalchemy.tables import stock
+        with self.engine.begin() as connection:
+            stock.create(connection, checkfirst=True)
+            self._stock.rebuild_stock(connection)
+
+    def check_stock(self):
+        """Return rows missing on current stock and rows of current stock
+        not found on token history
+        """
+        with self.engine.connect() as connection:
+            return self._stock.check_stock(connection)
 
     def drop_all(self):
         metadata.drop_all()
@@ -54,6 +109,12 @@ class KeyRepo(Repository):
         self.RepoClass = RepoClass
 
     def get(self, key):
+        cache = self.session.info.get('cache')
+        if cache is not None:
+            return cache.get(self.session, self.RepoClass, key, self._load)
+        return self._load(key)
+
+    def _load(self, key):
         resource = self.session.query(self.RepoClass).filter(self.RepoClass.key==key).first()
         if resource is None:
             raise KeyError('resource with key "{}" is not found'.format(key))
@@ -119,9 +180,15 @@ class DeviceRepo(Repository):
         super().__init__(session)
 
     def get_all_from(self, location_key):
-        location = self.session.query(Location).filter(Location.key == location_key).one()
-        results =  self.session.query(Device, Token).filter(Token.node == location).all()
-        return [result[0] for result in results]
+        """Return devices with stock on a location, with their models
+        """
+        from quactrl.data.sqlalchemy.tables import stock
+
+        return self.session.query(Device).join(
+            stock, stock.c.item_id == Device.id
+        ).join(Location, Location.id == stock.c.node_id).filter(
+            and_(Location.key == location_key, stock.c.qty > 0)
+        ).options(joinedload(Device.resource)).all()
 
 
 class PartRepo(Repository):
@@ -137,29 +204,101 @@ class PartRepo(Repository):
     def get_last_serial_number(self, part_model, batch_number, pos):
         """Retrieve the last serial number from database (if exists...)
         """
-        pass
+        result = self.session.query(Part.serial_number).filter(and_(
+            Part.model == part_model,
+            func.substr(Part.serial_number, pos + 1, len(batch_number)) ==
+            batch_number
+            )).order_by(cast(Part.serial_number, Integer).desc()).first()
+        return result[0] if result else None
+
+    def reserve_serial_numbers(self, part_model, batch_number, count=1,
+                               pos=None, retries=3):
+        """Return range of the next count sequences of a batch, they are
+        commited apart from session so they are given only once by all
+        connections. A new counter starts after the last sequence of the
+        batch on serial numbers of parts with batch number at pos (or 0
+        if pos is None)
+        """
+        from quactrl.data.sqlalchemy.tables import serial_counter
+
+        counter = serial_counter.c
+        condition = and_(counter.resource_id == part_model.id,
+                         counter.batch_number == batch_number)
+        engine = self.session.get_bind()
+        for attempt in range(retries):
+            try:
+                with engine.begin() as conn:  # Update locks counter row
+                    updated = conn.execute(serial_counter.update().where(
+                        condition).values(
+                            last_sequence=counter.last_sequence + count))
+                    if updated.rowcount:
+                        last = conn.execute(
+                            select([counter.last_sequence]).where(condition)
+                        ).scalar()
+                    else:
+                        last = self._get_last_sequence(
+                            conn, part_model, batch_number, pos) + count
+                        conn.execute(serial_counter.insert().values(
+                            resource_id=part_model.id,
+                            batch_number=batch_number, last_sequence=last))
+                return range(last - count + 1, last + 1)
+            except IntegrityError:  # Counter created by other connection
+                if attempt == retries - 1:
+                    raise
+
+    def _get_last_sequence(self, conn, part_model, batch_number, pos):
+        if pos is None:
+            return 0
+        start = pos + len(batch_number) + 1
+        query = self.session.query(
+            func.max(cast(func.substr(Part.serial_number, start), Integer))
+        ).filter(and_(
+            Part.model == part_model,
+            func.substr(Part.serial_number, pos + 1, len(batch_number)) ==
+            batch_number
+        ))
+        return conn.execute(query.statement).scalar() or 0
+
+
+def _plan_graph():
+    """Loader options of control plans with all they need to be compiled,
+    each level of the graph is loaded with one query
+    """
+    controls = selectinload(ControlPlan.subpaths.of_type(Control))
+    requirements = controls.joinedload(Control.requirement)
+    characteristics = requirements.selectinload(Requirement.characteristic)
+    failure_modes = characteristics.selectinload(Characteristic.failure_modes)
+    return [
+        selectinload(ControlPlan.outputs),
+        requirements.selectinload(Requirement.requirements),
+        characteristics.selectinload(Characteristic.element),
+        characteristics.selectinload(Characteristic.attribute),
+        failure_modes.selectinload(FailureMode.mode)
+    ]
 
 
 class ControlPlanRepo(Repository):
+    def get_all_from(self, location_key):
+        """Return all control plans executed on a location
+        """
+        location = self.session.query(Location).filter(Location.key == location_key).one()
+        return self.session.query(ControlPlan).options(*_plan_graph()).filter(
+            ControlPlan.source == location).all()
+
     def get_by(self, part_model, location):
-        """Return control plan for a part_model on a location
+        """Return control plan for a part_model on a location, a plan for
+        the part model is preferred to the ones of its groups
         """
-        control_plan = self.session.query(ControlPlan).join(ControlPlan.outputs).filter(
+        from quactrl.data.sqlalchemy.tables import resource_link
+
+        groups = select([resource_link.c.from_resource_id]).where(
+            resource_link.c.to_resource_id == part_model.id)
+        return self.session.query(ControlPlan).join(ControlPlan.outputs).filter(
             and_(
                 ControlPlan.source == location,
-                PartModel.key == part_model.key)
-            ).first()
-
-        if control_plan is None:
-            for group in part_model.groups:
-                control_plan = self.session.query(ControlPlan).join(ControlPlan.outputs).filter( and_(
-                    ControlPlan.source == location,
-                    PartGroup.key == group.key)
-                ).first()
-                if control_plan:
-                    return control_plan
-
-        return control_plan
+                or_(PartGroup.id == part_model.id, PartGroup.id.in_(groups)))
+            ).order_by(case([(PartGroup.id == part_model.id, 0)], else_=1)
+            ).options(*_plan_graph()).first()
 
 
 class TestRepo(Repository):
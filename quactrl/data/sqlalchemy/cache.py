@@ -0,0 +1,82 @@
+import threading
+import time
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+
+class KeyCache:
+    """Process wide read-through cache of resources got by key. Detached
+    copies are kept and every session gets its own instance merged from
+    them without any query
+
+    ttl: seconds a resource is kept before reading it again from database
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.metrics = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._entries = {}  # {(class, key): (copy, expires_on)}
+        self._keys = {}  # {identity key: (class, key)}
+        self._lock = threading.Lock()
+
+    @property
+    def hit_ratio(self):
+        total = self.metrics['hits'] + self.metrics['misses']
+        return self.metrics['hits'] / total if total else 0.0
+
+    def get(self, session, cls, key, load):
+        """Return resource of session, load(key) is called on a miss
+        """
+        entry = self._entries.get((cls, key))
+        if entry is not None and entry[1] > time.monotonic():
+            copy = entry[0]
+            identity = inspect(copy).key
+            obj = session.identity_map.get(identity)
+            state = inspect(obj) if obj is not None else None
+            # Expired instances are refreshed, changed ones are kept
+            if state is None or (state.expired_attributes and
+                                 not state.modified):
+                obj = session.merge(copy, load=False)
+            with self._lock:
+                self.metrics['hits'] += 1
+            return obj
+
+        obj = load(key)
+        with self._lock:
+            self.metrics['misses'] += 1
+        self._put(cls, key, obj)
+        return obj
+
+    def _put(self, cls, key, obj):
+        if not self.ttl or inspect(obj).modified:
+            return  # Only clean copies can be merged without loading
+        copier = Session()
+        copy = copier.merge(obj, load=False)
+        copier.close()  # Detaches copy
+        with self._lock:
+            self._entries[(cls, key)] = (copy, time.monotonic() + self.ttl)
+            self._keys[inspect(copy).key] = (cls, key)
+
+    def invalidate(self, cls=None, key=None):
+        """Drop cached resources, all of them, all of a class or only one
+        """
+        with self._lock:
+            for cache_key in list(self._entries):
+                if cls is not None and not issubclass(cache_key[0], cls):
+                    continue
+                if key is not None and cache_key[1] != key:
+                    continue
+                self._drop(cache_key)
+
+    def on_flush(self, session, flush_context):
+        """Drop cached copies of resources changed by a flush
+        """
+        with self._lock:
+            for obj in list(session.dirty) + list(session.deleted):
+                cache_key = self._keys.get(inspect(obj).key)
+                if cache_key is not None:
+                    self._drop(cache_key)
+
+    def _drop(self, cache_key):
+        copy, _ = self._entries.pop(cache_key)
+        self._keys.pop(inspect(copy).key, None)
+        self.metrics['invalidations'] += 1
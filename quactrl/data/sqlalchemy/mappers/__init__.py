@@ -1,5 +1,23 @@
+import importlib
+import sys
+from sqlalchemy.orm import clear_mappers
+
+
+MAPPERS = ['core', 'hhrr', 'products', 'operations', 'quality', 'devices']
+
+
 def load_all_mappers():
-    mappers = ['core' ,'hhrr', 'products', 'operations', 'quality', 'devices']
+    """Map all models once, a load broken halfway is undone so classes are
+    not left partially mapped for the next one
+    """
     # Without this order the loading cracks...
-    for mapper in mappers:
-        _ = __import__('quactrl.data.sqlalchemy.mappers.{}'.format(mapper))
+    try:
+        for mapper in MAPPERS:
+            importlib.import_module(
+                'quactrl.data.sqlalchemy.mappers.{}'.format(mapper))
+    except Exception:
+        clear_mappers()
+        for mapper in MAPPERS:
+            sys.modules.pop(
+                'quactrl.data.sqlalchemy.mappers.{}'.format(mapper), None)
+        raise
@@ -1,3 +1,4 @@
+from sqlalchemy import event
 from sqlalchemy.orm import mapper, relationship, synonym
 from sqlalchemy.orm.collections import attribute_mapped_collection
 import quactrl.models.core as core
@@ -54,3 +55,15 @@ mapper(op.Step, inherits=core.Path,
            'source': synonym('from_node'),
            'destination': synonym('to_node')
        })
+
+
+@event.listens_for(core.Path.method_pars, 'set', propagate=True)
+@event.listens_for(core.Path.method_pars, 'modified', propagate=True)
+@event.listens_for(core.Path.method_name, 'set', propagate=True)
+@event.listens_for(core.Path.subpaths, 'append', propagate=True)
+@event.listens_for(core.Path.subpaths, 'remove', propagate=True)
+def expire_plans(path, *args):
+    """Compiled execution plans are discarded when routes change
+    """
+    path.__dict__.pop('_method', None)
+    op.ExecutionPlan.expire(path)
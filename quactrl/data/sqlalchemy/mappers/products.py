@@ -1,7 +1,9 @@
+from sqlalchemy import event
 from sqlalchemy.orm import mapper, relationship, synonym
 from sqlalchemy.orm.collections import attribute_mapped_collection
 import quactrl.models.products as products
 import quactrl.models.core as core
+import quactrl.models.operations as operations
 import quactrl.models.quality as quality
 import quactrl.data.sqlalchemy.tables as tables
 
@@ -55,6 +57,15 @@ mapper(products.Requirement, inherits=core.Resource,
 )
 
 
+@event.listens_for(products.Requirement.pars, 'modified')
+def invalidate_requirement(requirement, initiator):
+    """Compiled specs of requirement and execution plans using it are
+    discarded when pars change in place
+    """
+    requirement.invalidate()
+    operations.ExecutionPlan.expire(requirement)
+
+
 mapper(products.Characteristic, inherits=core.Resource,
        polymorphic_identity='characteristic',
        properties={
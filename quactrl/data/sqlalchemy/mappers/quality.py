@@ -1,3 +1,4 @@
+from sqlalchemy import event
 from sqlalchemy.orm import mapper, synonym, relationship, backref
 import quactrl.models.core as core
 import quactrl.models.quality as qua
@@ -32,6 +33,19 @@ mapper(qua.Subject, inherits=core.UnitaryItem,
        })
 
 
+def _drop_index(name):
+    def drop_index(subject, item, initiator):
+        """Tracking index of list is rebuilt when an item is removed
+        """
+        subject.__dict__.pop('_{}_index'.format(name), None)
+    return drop_index
+
+
+for name in ('measurements', 'defects'):
+    event.listen(getattr(qua.Subject, name), 'remove', _drop_index(name),
+                 propagate=True)
+
+
 mapper(prod.Part, inherits=qua.Subject,
        polymorphic_identity='part',
        properties={
@@ -80,5 +94,14 @@ mapper(qua.Control, inherits=op.Step,
            'control_plan': synonym('parent'),
            'requirement': relationship(prod.Requirement,
                                        secondary=tables.path_resource,
-                                       uselist=False)
+                                       uselist=False),
+           'sampling_states': relationship(qua.SamplingState, viewonly=True)
+       })
+
+
+# Sampling states are written by tests flushed, see sampling module
+mapper(qua.SamplingState, tables.sampling_state,
+       properties={
+           'control': relationship(qua.Control, viewonly=True),
+           'location': relationship(op.Location, viewonly=True)
        })
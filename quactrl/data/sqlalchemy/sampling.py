@@ -0,0 +1,47 @@
+"""Sampling state of controls by location, kept by tests and written on
+their transaction
+"""
+from sqlalchemy import and_, or_
+from quactrl.models.quality import Check, Test
+from quactrl.data.sqlalchemy.tables import sampling_state
+
+
+def _get_tests(session):
+    """Tests flushed with sampling states, the last implemented the last
+    """
+    tests = set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Check):
+            obj = obj.test
+        if isinstance(obj, Test) and getattr(obj, 'sampling_states', None):
+            tests.add(obj)
+    return sorted(tests, key=lambda test: test.id)
+
+
+def _get_id(obj):
+    """Id of object of a sampling key, it can be persisted by this flush
+    """
+    return obj if obj is None or isinstance(obj, int) else obj.id
+
+
+def save_sampling_states(session, flush_context):
+    """Write sampling states kept by tests flushed by session
+    """
+    rows = {}
+    for test in _get_tests(session):
+        for (control, location), state in list(test.sampling_states.items()):
+            key = (_get_id(control), _get_id(location))
+            if None not in key:
+                rows[key] = state
+        test.sampling_states.clear()
+    if not rows:
+        return
+
+    connection = session.connection()
+    connection.execute(sampling_state.delete().where(or_(*[
+        and_(sampling_state.c.path_id == path_id,
+             sampling_state.c.node_id == node_id)
+        for path_id, node_id in rows])))
+    connection.execute(sampling_state.insert(), [
+        {'path_id': path_id, 'node_id': node_id, 'state': state}
+        for (path_id, node_id), state in rows.items()])
@@ -0,0 +1,71 @@
+"""Current stock of items by node, a copy of current tokens with qty kept
+on the same transaction that changes tokens
+"""
+from sqlalchemy import and_, or_, select, inspect
+from quactrl.models.core import Token
+from quactrl.data.sqlalchemy.tables import stock, token
+
+
+_CHUNK = 200  # Pairs by statement, below expression depth of sqlite
+
+
+def _current_tokens(condition=None):
+    columns = token.c
+    where = and_(columns.current == True, columns.qty != 0)
+    if condition is not None:
+        where = and_(where, condition)
+    return select([columns.item_id, columns.node_id, columns.qty,
+                   columns.id]).where(where)
+
+
+def _get_pairs(session):
+    """(item id, node id) of tokens changed on a flush, before and after
+    """
+    pairs = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Token):
+            continue
+        state = inspect(obj)
+        item_ids, node_ids = (
+            {getattr(obj, name)} | set(state.attrs[name].history.deleted)
+            for name in ('item_id', 'node_id'))
+        pairs.update((item_id, node_id) for item_id in item_ids
+                     for node_id in node_ids
+                     if item_id is not None and node_id is not None)
+    return pairs
+
+
+def update_stock(session, flush_context):
+    """Refresh stock of items and nodes of tokens flushed by session
+    """
+    pairs = sorted(_get_pairs(session))
+    connection = session.connection()
+    for index in range(0, len(pairs), _CHUNK):
+        chunk = pairs[index:index + _CHUNK]
+        connection.execute(stock.delete().where(or_(*[
+            and_(stock.c.item_id == item_id, stock.c.node_id == node_id)
+            for item_id, node_id in chunk])))
+        connection.execute(stock.insert().from_select(
+            ['item_id', 'node_id', 'qty', 'token_id'],
+            _current_tokens(or_(*[
+                and_(token.c.item_id == item_id, token.c.node_id == node_id)
+                for item_id, node_id in chunk]))
+        ))
+
+
+def rebuild_stock(connection):
+    """Replace stock by the one of token history
+    """
+    connection.execute(stock.delete())
+    connection.execute(stock.insert().from_select(
+        ['item_id', 'node_id', 'qty', 'token_id'], _current_tokens()))
+
+
+def check_stock(connection):
+    """Compare stock with token history, returns rows missing on stock
+    and rows of stock not found on history
+    """
+    expected = set(tuple(row) for row in connection.execute(_current_tokens()))
+    actual = set(tuple(row) for row in connection.execute(select([
+        stock.c.item_id, stock.c.node_id, stock.c.qty, stock.c.token_id])))
+    return sorted(expected - actual), sorted(actual - expected)
@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy import (Table, MetaData, Column, Integer, String, ForeignKey,
-                        DateTime, Float, Boolean, UniqueConstraint)
+                        DateTime, Float, Boolean, UniqueConstraint, Index)
 from .types import JsonEncodedDict
 from quactrl.data.sqlalchemy import metadata
 
@@ -91,3 +91,35 @@ token = Table(
 item_link = Table('item_link', metadata,
                   Column('from_item_id', Integer, ForeignKey('item.id')),
                   Column('to_item_id', Integer, ForeignKey('item.id')))
+
+
+serial_counter = Table('serial_counter', metadata,
+                       Column('resource_id', Integer, ForeignKey('resource.id'),
+                              primary_key=True),
+                       Column('batch_number', String(50), primary_key=True),
+                       Column('last_sequence', Integer, nullable=False))
+
+
+sampling_state = Table(
+    'sampling_state', metadata,
+    Column('path_id', Integer, ForeignKey('path.id'), primary_key=True),
+    Column('node_id', Integer, ForeignKey('node.id'), primary_key=True),
+    Column('state', JsonEncodedDict)
+)
+
+
+journal = Table(
+    'journal', metadata,
+    Column('name', String(255), primary_key=True),
+    Column('sequence', Integer, nullable=False)
+)
+
+
+stock = Table(
+    'stock', metadata,
+    Column('item_id', Integer, ForeignKey('item.id'), primary_key=True),
+    Column('node_id', Integer, ForeignKey('node.id'), primary_key=True),
+    Column('qty', Float),
+    Column('token_id', Integer, ForeignKey('token.id')),
+    Index('ix_stock_node_item', 'node_id', 'item_id')
+)
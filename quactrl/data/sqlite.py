@@ -1,44 +1,172 @@
 import os.path
 import sqlite3
+import threading
+
+
+if sqlite3.sqlite_version_info >= (3, 35):  # Upsert returning id
+    _UPSERT_PART = (
+        'insert into Parts (id, part_number, serial_number) values (?, ?, ?) '
+        'on conflict (part_number, serial_number) '
+        'do update set serial_number=excluded.serial_number returning id'
+    )
+else:
+    _UPSERT_PART = None
 
 
 class TestSaver:
-    def __init__(self, file_name=':memory:', create_schema=False, keep_data=False):
+    SCHEMA_VERSION = 2  # Stored as user_version pragma of database
+    _INSERTS = {
+        'Tests': ('insert into Tests '
+                  '(id, fk_part, started_on, finished_on, responsible_key, state, cavity) '
+                  'values (?, ?, ?, ?, ?, ?, ?)'),
+        'Actions': ('insert into Actions '
+                    '(id, fk_test, started_on, finished_on, description, state) '
+                    'values (?, ?, ?, ?, ?, ?)'),
+        'Measurements': ('insert into Measurements '
+                         '(id, fk_check, char_key, tracking, value) '
+                         'values (?, ?, ?, ?, ?)'),
+        'Defects': ('insert into Defects '
+                    '(id, fk_check, failure_key, tracking) '
+                    'values (?, ?, ?, ?)'),
+    }
+
+    def __init__(self, file_name=':memory:', create_schema=False, keep_data=True,
+                 journal_mode='WAL'):
         """Test saver using sqlite database(to be obsolete)
+
+        keep_data: data of an existing database is only deleted when False,
+            serial counters included
         """
+        exists = os.path.exists(file_name)  # connect creates the file
         self.conn = sqlite3.connect(file_name, check_same_thread=False)
+        self._lock = threading.Lock()
         self.c = self.conn.cursor()
-        if os.path.exists(file_name):
+        if exists:
             if create_schema:
                 self.create_schema()
+            else:
+                self.migrate()
             if not keep_data:
                 self.clear()
         else:
             self.create_schema()
 
+        if journal_mode:  # WAL lets readers work while a test is written
+            self.conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+
     def save(self, test):
-        self.c = self.conn.cursor()
-        part = self.upsert_part(test.part)
-        self.insert_test(test)
-        for action in test.actions:
-            if action.__class__.__name__ == 'Check':
-                check = action
-                self.insert_check(check)
-                for measurement in check.measurements:
-                    self.insert_measurement(measurement, check)
-                for defect in check.defects:
-                    self.insert_defect(defect, check)
-            else:
-                self.insert_action(action)
-        self.conn.commit()
+        self.save_all([test])
+
+    def save_all(self, tests):
+        """Save tests in one transaction, ids are assigned in bulk and rows
+        of each table are inserted with one executemany
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')  # Nobody else takes ids
+            try:
+                ids = self._insert_all(cursor, tests)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+        for obj, id in ids:
+            obj._id = id
+
+    def _insert_all(self, cursor, tests):
+        ids = []
+        rows = {'Parts': [], 'Tests': [], 'Actions': [],
+                'Measurements': [], 'Defects': []}
+        next_ids = {table: self._get_next_id(cursor, table) for table in rows}
+
+        def add(table, obj, values):
+            id = next_ids[table]
+            next_ids[table] += 1
+            rows[table].append((id,) + values)
+            ids.append((obj, id))
+            return id
+
+        part_ids = {}
+        for test in tests:
+            part = test.part
+            key = (part.model.key, part.serial_number)
+            if key not in part_ids:
+                part_ids[key] = self._upsert_part(cursor, key, next_ids)
+            ids.append((part, part_ids[key]))
+
+            test_id = add('Tests', test, (
+                part_ids[key], test.started_on, test.finished_on,
+                test.responsible.key, test.state, test.cavity
+            ))
+            for action in test.actions:
+                if action.__class__.__name__ == 'Check':
+                    check = action
+                    check_id = add('Actions', check, (
+                        test_id, check.started_on, check.finished_on,
+                        check.control.requirement.description, check.state
+                    ))
+                    for measurement in check.measurements:
+                        add('Measurements', measurement, (
+                            check_id, measurement.characteristic.key,
+                            measurement.tracking, measurement.value
+                        ))
+                    for defect in check.defects:
+                        add('Defects', defect, (
+                            check_id, defect.failure_mode.key, defect.tracking
+                        ))
+                else:
+                    add('Actions', action, (
+                        test_id, action.started_on, action.finished_on,
+                        action.step.method_name, action.state
+                    ))
+
+        for table, sql in self._INSERTS.items():
+            if rows[table]:
+                cursor.executemany(sql, rows[table])
+        return ids
+
+    def _upsert_part(self, cursor, key, next_ids=None):
+        """Return id of part with key, inserting it with next id of Parts
+        (or an autoincremented one) if it does not exist
+        """
+        id = next_ids['Parts'] if next_ids else None
+        if _UPSERT_PART:
+            cursor.execute(_UPSERT_PART, (id,) + key)
+            part_id = cursor.fetchone()[0]
+        else:
+            cursor.execute(
+                'insert or ignore into Parts (id, part_number, serial_number) '
+                'values (?, ?, ?)', (id,) + key
+            )
+            cursor.execute(
+                'select id from Parts where part_number=? and serial_number=?',
+                key
+            )
+            part_id = cursor.fetchone()[0]
+        if next_ids and part_id == id:
+            next_ids['Parts'] += 1
+        return part_id
+
+    def _get_next_id(self, cursor, table):
+        """First id not used by table, deleted ids are not reused as with
+        autoincrement
+        """
+        cursor.execute('select seq from sqlite_sequence where name=?', (table,))
+        result = cursor.fetchone()
+        cursor.execute('select max(id) from {}'.format(table))
+        return max(result[0] if result else 0, cursor.fetchone()[0] or 0) + 1
 
     def create_schema(self):
         try:
 
             self.c.execute("select * from Parts where id=0")
-            return
         except Exception:
             pass
+        else:
+            self.migrate()
+            return
 
         self.c.execute(
             """
@@ -100,31 +228,93 @@ class TestSaver:
         )
 
         self.conn.commit()
+        self.migrate()
 
-    def clear(self):
-        self.c.execute('DELETE * FROM Measurements')
-        self.c.execute('DELETE * FROM Defects')
-        self.c.execute('DELETE * FROM Actions')
-        self.c.execute('DELETE * FROM Tests')
-        self.c.execute('DELETE * FROM Parts')
-        self.conn.commit()
+    def migrate(self):
+        """Upgrade schema of a database created by an older version
+        """
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
 
-    def upsert_part(self, part):
-        self.c.execute(
-            'select id from Parts where part_number=? and serial_number=?',
-            (part.model.key, part.serial_number)
+        with self._lock:
+            cursor = self.conn.cursor()
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            try:
+                if version < 1:
+                    self._migrate_to_unique_parts(cursor)
+                if version < 2:
+                    self._migrate_to_serial_counters(cursor)
+                cursor.execute('PRAGMA user_version={}'.format(
+                    self.SCHEMA_VERSION))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _migrate_to_unique_parts(self, cursor):
+        """Merge repeated parts on the first one and index lookups of
+        parts and children rows
+        """
+        cursor.execute(
+            """
+            update Tests set fk_part = (
+                select min(p.id) from Parts p join Parts q
+                on p.part_number=q.part_number and p.serial_number=q.serial_number
+                where q.id=Tests.fk_part)
+            where fk_part not in (
+                select min(id) from Parts group by part_number, serial_number)
+            """
+        )
+        cursor.execute(
+            """
+            delete from Parts where id not in (
+                select min(id) from Parts group by part_number, serial_number)
+            """
+        )
+        cursor.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_parts_number '
+            'ON Parts (part_number, serial_number)'
         )
-        result = self.c.fetchone()
-        id = result[0] if result else None
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS ix_tests_part ON Tests (fk_part)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS ix_actions_test ON Actions (fk_test)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS ix_measurements_check '
+            'ON Measurements (fk_check)'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS ix_defects_check ON Defects (fk_check)')
 
-        if not id:
-            self.c.execute(
-                'insert into Parts (part_number, serial_number) values (?, ?)',
-                (part.model.key, part.serial_number)
+    def _migrate_to_serial_counters(self, cursor):
+        """Last sequence given by part number and batch number
+        """
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS 'SerialCounters'
+            (
+            'part_number' TEXT,
+            'batch_number' TEXT,
+            'last_sequence' INTEGER NOT NULL,
+            PRIMARY KEY ('part_number', 'batch_number')
             )
-            id = self.c.lastrowid
+            """
+        )
+
+    def clear(self):
+        self.c.execute('DELETE FROM Measurements')
+        self.c.execute('DELETE FROM Defects')
+        self.c.execute('DELETE FROM Actions')
+        self.c.execute('DELETE FROM Tests')
+        self.c.execute('DELETE FROM Parts')
+        self.c.execute('DELETE FROM SerialCounters')
+        self.conn.commit()
 
-        part._id = id
+    def upsert_part(self, part):
+        part._id = self._upsert_part(
+            self.c, (part.model.key, part.serial_number))
 
     def insert_test(self, test):
         self.c.execute(
@@ -177,6 +367,52 @@ class TestSaver:
         )
         defect._id = self.c.lastrowid
 
+    def reserve_serial_numbers(self, part_number, batch_number, count=1,
+                               pos=None):
+        """Return range of the next count sequences of a batch, they are
+        given only once by all connections to the database. A new counter
+        starts after the last sequence of the batch on serial numbers of
+        parts with batch number at pos (or 0 if pos is None)
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')  # Other processes wait
+            try:
+                cursor.execute(
+                    'update SerialCounters set last_sequence=last_sequence+? '
+                    'where part_number=? and batch_number=?',
+                    (count, part_number, batch_number)
+                )
+                if cursor.rowcount:
+                    cursor.execute(
+                        'select last_sequence from SerialCounters '
+                        'where part_number=? and batch_number=?',
+                        (part_number, batch_number)
+                    )
+                    last = cursor.fetchone()[0]
+                else:
+                    last = self._get_last_sequence(
+                        part_number, batch_number, pos) + count
+                    cursor.execute(
+                        'insert into SerialCounters values (?, ?, ?)',
+                        (part_number, batch_number, last)
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+        return range(last - count + 1, last + 1)
+
+    def _get_last_sequence(self, part_number, batch_number, pos):
+        if pos is None:
+            return 0
+        serial_number = self.get_max_part_sn(part_number, batch_number, pos)
+        if not serial_number:
+            return 0
+        return int(serial_number[pos + len(batch_number):] or 0)
+
     def get_max_part_sn(self, part_number, batch_number, pos):
         sql = """
         select
@@ -1,19 +1,55 @@
 import importlib
+import threading
 from ruamel.yaml import YAML
 
 
 yaml = YAML(typ='safe')
 
 
+class Resolver:
+    """Registry of components resolved by full module path
+    """
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.Lock()
+
+    def get(self, component_name):
+        try:
+            return self._components[component_name]
+        except KeyError:
+            component = _get(component_name)
+            with self._lock:
+                self._components[component_name] = component
+            return component
+
+    def prewarm(self, component_names):
+        """Resolve components in advance, returns errors by component name
+        """
+        errors = {}
+        for component_name in component_names:
+            try:
+                self.get(component_name)
+            except (ImportError, AttributeError, ValueError) as e:
+                errors[component_name] = e
+        return errors
+
+    def clear(self):
+        with self._lock:
+            self._components = {}
+
+
+resolver = Resolver()
+
+
 def get_class(full_class_name):
     """Return class by full module path"""
-    return _get(full_class_name)
+    return resolver.get(full_class_name)
 
 
 def get_function(full_function_name):
     """Return function by full module path
     """
-    return _get(full_function_name)
+    return resolver.get(full_function_name)
 
 
 def _get(component_name):
@@ -17,6 +17,45 @@ class Resource:
     pass
 
 
+class Ledger:
+    """Token history of an item with current tokens indexed by node
+    """
+    def __init__(self, history):
+        self.history = history
+        self.current = {}
+        for token in history:
+            if token.current:
+                self.current[token.node] = token
+
+    def get(self, node):
+        return self.current.get(node)
+
+    def post(self, token):
+        """Append token to history as the current one of its node
+        """
+        previous = self.current.get(token.node)
+        if previous is not None:
+            previous.current = False
+        self.history.append(token)
+        self.current[token.node] = token
+
+    def undo(self, flow):
+        """Remove tokens of a flow, last remaining ones become current
+        """
+        undone = [token for token in self.history if token.flow == flow]
+        nodes = set()
+        for token in undone:
+            self.history.remove(token)
+            nodes.add(token.node)
+            if self.current.get(token.node) is token:
+                del self.current[token.node]
+
+        for token in reversed(self.history):
+            if token.node in nodes and token.node not in self.current:
+                token.current = True
+                self.current[token.node] = token
+
+
 class Item:
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
@@ -25,25 +64,30 @@ class Item:
         self.flow_qty = 0
         self.tokens = []
 
+    @property
+    def ledger(self):
+        """Current tokens by node, rebuilt only when tokens are reloaded
+        """
+        if not hasattr(self, 'tokens'):
+            self.tokens = []
+        if (not hasattr(self, '_ledger')
+                or self._ledger.history is not self.tokens):
+            self._ledger = Ledger(self.tokens)
+        return self._ledger
+
     @property
     def qty(self):
         return sum([token.qty
-                    for token in self.tokens
-                    if token.current])
+                    for token in self.ledger.current.values()])
 
     @property
     def stocks(self):
-        stocks = {}
-        for token in self.tokens:
-            if token.current:
-                stocks[token.node] = token.qty
-
-        return stocks
+        return {node: token.qty
+                for node, token in self.ledger.current.items()
+                if token.qty}
 
     def get_token(self, node):
-        for token in self.tokens:
-            if token.current and token.node == node:
-                return token
+        return self.ledger.get(node)
 
     def update_qty(self, qty, node, flow):
         """Add a qty on a node
@@ -53,22 +97,12 @@ class Item:
         elif qty < 0:
             raise Exception('Quantity should not be negative')
         else:
-            token = self.get_token(node)
-            if token:
-                token.current = False
-
-            new_token = Token(self, node, qty, flow)
-            self.tokens.append(new_token)
+            self.ledger.post(Token(self, node, qty, flow))
 
     def clear(self, node, flow):
         """Empty node from quantity
         """
-        token = self.get_token(node)
-        if token:
-            token.current = False
-        new_token = Token(self, node, 0, flow)
-        token.current = False
-        self.tokens.append(token)
+        self.ledger.post(Token(self, node, 0, flow))
 
     def move(self, from_node, to_node, flow, qty=None):
         token = self.get_token(from_node)
@@ -80,9 +114,7 @@ class Item:
 
     def undo_flow(self, flow):
         "Clear all tokens of a flow"
-        for token in self.tokens:
-            if token.flow == flow:
-                self.tokens.pop(token)
+        self.ledger.undo(flow)
 
 
 class Token:
@@ -110,9 +142,9 @@ class UnitaryItem(Item):
 
     @property
     def location(self):
-        for token in self.tokens:
-            if token.current:
-                return token.node
+        for node, token in self.ledger.current.items():
+            if token.qty:
+                return node
 
 class Path:
     @property
@@ -4,6 +4,7 @@ from quactrl.helpers import get_class
 from threading import Lock
 from types import MethodType
 from .core import Resource
+from .scheduling import DeviceScheduler
 import quactrl.models.quality as qua
 import logging
 
@@ -73,7 +74,7 @@ class MultiplexedDutFactory(DutFactory):
         return self.multiplexor_factory(dut, cavity)
 
 
-class ConnectionProvider(provides.Provider):
+class ConnectionProvider(providers.Provider):
     def __init__(self, Connection, port, *args, **kwargs):
         super().__init__()
         ports = port if type(port) is list else [port]
@@ -85,21 +86,44 @@ class ConnectionProvider(provides.Provider):
         return self._singletons[cavity]()
 
 
+class LockedDevice:
+    """Device whose methods are called holding a lock, so only one caller
+    uses it at a time
+    """
+    def __init__(self, device, lock):
+        self._device = device
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._device, name)
+        if not isinstance(attr, MethodType):
+            return attr
+
+        def method(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return method
+
+
 class DeviceProvider(providers.Provider):
-    """Provider of devices, with tracking attribute inserted
+    """Provider of devices, with tracking attribute inserted. Calls to
+    device methods hold lock, the one of the device on the toolbox
+    scheduler (see DeviceScheduler.get_lock)
     """
-    def __init__(self, Device, *args, **kwargs):
-        "docstring"
-        logger.debug(' Creating device with tracking {}'.format(self.tracking))
-        self.tracking = args.pop(0)
+    def __init__(self, Device, tracking, *args, lock=None, **kwargs):
+        super().__init__()
+        logger.debug(' Creating device with tracking {}'.format(tracking))
+        self.tracking = tracking
+        self.lock = lock if lock else Lock()
         self._singleton = providers.ThreadSafeSingleton(Device, *args,
                                                         **kwargs)
         self._device = None
 
     def __call__(self):
         if not self._device:
-            self._device = self._singleton()
-            self._device.tracking = self.tracking
+            device = self._singleton()
+            device.tracking = self.tracking
+            self._device = LockedDevice(device, self.lock)
 
         return self._device
 
@@ -120,6 +144,7 @@ class Toolbox(containers.DynamicContainer):
         """Receive a list of devices and loads a container of them and subcomponents
         """
         super().__init__()
+        self.scheduler = DeviceScheduler()
         self._devices = {}
         self._load_device_configs(devices)
         for name in self._devices.keys():
@@ -189,6 +214,8 @@ class Toolbox(containers.DynamicContainer):
                 if type(value) is str and value and value[0] == '>':
                     kwargs[key] = self._inject_provider(value[1:])
 
+            if Provider is DeviceProvider:  # Calls share scheduler locks
+                kwargs = dict(kwargs, lock=self.scheduler.get_lock(dev_name))
             setattr(self, dev_name, Provider(DeviceClass, *args, **kwargs))
 
         return getattr(self, dev_name)
@@ -1,13 +1,120 @@
+import bisect
 import datetime
 import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import MappingProxyType
 from quactrl.helpers import get_function
 from .core import Node, Resource, UnitaryItem, Path, Flow, Token
+from .scheduling import DeviceScheduler, DeviceUsage
 
 
 class NotAuthorizedException(Exception):
     pass
 
 
+class PlannedStep(namedtuple('PlannedStep', 'step id method kwargs devices')):
+    __slots__ = ()
+
+    def implement(self, operation):
+        """Return action of step for operation, None if it is not needed
+        """
+        action = self.step.implement(operation)
+        if action:
+            action.planned = self
+        return action
+
+
+class ExecutionPlan:
+    """Flat and immutable view of a route with step methods resolved
+
+    A plan is shared by all operations of its route until the route, its
+    steps or the master data they use change, see expire. Changes made by
+    other processes are not notified, so plans also expire after ttl
+    seconds
+    """
+    ttl = 60
+    _plans = {}  # {key of compiled object: plans depending on it}
+    _plans_lock = threading.Lock()
+    _prune_at = 64  # Size of _plans when keys without plans are pruned
+
+    def __init__(self, route):
+        self.route = route
+        self.compiled_on = time.monotonic()
+        self._expired = False
+        self.depend_on(route)
+        dependencies = route.get_dependencies()
+        self.dependencies = (None if dependencies is None else
+                             tuple(frozenset(step_dependencies)
+                                   for step_dependencies in dependencies))
+        self.steps = tuple(self._plan_step(step) for step in route.steps)
+
+    @property
+    def is_expired(self):
+        return (self._expired or
+                time.monotonic() - self.compiled_on > self.ttl)
+
+    def depend_on(self, obj):
+        """Expire plan when obj changes
+        """
+        with self._plans_lock:
+            for key in self._get_keys(obj):
+                self._plans.setdefault(key, weakref.WeakSet()).add(self)
+            if len(self._plans) > ExecutionPlan._prune_at:
+                self._prune()
+
+    @classmethod
+    def _prune(cls):
+        """Remove keys whose plans have been collected, their ids can be
+        reused by other objects
+        """
+        for key in [key for key, plans in cls._plans.items() if not plans]:
+            del cls._plans[key]
+        ExecutionPlan._prune_at = 2 * len(cls._plans) + 64
+
+    @classmethod
+    def expire(cls, obj):
+        """Expire plans compiled from obj, called when it changes
+        """
+        with cls._plans_lock:
+            for key in cls._get_keys(obj):
+                for plan in cls._plans.pop(key, ()):
+                    plan._expired = True
+
+    @classmethod
+    def expire_all(cls):
+        """Expire all compiled plans
+        """
+        with cls._plans_lock:
+            for plans in cls._plans.values():
+                for plan in plans:
+                    plan._expired = True
+            cls._plans.clear()
+
+    @staticmethod
+    def _get_keys(obj):
+        """Keys of obj, by identity and by id once persisted, so plans
+        expire whatever the session of the changed instance
+        """
+        keys = [id(obj)]
+        obj_id = getattr(obj, 'id', None)
+        if obj_id is not None:
+            keys.append(('path' if isinstance(obj, Path) else 'resource',
+                         obj_id))
+        return keys
+
+    def _plan_step(self, step):
+        self.depend_on(step)
+        kwargs = getattr(step, 'method_kwargs', None)  # Routes have no kwargs
+        return PlannedStep(
+            step, getattr(step, 'id', None), step.method,
+            None if kwargs is None else MappingProxyType(kwargs),
+            tuple(step.devices)
+        )
+
+
 class Location(Node):
     """Site of products
     """
@@ -38,12 +145,27 @@ class Action(Flow):
         """Execute method asociated to route
         """
         if (self.status == 'started'):
-            if self.step.method:
-                self.step.method(self, **self.step.method_pars)
-                if hasattr(self, 'thread'):
-                    self.status = 'ongoing'
-                else:
-                    self.status = 'done'
+            status = self.call_method()
+            if status:
+                self.status = status
+
+    def call_method(self):
+        """Call method of step, returns status of action once called or
+        None if step has no method
+        """
+        if hasattr(self, 'planned'):
+            method, kwargs = self.planned.method, self.planned.kwargs
+        else:
+            method, kwargs = self.step.method, self.step.method_kwargs
+        if method:
+            method(self, **kwargs)
+            return 'ongoing' if hasattr(self, 'thread') else 'done'
+
+    def keep_results(self):
+        """Keep results added by method until action is closed, so it can
+        be called out of the thread of its session
+        """
+        pass
 
     def cancel(self):
         """Cancel execution of operation
@@ -84,32 +206,220 @@ class Operation(Flow):
 
     def walk(self):
         """Execute each child action
+
+        If route steps declare dependencies or devices, actions whose
+        dependencies are finished and devices are free are executed
+        concurrently (see Route.get_dependencies). The plan received on
+        start is used when it belongs to the route
+
+        Devices of the route are reserved on the toolbox scheduler during
+        the walk and the ones of each step while its action runs, nested
+        operations use the devices reserved for them
         """
         self.status = 'walking'
         self.on_action = None
-        for action in self.action_iterator():
+        plan = self.get_plan()
+        scheduler = self.get_scheduler()
+        holders = self.get_holders()
+        if not self._wait_reservation(scheduler, self.route.devices, self,
+                                      holders):
+            return
+        try:
+            if plan.dependencies is None:
+                self._walk_sequentially(plan, scheduler, holders)
+            else:
+                self._walk_concurrently(plan, scheduler, holders)
+        finally:
+            scheduler.release(self.route.devices, self)
+
+        self.status = 'walked'
+
+    def get_scheduler(self):
+        """Return device scheduler of toolbox, shared by all inspectors
+        """
+        toolbox = getattr(self, 'toolbox', None)
+        scheduler = getattr(toolbox, 'scheduler', None)
+        return scheduler if scheduler is not None else DeviceScheduler()
+
+    def get_holders(self):
+        """Return the owners of device reservations this operation runs
+        on behalf of, itself and its parent operations and their actions
+        """
+        holders = []
+        operation = self
+        while isinstance(operation, Operation):
+            holders.append(operation)
+            reservation = getattr(operation, 'reservation', None)
+            if reservation is not None:
+                holders.append(reservation)
+            operation = operation.responsible
+        return holders
+
+    def _wait_reservation(self, scheduler, devices, owner, holders):
+        """Reserve devices as soon as they are released, returns False if
+        operation is cancelled meanwhile
+        """
+        while True:
+            generation = scheduler.generation
+            if scheduler.reserve(devices, owner, holders):
+                return True
+            if self._cancel:
+                return False
+            scheduler.wait_release(generation, self.route.reserve_period)
+
+    def _walk_sequentially(self, plan, scheduler, holders):
+        for action in self.action_iterator(plan):
             if action:  # step could no create operation!
+                devices = action.planned.devices
+                action.reservation = reservation = object()
+                if not self._wait_reservation(scheduler, devices,
+                                              reservation, holders):
+                    break
                 self.on_action = action
                 self.actions.append(action)
-                action.start(**self.inbox)
-                action.execute()
-                if action.status == 'ongoing':
-                    action.thread.join()
-                    if hasattr(action, 'exception'):
-                        # The thread has raised an exception
-                        raise action.exception
-                    action.status = 'done'
-                action.close()
+                try:
+                    self._run_action(action)
+                finally:
+                    scheduler.release(devices, reservation)
             self.on_action = None
 
-        self.status = 'walked'
+    def get_plan(self):
+        plan = getattr(self, 'plan', None)
+        if plan is None or plan.route is not self.route:
+            plan = self.route.compile()
+        return plan
+
+    def _run_action(self, action):
+        action.start(**self.inbox)
+        action.execute()
+        if action.status == 'ongoing':
+            action.thread.join()
+            if hasattr(action, 'exception'):
+                # The thread has raised an exception
+                raise action.exception
+            action.status = 'done'
+        action.close()
+
+    def _walk_concurrently(self, plan, scheduler, holders):
+        """Call methods of ready actions on a pool of threads, actions are
+        kept in step order and the exception of the first failed step is
+        raised once running actions have finished
+
+        Actions are started and closed on the walking thread, so only it
+        changes objects of the session
+
+        An action only starts when the devices of its step are reserved,
+        planned and actual device utilization are reported at utilization
+        attribute
+        """
+        steps = plan.steps
+        dependencies = plan.dependencies
+        pending = list(range(len(steps)))
+        finished = set()
+        positions = []  # Step index of each action
+        running = {}
+        errors = {}
+        self._running = []
+        usage = DeviceUsage()
+        self.utilization = {'planned': scheduler.plan(steps, dependencies)}
+
+        with ThreadPoolExecutor(max_workers=self.route.max_workers) as pool:
+            while pending or running:
+                generation = scheduler.generation
+                ready = [index for index in pending
+                         if dependencies[index] <= finished]
+                if self._cancel or errors:
+                    pending, ready = [], []
+
+                is_blocked = False
+                for index in ready:
+                    devices = steps[index].devices
+                    reservation = object()
+                    if not scheduler.reserve(devices, reservation, holders):
+                        is_blocked = True
+                        continue
+                    pending.remove(index)
+                    action = self._implement(steps[index])
+                    if not action:  # step could no create operation!
+                        scheduler.release(devices, reservation)
+                        finished.add(index)
+                        continue
+                    action.reservation = reservation
+                    position = bisect.bisect(positions, index)
+                    positions.insert(position, index)
+                    if action in self.actions:  # Appended by mapper backref
+                        self.actions.remove(action)
+                    self.actions.insert(position, action)
+                    self.on_action = action
+                    try:
+                        action.start(**self.inbox)
+                    except Exception as e:
+                        scheduler.release(devices, reservation)
+                        finished.add(index)
+                        errors[index] = e
+                        continue
+                    action.keep_results()
+                    self._running.append(action)
+                    future = pool.submit(self._call_scheduled, action,
+                                         scheduler, usage)
+                    running[future] = (index, action)
+
+                timeout = self.route.reserve_period if is_blocked else None
+                if not running:
+                    if is_blocked:  # Devices are used by other operation
+                        scheduler.wait_release(generation, timeout)
+                    continue
+
+                done, _ = wait(running, timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, action = running.pop(future)
+                    self._running.remove(action)
+                    finished.add(index)
+                    try:
+                        status = future.result()
+                        if status and action.status == 'started':
+                            action.status = status
+                        action.close()
+                    except Exception as e:
+                        errors[index] = e
+
+        self.on_action = None
+        self.utilization['actual'] = usage.get_utilization()
+        if errors:
+            raise errors[min(errors)]
 
-    def action_iterator(self):
-        for step in self.route.steps:
+    def _call_scheduled(self, action, scheduler, usage):
+        """Call method of a started action on a pool thread, returns its
+        status once finished
+        """
+        devices = action.planned.devices
+        started_on = time.time()
+        try:
+            if action.status != 'started':
+                return None
+            status = action.call_method()
+            if status == 'ongoing':
+                action.thread.join()
+                if hasattr(action, 'exception'):
+                    raise action.exception
+                status = 'done'
+            return status
+        finally:
+            duration = time.time() - started_on
+            usage.add(devices, duration)
+            scheduler.release(devices, action.reservation)
+            scheduler.record(action.planned, duration)
+
+    def action_iterator(self, plan=None):
+        plan = plan if plan else self.get_plan()
+        for planned in plan.steps:
             if self._cancel:
                 break
             else:
-                yield step.implement(self)
+                yield self._implement(planned)
+
+    def _implement(self, planned):
+        return planned.implement(self)
 
     def cancel(self):
         """Cancel execution of operation
@@ -120,6 +430,9 @@ class Operation(Flow):
             self._cancel = True
         if self.on_action:
             self.on_action.cancel()
+        for action in list(getattr(self, '_running', [])):
+            if action is not self.on_action:
+                action.cancel()
         self.status = 'cancelled'
         self.finished_on = datetime.datetime.now()
 
@@ -134,6 +447,9 @@ class Operation(Flow):
 class Route(Path):
     """Planning of an operation over resources
     """
+    max_workers = 4  # Threads for concurrent steps of an operation
+    reserve_period = 0.05  # Seconds between retries of blocked reservations
+
     def __init__(self, role, source=None, destination=None,
                  outputs=None, parent=None,
                  method_name=None, method_pars=None):
@@ -166,16 +482,97 @@ class Route(Path):
         """
         return (responsible == self.role) or (self.role in responsible.roles)
 
+    @property
+    def devices(self):
+        """Names of toolbox devices used exclusively by the route
+        """
+        return self.method_pars.get('devices', [])
+
+    def compile(self):
+        """Return a new execution plan of the route
+        """
+        return ExecutionPlan(self)
+
+    def get_component_names(self):
+        """Full module paths of the methods used by route and its steps
+        """
+        method_name = getattr(self, 'method_name', None)
+        names = {method_name} if method_name else set()
+        for step in self.steps:
+            names |= step.get_component_names()
+        return names
+
+    def get_dependencies(self):
+        """Return, for each step, the set of step indexes it depends on
+
+        A step depends on the previous one unless it declares the sequences
+        of the steps it depends on at method_pars['depends_on'] (an empty
+        list for an independent step). Steps declaring devices at
+        method_pars['devices'] only depend on the last step without devices,
+        which waits for all of them. If no step declares dependencies or
+        devices returns None, the route is sequential
+        """
+        indexes = {step.sequence: index
+                   for index, step in enumerate(self.steps)}
+        dependencies = []
+        is_sequential = True
+        barrier = None  # Last step without devices
+        device_steps = set()  # Steps with devices after barrier
+        for index, step in enumerate(self.steps):
+            depends_on = step.method_pars.get('depends_on')
+            if depends_on is not None:
+                is_sequential = False
+                step_dependencies = {indexes[sequence]
+                                     for sequence in depends_on}
+                if step_dependencies and max(step_dependencies) >= index:
+                    raise ValueError(
+                        'Step {} can only depend on previous steps'.format(
+                            step.sequence)
+                    )
+            elif step.devices:
+                is_sequential = False
+                step_dependencies = set() if barrier is None else {barrier}
+            else:
+                step_dependencies = {index - 1} if index else set()
+                step_dependencies |= device_steps
+            dependencies.append(step_dependencies)
+
+            if step.devices:
+                device_steps.add(index)
+            else:
+                barrier = index
+                device_steps = set()
+
+        return None if is_sequential else dependencies
+
 
 class Step(Path):
     """Planning of a sub action for a Route
     """
+    _control_pars = ('depends_on', 'devices')
+
     def __init__(self, route, method_name, method_pars):
         self.route = route
         self.sequence = 0 if not route.steps else route.steps[-1].sequence + 5
         self.method_name = method_name
         self.method_pars = method_pars if method_pars else {}
 
+    @property
+    def devices(self):
+        """Names of toolbox devices used exclusively by the step
+        """
+        return self.method_pars.get('devices', [])
+
+    @property
+    def method_kwargs(self):
+        """Parameters passed to method on execution
+        """
+        return {key: value for key, value in self.method_pars.items()
+                if key not in self._control_pars}
+
+    def get_component_names(self):
+        return {self.method_name} if self.method_name else set()
+
     def implement(self, operation):
         return Action(operation, self, operation.update)
 
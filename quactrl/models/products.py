@@ -88,8 +88,82 @@ class Requirement(Resource):
 
     @property
     def eid(self):
-        result = re.findall('.*>(.*)', self.key)
-        return result[0] if result else ''
+        self._compile_key()
+        return self._eid
+
+    @property
+    def requi_key(self):
+        """Key of defects and measurements tracking this requirement
+        """
+        self._compile_key()
+        return self._requi_key
+
+    def get_tracking(self, mode_key=None, index=None):
+        """Return tracking (without subject) of a measurement of requirement
+        or, if mode_key, of a defect
+        """
+        self._compile_key()
+        if mode_key is None:
+            tracking = self._tracking
+        else:
+            tracking = self._mode_trackings.get(mode_key)
+            if tracking is None:
+                failure_mode = self.characteristic.failure_modes[mode_key]
+                tracking = failure_mode.key + self._eid_sufix
+                self._mode_trackings[mode_key] = tracking
+
+        if index is not None:
+            tracking += '_{:02d}'.format(index)
+        return tracking
+
+    def _compile_key(self):
+        """Compile eid and trackings once for each key
+        """
+        key = self.key
+        if getattr(self, '_compiled_key', None) is key:
+            return
+
+        result = re.findall('.*>(.*)', key)
+        self._eid = result[0] if result else ''
+        self._eid_sufix = '>{}'.format(self._eid) if self._eid else ''
+        char_key = self.characteristic.key
+        self._requi_key = (char_key, self._eid)
+        self._tracking = char_key + self._eid_sufix
+        self._mode_trackings = {}
+        self._compiled_key = key
+
+    @property
+    def evaluator(self):
+        """Specs compiled for evaluating values, compiled again when specs
+        are replaced
+        """
+        specs = self.specs
+        evaluator = getattr(self, '_evaluator', None)
+        if evaluator is None or evaluator.specs is not specs:
+            evaluator = qua.SpecsEvaluator(specs,
+                                           self.characteristic.failure_modes)
+            self._evaluator = evaluator
+        return evaluator
+
+    def invalidate(self):
+        """Discard compiled state, needed when specs are modified in place
+        """
+        for name in ('_compiled_key', '_evaluator'):
+            self.__dict__.pop(name, None)
+
+    @property
+    def subtree_keys(self):
+        """Requi keys of requirement and all its sub requirements, walked on
+        each call because any requirement of the tree can gain children.
+        Execution plans keep them from compile time
+        """
+        keys = []
+        pending = [self]
+        while pending:
+            requirement = pending.pop()
+            keys.append(requirement.requi_key)
+            pending.extend(requirement.requirements.values())
+        return keys
 
     @property
     def description(self):
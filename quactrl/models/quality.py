@@ -1,78 +1,357 @@
 import datetime
+import logging
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+import numpy as np
 from quactrl.helpers import get_function
 from quactrl.models.core import Item, Resource, UnitaryItem, Token
 import quactrl.models.operations as op
 
 
+logger = logging.getLogger(__name__)
+
+
 class DefectFound(Exception):
     pass
 
 
+class ReactionDispatcher:
+    """Delivery of reactions to nok checks on background workers
+
+    The queue is bounded, when it's full the reaction is executed by the
+    caller. Blocking reactions are always executed by the caller and their
+    exceptions are raised.
+
+    Reactions get a detached snapshot of the check (see Check.snapshot),
+    never session objects, so they load what they need on a session of
+    the thread they run on
+    """
+    def __init__(self, maxsize=100, workers=1):
+        self.workers = workers
+        self.metrics = {'dispatched': 0, 'delivered': 0, 'failed': 0,
+                        'inline': 0, 'latency': 0.0, 'max_latency': 0.0}
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def dispatch(self, reaction, check, blocking=False):
+        """Queue reaction to check or execute it if blocking
+        """
+        queued_on = time.time()
+        if blocking:
+            self._count('inline')
+            reaction(check)
+            self._count_delivery(queued_on)
+            return
+
+        self._start_workers()
+        try:
+            self._queue.put_nowait((reaction, check, queued_on))
+            self._count('dispatched')
+        except queue.Full:
+            self._count('inline')
+            self._deliver(reaction, check, queued_on)
+
+    def join(self):
+        """Wait until all queued reactions are delivered
+        """
+        self._queue.join()
+
+    def _start_workers(self):
+        if len(self._threads) < self.workers:
+            with self._lock:
+                while len(self._threads) < self.workers:
+                    thread = threading.Thread(target=self._work, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            reaction, check, queued_on = self._queue.get()
+            try:
+                self._deliver(reaction, check, queued_on)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, reaction, check, queued_on):
+        try:
+            reaction(check)
+        except Exception as e:
+            logger.exception(e)
+            self._count('failed')
+        else:
+            self._count_delivery(queued_on)
+
+    def _count(self, key):
+        with self._lock:
+            self.metrics[key] += 1
+
+    def _count_delivery(self, queued_on):
+        latency = time.time() - queued_on
+        with self._lock:
+            self.metrics['delivered'] += 1
+            self.metrics['latency'] += latency
+            self.metrics['max_latency'] = max(self.metrics['max_latency'],
+                                              latency)
+
+
+class TrackingIndex:
+    """Items of a list indexed by tracking, synced when the list changes.
+    Appended items are indexed on next use, the index is rebuilt when the
+    list shrinks or its last indexed item is no longer in place. Mapped
+    lists reset it on any removal (see mappers.quality)
+    """
+    def __init__(self, items):
+        self.items = items
+        self._reset()
+
+    def get(self, tracking):
+        self._sync()
+        return self._by_tracking.get(tracking)
+
+    def add(self, item):
+        """Append item to list if it's not already there
+        """
+        if self.get(item.tracking) is not item:
+            self.items.append(item)
+            self._sync()
+
+    def _sync(self):
+        items = self.items
+        if (self._count > len(items) or
+                (self._count and items[self._count - 1] is not self._last)):
+            self._reset()
+
+        if self._count < len(items):
+            for item in items[self._count:]:
+                self._insert(item)
+            self._count = len(items)
+            self._last = items[-1]
+
+    def _reset(self):
+        self._by_tracking = {}
+        self._count = 0  # Indexed items, the first ones of list
+        self._last = None
+
+    def _insert(self, item):
+        self._by_tracking[item.tracking] = item
+
+
+class DefectIndex(TrackingIndex):
+    """Defects indexed by tracking and grouped by requirement key
+    """
+    def __init__(self, items):
+        self._by_requi = {}
+        super().__init__(items)
+
+    def get_by_requi(self, requi_key):
+        self._sync()
+        return self._by_requi.get(requi_key, [])
+
+    def _reset(self):
+        super()._reset()
+        self._by_requi = {}
+
+    def _insert(self, defect):
+        super()._insert(defect)
+        requi_key = self._get_requi_key(defect)
+        self._by_requi.setdefault(requi_key, []).append(defect)
+
+    def _get_requi_key(self, defect):
+        """Return requirement key of defect, parsing tracking if unknown
+        """
+        if hasattr(defect, 'requi_key'):
+            return defect.requi_key
+
+        failure_mode = defect.failure_mode
+        sufix = defect.tracking.rpartition(failure_mode.key)[2]
+        eid = re.sub(r'_\d+$', '', sufix[1:]) if sufix[:1] == '>' else ''
+        return (failure_mode.characteristic.key, eid)
+
+
 class Subject(UnitaryItem):
+    _locks_lock = threading.Lock()
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.measurements = []
         self.defects = []
 
-    def get_measurement(self, requirement, index=None):
-        """Return measurement instance of subject
+    @property
+    def _lock(self):
+        """Lock of subject, checks running concurrently share subjects.
+        Loaded subjects are not initialized so it is created on first use
         """
-        eid = '>{}'.format(requirement.eid) if requirement.eid else ''
-        sufix = '' if index is None else '_{:02d}'.format(index)
-        tracking = requirement.characteristic.key + eid + sufix
-        tracking = '{}/{}'.format(self.tracking, tracking)
+        lock = self.__dict__.get('_subject_lock')
+        if lock is None:
+            with Subject._locks_lock:
+                lock = self.__dict__.get('_subject_lock')
+                if lock is None:
+                    lock = self.__dict__['_subject_lock'] = threading.RLock()
+        return lock
 
-        for measurement in self.measurements:
-            if measurement.tracking == tracking:
-                return measurement
+    @property
+    def measurement_index(self):
+        return self._get_index('measurements')
 
-        # No found, creating a new one
-        measurement = Measurement(requirement.characteristic, tracking, self)
-        if measurement not in self.measurements:
-            self.measurements.append(measurement)
+    @property
+    def defect_index(self):
+        return self._get_index('defects', DefectIndex)
+
+    def _get_index(self, name, Index=TrackingIndex):
+        """Return index of a list attribute, rebuilt when the list is reloaded
+        """
+        if not hasattr(self, name):
+            setattr(self, name, [])
+        items = getattr(self, name)
+        index_name = '_{}_index'.format(name)
+        index = getattr(self, index_name, None)
+        if index is None or index.items is not items:
+            index = Index(items)
+            setattr(self, index_name, index)
+        return index
+
+    def get_measurement(self, requirement, index=None):
+        """Return measurement instance of subject
+        """
+        tracking = '{}/{}'.format(self.tracking,
+                                  requirement.get_tracking(index=index))
+
+        with self._lock:
+            measurement = self.measurement_index.get(tracking)
+            if measurement is None:
+                measurement = Measurement(requirement.characteristic,
+                                          tracking, self)
+                self.measurement_index.add(measurement)
         return measurement
 
     def get_defect(self, requirement, mode_key, index=None):
         """Return defect instance of subject
         """
-        failure_mode = requirement.characteristic.failure_modes[mode_key]
-
-        eid = '>{}'.format(requirement.eid) if requirement.eid else ''
-        sufix = '' if index is None else '_{:02d}'.format(index)
-        tracking = failure_mode.key + eid + sufix
-        tracking = '{}/{}'.format(self.tracking, tracking)
-
-        for defect in self.defects:
-            if defect.tracking == tracking:
-                return defect
-
-        # Not found, creating a new one
-        defect = Defect(failure_mode, tracking, self)
-        if defect not in self.defects:
-            self.defects.append(defect)
+        tracking = '{}/{}'.format(self.tracking,
+                                  requirement.get_tracking(mode_key, index))
+
+        with self._lock:
+            defect = self.defect_index.get(tracking)
+            if defect is None:
+                failure_mode = requirement.characteristic.failure_modes[mode_key]
+                defect = Defect(failure_mode, tracking, self)
+                defect.requi_key = requirement.requi_key
+                self.defect_index.add(defect)
         return defect
 
     def clear_defects(self, check):
-        self._clear_requi_defects(check.control.requirement, check)
+        """Clear defects of check requirement and its sub requirements
+        from check location and its sub locations
+        """
+        location = check.location
+        locations = set(check.sub_locations.values())
+        locations.add(location)
+
+        with self._lock:
+            defect_index = self.defect_index
+            for requi_key in check.subtree_keys:
+                for defect in defect_index.get_by_requi(requi_key):
+                    for node in list(defect.stocks):
+                        if node in locations:
+                            defect.clear(node, check)
+
+
+class PlannedControl(namedtuple(
+    'PlannedControl', op.PlannedStep._fields + (
+        'requirement', 'evaluator', 'subtree_keys', 'location',
+        'sub_locations', 'cavity_locations', 'sampling', 'sampling_location',
+        'sampling_key', 'reaction_name', 'reaction_blocking'
+    )
+)):
+    __slots__ = ()
+
+    def implement(self, test):
+        """Return check of control for test if sampling requires it
+        """
+        check = self.step.implement(test, self)
+        if check:
+            check.planned = self
+        return check
 
-    def _clear_requi_defects(self, requi, check):
-        req_key = '{}>{}'.format(requi.characteristic.key, requi.eid)
-        for defect in self.defects:
-            if req_key in defect.tracking:
-                defect.clear(check.location, check)
-                for loc in check.location.sub_locations:
-                    defect.clear(loc, check)
 
-        for req in requi.requirements.values():
-            self._clear_requi_defects(req, check)
+class InspectionPlan(op.ExecutionPlan):
+    """Execution plan of a control plan, with requirements compiled and
+    locations of its checks resolved
+    """
+    def __init__(self, control_plan):
+        self._sub_locations = {}
+        super().__init__(control_plan)
+
+    def _plan_step(self, step):
+        planned = super()._plan_step(step)
+        if not isinstance(step, Control):
+            return planned
+
+        requirement = step.requirement
+        self.depend_on(requirement)
+        requirement.get_tracking()  # Compiles trackings
+        location = step.source if step.source else self.route.source
+        sub_locations, cavity_locations = self._get_sub_locations(location)
+        sampling_location = self.route.source
+        return PlannedControl(
+            *planned, requirement, requirement.evaluator,
+            frozenset(requirement.subtree_keys), location,
+            sub_locations, cavity_locations,
+            step.method_pars.get('sampling', '100%'), sampling_location,
+            Sampling.get_key(step, sampling_location),
+            step.method_pars.get('reaction_name'), step.is_reaction_blocking
+        )
+
+    def _get_sub_locations(self, location):
+        """Return sub locations of location by key and by cavity
+        """
+        if id(location) not in self._sub_locations:
+            sub_locations = dict(getattr(location, 'sub_locations', None) or {})
+            prefix = '{}_'.format(getattr(location, 'key', None))
+            cavity_locations = {
+                key[len(prefix):]: sub_location
+                for key, sub_location in sub_locations.items()
+                if key.startswith(prefix)
+            }
+            self._sub_locations[id(location)] = (
+                MappingProxyType(sub_locations),
+                MappingProxyType(cavity_locations)
+            )
+        return self._sub_locations[id(location)]
 
 
 class ControlPlan(op.Route):
     def implement(self, responsible, update=None):
         return self.can_implement(Test, responsible, update)
 
+    def compile(self):
+        return InspectionPlan(self)
+
+    def get_component_names(self):
+        """Full module paths of methods, reactions and part devices
+        """
+        names = super().get_component_names()
+        for part_group in self.outputs:
+            device_class = part_group.pars.get('device_class')
+            if device_class:
+                names.add(device_class)
+        return names
+
 
 class Test(op.Operation):
+    def __init__(self, control_plan, responsible, update=None):
+        super().__init__(control_plan, responsible, update)
+        self.sampling_states = {}  # {sampling key: state}, saved with test
+
     def start(self, **kwargs):
         super().start(**kwargs)
         self.part.update_qty(1, self.control_plan.source, self)
@@ -102,6 +381,8 @@ class Test(op.Operation):
 class Check(op.Action):
     """Verification of a characteristic on a part, outputs defects...
     """
+    reactions = ReactionDispatcher()  # Shared by all inspectors
+
     @property
     def description(self):
         return self.control.requirement.description
@@ -114,64 +395,200 @@ class Check(op.Action):
     def control(self):
         return self.step
 
+    @property
+    def is_planned(self):
+        """Check is implemented from a compiled inspection plan
+        """
+        return isinstance(getattr(self, 'planned', None), PlannedControl)
+
     @property
     def location(self):
         if not hasattr(self, '_location'):
-            self._location = (self.control.source if self.control.source
-                              else self.test.control_plan.source)
+            if self.is_planned:
+                self._location = self.planned.location
+            else:
+                self._location = (self.control.source if self.control.source
+                                  else self.test.control_plan.source)
         return self._location
 
+    @property
+    def sub_locations(self):
+        if self.is_planned:
+            return self.planned.sub_locations
+        return getattr(self.location, 'sub_locations', {})
+
+    @property
+    def subtree_keys(self):
+        if self.is_planned:
+            return self.planned.subtree_keys
+        return self.control.requirement.subtree_keys
+
+    def get_evaluator(self, requirement):
+        """Return evaluator of requirement specs, compiled on plan if possible
+        """
+        if self.is_planned and self.planned.requirement is requirement:
+            return self.planned.evaluator
+        return requirement.evaluator
+
     def start(self, **inputs):
         super().start(**inputs)
         self.measurements = []
         self.defects = []
+        self._kept = None
         self.part.clear_defects(self)
         for device in self.devices.values():
             device.clear_defects(self)
 
+    def keep_results(self):
+        """Measurements and defects added by method are only evaluated,
+        subjects get them on close
+        """
+        self._kept = []
+
+    def _keep(self, method, *args):
+        """Return if results are kept, then method is called on close
+        """
+        kept = getattr(self, '_kept', None)
+        if kept is not None:
+            kept.append((method, args))
+        return kept is not None
+
     def close(self):
         """Eval results once check is finished, if ttf raises DefectFound
         """
+        kept, self._kept = getattr(self, '_kept', None), None
+        for method, args in kept or ():
+            method(*args)
+
         if self.status == 'done':
             self.status = 'nok' if self.defects else 'ok'
 
-            location = (
-                self.location
-                if self.cavity is None else
-                 self.location.sub_locations['{}_{}'.format(self.location.key, self.cavity)]
-            )
+            if self.cavity is None:
+                location = self.location
+            elif self.is_planned:
+                location = self.planned.cavity_locations[str(self.cavity)]
+            else:
+                location = self.location.sub_locations[
+                    '{}_{}'.format(self.location.key, self.cavity)]
 
             for defect in self.defects:
                 defect.update_qty(defect.ocurrence,
                                   location, self)
 
             for measurement in self.measurements:
-                measurement.tokens.append(Token(
+                measurement.ledger.post(Token(
                     measurement, location, measurement.value, self
                 ))
 
             self.finished_on = datetime.datetime.now()
+            if self.is_planned:
+                sampling = self.control.get_sampling(
+                    self.planned.sampling_location, self.planned)
+                reaction_name = self.planned.reaction_name
+                is_blocking = self.planned.reaction_blocking
+            else:
+                sampling = self.control.get_sampling(self.test.route.source)
+                reaction_name = self.control.method_pars.get('reaction_name')
+                is_blocking = self.control.is_reaction_blocking
+            sampling.register(self)
+            sampling.save(self.test)
             if self.status == 'nok':
-                self.control.get_reaction()(self)
+                if reaction_name:
+                    self.reactions.dispatch(get_function(reaction_name),
+                                            self.snapshot(location),
+                                            is_blocking)
                 if self.tff:
                     raise DefectFound()
 
 
+    def snapshot(self, location):
+        """Return check results as a dict of primitives, detached from
+        session
+        """
+        part = getattr(self, 'part', None)
+        return {
+            'test_id': self.test.id,
+            'control_id': self.control.id,
+            'description': self.description,
+            'status': self.status,
+            'finished_on': self.finished_on,
+            'location': location.key,
+            'cavity': self.cavity,
+            'part': (None if part is None
+                     else {'key': part.model.key, 'tracking': part.tracking}),
+            'measurements': [
+                {'characteristic': measurement.characteristic.key,
+                 'tracking': measurement.tracking,
+                 'value': measurement.value}
+                for measurement in self.measurements],
+            'defects': [
+                {'failure_mode': defect.failure_mode.key,
+                 'tracking': defect.tracking}
+                for defect in self.defects]
+        }
+
     def add_measurement(self, requirement, value, subject, index=None, uncertainty=0):
-        """Add measurement of a characteristic to check
+        """Add measurement of a characteristic to check, returns failure mode key
+
+        If value is an array, it's evaluated as values of many elements
+        (see add_measurements), a scalar index is the index of its first
+        value
         """
+        if isinstance(value, (list, tuple, np.ndarray)):
+            if index is not None and np.ndim(index) == 0:
+                index = range(index, index + len(value))
+            return self.add_measurements(requirement, value, subject, index,
+                                         uncertainty)
+        if self._keep(self.add_measurement, requirement, value, subject,
+                      index, uncertainty):
+            return self.get_evaluator(requirement).eval(value, uncertainty)
+
         measurement = subject.get_measurement(requirement, index)
 
         self.measurements.append(measurement)
-        mode_key = measurement.eval_value(value, requirement.specs,
+        mode_key = measurement.eval_value(value,
+                                          self.get_evaluator(requirement),
                                           uncertainty=uncertainty)
 
         if mode_key:
             self.add_defect(requirement, mode_key, subject, index)
+        return mode_key
+
+    def add_measurements(self, requirement, values, subject, indexes=None,
+                         uncertainty=0):
+        """Add measurements of an array of values in one vectorized evaluation,
+        returns list of failure mode keys
+
+        Value of position i is measured with index indexes[i], or i if
+        there are no indexes
+        """
+        values = np.asarray(values)
+        if indexes is None:
+            indexes = range(len(values))
+        elif len(indexes) != len(values):
+            raise ValueError('Values and indexes have different lengths')
+
+        mode_keys = self.get_evaluator(requirement).eval_values(
+            values, uncertainty).tolist()
+        if self._keep(self.add_measurements, requirement, values, subject,
+                      indexes, uncertainty):
+            return mode_keys
+
+        for value, index, mode_key in zip(values.tolist(), indexes, mode_keys):
+            measurement = subject.get_measurement(requirement, index)
+            measurement.value = value
+            self.measurements.append(measurement)
+            if mode_key:
+                self.add_defect(requirement, mode_key, subject, index)
+
+        return mode_keys
 
     def add_defect(self, requirement, mode_key, subject, index=None, ocurrence=1):
         """Add defect of check
         """
+        if self._keep(self.add_defect, requirement, mode_key, subject, index,
+                      ocurrence):
+            return
         failure_mode = requirement.characteristic.failure_modes[mode_key]
 
         defect = subject.get_defect(requirement, mode_key, index)
@@ -200,15 +617,51 @@ class Measurement(Item):
         self.value = None
 
     def eval_value(self, value, specs, uncertainty=0):
+        """Set value and return its failure mode key, if any
+
+        specs can be a specs dict or a compiled SpecsEvaluator
+        """
         self.value = value
+        if not isinstance(specs, SpecsEvaluator):
+            specs = SpecsEvaluator(specs, self.characteristic.failure_modes)
+        return specs.eval(value, uncertainty)
+
 
-        low_limit = high_limit = None
+class SpecsEvaluator:
+    """Specs of a requirement compiled for evaluating measured values
+    """
+    def __init__(self, specs, failure_modes):
+        self.specs = specs
+        self._failure_modes = failure_modes
+        self._abs_mode_key = None
+
+        self.low_limit = self.high_limit = None
+        self.is_abs = False
         if 'limits' in specs:
-            low_limit, high_limit = specs['limits']
-            value = self.value
+            self.low_limit, self.high_limit = specs['limits']
         elif 'max_abs' in specs:
-            high_limit = specs['max_abs']
-            value = abs(self.value)
+            self.high_limit = specs['max_abs']
+            self.is_abs = True
+
+        self.is_inverted = not (self.low_limit is None
+                                or self.high_limit is None)
+        self.is_inverted = self.is_inverted and self.low_limit > self.high_limit
+
+    @property
+    def abs_mode_key(self):
+        """Failure mode key of all failures of a max_abs spec
+        """
+        if self._abs_mode_key is None:
+            self._abs_mode_key = list(self._failure_modes.keys())[0]
+        return self._abs_mode_key
+
+    def eval(self, value, uncertainty=0):
+        """Return failure mode key of value, None if it's ok
+        """
+        low_limit = self.low_limit
+        high_limit = self.high_limit
+        if self.is_abs:
+            value = abs(value)
 
         mode_key = None
         if high_limit is not None and value > high_limit - uncertainty:
@@ -217,38 +670,97 @@ class Measurement(Item):
         if low_limit is not None and value < low_limit + uncertainty:
             mode_key = 'lo' if value < low_limit else 'slo'
 
-        if not (low_limit is None or high_limit is None):
-            if low_limit > high_limit:
-                mode_key = None if mode_key else 'lo'
+        if self.is_inverted:
+            mode_key = None if mode_key else 'lo'
 
-        if mode_key and 'max_abs' in specs:
-            mode_key = list(self.characteristic.failure_modes.keys())[0]
+        if mode_key and self.is_abs:
+            mode_key = self.abs_mode_key
 
         return mode_key
 
+    def eval_values(self, values, uncertainty=0):
+        """Evaluate an array of values as eval does with each one
+
+        Returns an object array with the failure mode key (or None) of each value
+        """
+        values = np.asarray(values, dtype=float)
+        mode_keys = np.full(values.shape, None, dtype=object)
+        low_limit = self.low_limit
+        high_limit = self.high_limit
+        if self.is_abs:
+            values = np.abs(values)
+
+        if high_limit is not None:
+            suspicious = values > high_limit - uncertainty
+            mode_keys[suspicious] = 'shi'
+            mode_keys[suspicious & (values > high_limit)] = 'hi'
+
+        if low_limit is not None:
+            suspicious = values < low_limit + uncertainty
+            mode_keys[suspicious] = 'slo'
+            mode_keys[suspicious & (values < low_limit)] = 'lo'
+
+        if self.is_inverted:
+            failed = mode_keys != None  # noqa: E711, elementwise comparison
+            mode_keys[failed] = None
+            mode_keys[~failed] = 'lo'
+
+        if self.is_abs:
+            failed = mode_keys != None  # noqa: E711
+            if failed.any():
+                mode_keys[failed] = self.abs_mode_key
+
+        return mode_keys
+
+
+def eval_values(values, specs, failure_modes, uncertainty=0):
+    """Evaluate an array of values as Measurement.eval_value does with each one
+    """
+    return SpecsEvaluator(specs, failure_modes).eval_values(values, uncertainty)
+
 
 class Control(op.Step):
     """Plan for checking a characteristic on a subject
 
     A subject can be a machine, environment or material
     """
-    _sampling_par = {'100%': (1, 1)}
+    _control_pars = op.Step._control_pars + (
+        'sampling', 'reaction_name', 'reaction_blocking'
+    )
 
     def __init__(self, route, requirement, method_name, method_pars=None,
-                 sampling='100%', reaction=None):
+                 sampling='100%', reaction=None, reaction_blocking=False):
 
         super().__init__(route, method_name, method_pars)
         self.requirement = requirement
         self.reaction_name = reaction
+        if sampling != '100%':
+            self.method_pars['sampling'] = sampling
+        if reaction_blocking:
+            self.method_pars['reaction_blocking'] = True
+
+    def get_sampling(self, location, planned=None):
+        return Sampling.get(self, location, planned)
 
-    def implement(self, operation):
+    def get_sampling_state(self, location):
+        """Return state of sampling saved on location, if any
+        """
+        for sampling_state in getattr(self, 'sampling_states', ()):
+            if sampling_state.location is location:
+                return sampling_state.state
+
+    def implement(self, operation, planned=None):
         """Counts item (time or units)
         and using sampling decides to create check or not
         """
-        if not hasattr(self, 'sampling'):
-            self.sampling = Sampling(self, *self._sampling_par['100%'])
-
-        if self.sampling.count(operation):
+        if planned is None:
+            sampling = self.get_sampling(operation.route.source)
+        else:
+            sampling = self.get_sampling(planned.sampling_location, planned)
+        must_check = sampling.count(operation)
+        sampling.save(operation)
+
+        if must_check:
             return Check(operation, self, operation.update)
 
     def get_reaction(self):
@@ -260,18 +772,205 @@ class Control(op.Step):
 
         return lambda check: None
 
+    def get_component_names(self):
+        names = super().get_component_names()
+        reaction_name = self.method_pars.get('reaction_name')
+        if reaction_name:
+            names.add(reaction_name)
+        return names
 
-class Sampling:
-    def __init__(self, control,  quantity, frequency):
+    @property
+    def is_reaction_blocking(self):
+        """Reaction must finish before test continues
+        """
+        return self.method_pars.get('reaction_blocking', False)
+
+
+class SamplingState:
+    """State of the sampling of a control on a location
+    """
+    def __init__(self, control, location, state):
         self.control = control
-        control.last_count = 0
-        self.quantity = quantity
-        self.frequency = frequency
+        self.location = location
+        self.state = state
+
+
+class Sampling:
+    """Sampling plan of a control, checks 100% of units
+
+    Sampling of a persisted control on a location is shared by all its
+    instances on the process (one for each inspector session), its state is
+    kept by tests and saved with them as a SamplingState to survive
+    restarts. It is not shared between processes, so services with
+    inspector processes reject sampling plans (see Service.check_sampling). Sampling pars are defined on method_pars['sampling'] as '100%'
+    or a dict with the plan name and its arguments, for example
+    {'plan': 'units', 'quantity': 1, 'frequency': 5}
+    """
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, pars=None, state=None):
+        self.pars = pars
+        self.state = dict(state) if state else {}
+        self.key = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, control, location, planned=None):
+        """Return sampling of control on location, created from its pars if
+        necessary. Pars and key of a planned control are the ones of its
+        compile time
+        """
+        if planned is None:
+            pars = control.method_pars.get('sampling', '100%')
+            key = cls.get_key(control, location)
+        else:
+            pars, key = planned.sampling, planned.sampling_key
+        is_persisted = all(isinstance(obj_id, int) for obj_id in key)
+        with cls._registry_lock:
+            if is_persisted:
+                sampling = cls._registry.get(key)
+            else:
+                sampling = getattr(control, '_sampling', None)
+
+            if sampling is None or sampling.pars != pars:
+                sampling = cls.create(pars,
+                                      control.get_sampling_state(location))
+                sampling.key = key
+                if is_persisted:
+                    cls._registry[key] = sampling
+                else:
+                    control._sampling = sampling
+        return sampling
+
+    @staticmethod
+    def get_key(control, location):
+        """Return ids of control and location, themselves if they are not
+        persisted yet
+        """
+        return tuple(obj if getattr(obj, 'id', None) is None else obj.id
+                     for obj in (control, location))
+
+    @classmethod
+    def create(cls, pars, state=None):
+        if pars in (None, '100%'):
+            return Sampling(pars)
+        kwargs = dict(pars)
+        Plan = _SAMPLING_PLANS[kwargs.pop('plan')]
+        return Plan(pars, state, **kwargs)
 
     def count(self, operation):
-        self.control.last_count += self.quantity
+        """Count operation and return if it has to be checked
+        """
+        with self._lock:
+            return self._count(operation)
+
+    def _count(self, operation):
         return True
 
+    def register(self, check):
+        """Receive closed check of sampled operation
+        """
+        pass
+
+    def save(self, test):
+        """Keep state of sampling on test by its key, it is saved with it
+        """
+        with self._lock:
+            state = dict(self.state)
+        if state:
+            test.sampling_states[self.key] = state
+
+
+class UnitSampling(Sampling):
+    """Check quantity units of each frequency units
+    """
+    def __init__(self, pars, state, quantity, frequency):
+        super().__init__(pars, state)
+        self.quantity = quantity
+        self.frequency = frequency
+        self.state.setdefault('counter', 0)
+
+    def _count(self, operation):
+        counter = self.state['counter']
+        self.state['counter'] = (counter + 1) % self.frequency
+        return counter < self.quantity
+
+
+class TimeSampling(Sampling):
+    """Check quantity units every period seconds
+    """
+    def __init__(self, pars, state, quantity, period):
+        super().__init__(pars, state)
+        self.quantity = quantity
+        self.period = period
+        self.state.setdefault('since', None)
+        self.state.setdefault('checked', 0)
+
+    def _count(self, operation):
+        now = time.time()
+        since = self.state['since']
+        if since is None or now - since >= self.period:
+            self.state['since'] = now
+            self.state['checked'] = 0
+
+        if self.state['checked'] < self.quantity:
+            self.state['checked'] += 1
+            return True
+        return False
+
+
+class SkipLotSampling(Sampling):
+    """Check all units of a lot, but once clearance consecutive lots are
+    accepted only one lot of each frequency lots is checked
+
+    Lot is taken from part pars 'batch_number', a nok check restarts
+    clearance
+    """
+    def __init__(self, pars, state, clearance, frequency):
+        super().__init__(pars, state)
+        self.clearance = clearance
+        self.frequency = frequency
+        for key, value in (('lot', None), ('is_sampled', True),
+                           ('has_failed', False), ('accepted', 0),
+                           ('skipped', 0)):
+            self.state.setdefault(key, value)
+
+    def _count(self, operation):
+        lot = self._get_lot(operation)
+        state = self.state
+        if 'started' not in state or lot != state['lot']:
+            if 'started' in state and state['is_sampled']:
+                state['accepted'] = (0 if state['has_failed']
+                                     else state['accepted'] + 1)
+
+            state['is_sampled'] = (state['accepted'] < self.clearance
+                                   or state['skipped'] + 1 >= self.frequency)
+            state['skipped'] = 0 if state['is_sampled'] else state['skipped'] + 1
+            state['has_failed'] = False
+            state['lot'] = lot
+            state['started'] = True
+
+        return state['is_sampled']
+
+    def register(self, check):
+        if check.status == 'nok':
+            with self._lock:
+                self.state['has_failed'] = True
+                self.state['accepted'] = 0
+
+    def _get_lot(self, operation):
+        part = getattr(operation, 'part', None)
+        pars = getattr(part, 'pars', None) or {}
+        return pars.get('batch_number')
+
+
+_SAMPLING_PLANS = {
+    'units': UnitSampling,
+    'time': TimeSampling,
+    'skip_lot': SkipLotSampling
+}
+
 
 class FailureMode(Resource):
     """Mode of failing a characteristic
@@ -0,0 +1,183 @@
+import threading
+import time
+
+
+class DeviceScheduler:
+    """Reservation of toolbox devices for the actions of all inspectors
+
+    Devices of an action are reserved all at once, so actions sharing a
+    device never overlap and cavities can not deadlock each other. The
+    scheduler also keeps the lock serializing single calls of each device
+    (see models.devices.DeviceProvider)
+    """
+    default_duration = 1.0  # Estimated seconds of a never executed step
+
+    def __init__(self):
+        self.generation = 0  # Increased on every release
+        self._owners = {}  # {device: [owner, nested owners...]}
+        self._locks = {}
+        self._durations = {}
+        self._condition = threading.Condition()
+
+    def reserve(self, devices, owner, holders=()):
+        """Reserve devices for owner if all of them are free or reserved
+        by one of holders, the owners it runs on behalf of
+        """
+        with self._condition:
+            for device in devices:
+                owners = self._owners.get(device)
+                if (owners and owners[-1] != owner and
+                        owners[-1] not in holders):
+                    return False
+            for device in devices:
+                owners = self._owners.setdefault(device, [])
+                if not owners or owners[-1] != owner:
+                    owners.append(owner)
+            return True
+
+    def release(self, devices, owner):
+        """Release devices reserved by owner and wake up waiting operations
+        """
+        with self._condition:
+            for device in devices:
+                owners = self._owners.get(device)
+                if owners and owners[-1] == owner:
+                    owners.pop()
+                    if not owners:
+                        del self._owners[device]
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait_release(self, generation, timeout=None):
+        """Wait until some release happens after generation
+        """
+        with self._condition:
+            if self.generation == generation:
+                self._condition.wait(timeout)
+            return self.generation
+
+    def get_owner(self, device):
+        owners = self._owners.get(device)
+        return owners[-1] if owners else None
+
+    def get_lock(self, device):
+        """Return the lock serializing calls to device
+        """
+        with self._condition:
+            return self._locks.setdefault(device, threading.Lock())
+
+    def is_busy(self, device):
+        """Return True if device is reserved or being called
+        """
+        lock = self.get_lock(device)
+        if not lock.acquire(blocking=False):
+            return True
+        lock.release()
+        return self.get_owner(device) is not None
+
+    def record(self, step, duration):
+        """Record duration of an executed step for estimating next plans
+        """
+        key = self._get_key(step)
+        last = self._durations.get(key)
+        self._durations[key] = (duration if last is None
+                                else 0.7 * last + 0.3 * duration)
+
+    def estimate(self, step):
+        return self._durations.get(self._get_key(step), self.default_duration)
+
+    def plan(self, steps, dependencies):
+        """Simulate scheduling of steps with their estimated durations
+
+        Returns the planned makespan and the busy fraction of each device,
+        raises ValueError if dependencies can not be satisfied
+        """
+        self._check_dependencies(steps, dependencies)
+        pending = list(range(len(steps)))
+        finished_on = {}
+        device_free_on = {}
+        busy = {}
+        now = 0.0
+        while pending:
+            ready = [index for index in pending
+                     if all(dep in finished_on and finished_on[dep] <= now
+                            for dep in dependencies[index])]
+            started = False
+            for index in ready:
+                devices = steps[index].devices
+                if all(device_free_on.get(device, 0.0) <= now
+                       for device in devices):
+                    duration = self.estimate(steps[index])
+                    finished_on[index] = now + duration
+                    for device in devices:
+                        device_free_on[device] = now + duration
+                        busy[device] = busy.get(device, 0.0) + duration
+                    pending.remove(index)
+                    started = True
+
+            if pending and not started:
+                now = min(time_ for time_ in finished_on.values()
+                          if time_ > now)
+
+        makespan = max(finished_on.values()) if finished_on else 0.0
+        return {
+            'time': makespan,
+            'devices': {device: busy_time / makespan if makespan else 0.0
+                        for device, busy_time in busy.items()}
+        }
+
+    def _check_dependencies(self, steps, dependencies):
+        if len(dependencies) != len(steps):
+            raise ValueError('{} steps with {} dependencies'.format(
+                len(steps), len(dependencies)))
+        for index, step_dependencies in enumerate(dependencies):
+            unknown = [dep for dep in step_dependencies
+                       if not 0 <= dep < len(steps)]
+            if unknown:
+                raise ValueError('Step {} depends on unknown steps {}'.format(
+                    index, unknown))
+
+        visited = set()
+        for start in range(len(steps)):
+            if start in visited:
+                continue
+            path, stack = [], [(start, iter(dependencies[start]))]
+            while stack:  # Depth first search of a dependency back to path
+                index, pending = stack[-1]
+                if index not in path:
+                    path.append(index)
+                dep = next(pending, None)
+                if dep is None:
+                    visited.add(path.pop())
+                    stack.pop()
+                elif dep in path:
+                    raise ValueError('Steps {} depend on each other'.format(
+                        path[path.index(dep):]))
+                elif dep not in visited:
+                    stack.append((dep, iter(dependencies[dep])))
+
+    def _get_key(self, step):
+        key = getattr(step, 'id', None)
+        return key if key is not None else id(step)
+
+
+class DeviceUsage:
+    """Busy time of devices during the walk of an operation
+    """
+    def __init__(self):
+        self.started_on = time.time()
+        self.busy = {}
+        self._lock = threading.Lock()
+
+    def add(self, devices, duration):
+        with self._lock:
+            for device in devices:
+                self.busy[device] = self.busy.get(device, 0.0) + duration
+
+    def get_utilization(self):
+        elapsed = time.time() - self.started_on
+        return {
+            'time': elapsed,
+            'devices': {device: busy / elapsed if elapsed else 0.0
+                        for device, busy in self.busy.items()}
+        }
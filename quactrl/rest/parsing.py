@@ -152,6 +152,10 @@ def _parse_question(question):
     return result
 
 
+def _parse_remote_object(remote_object):
+    return remote_object.parsed
+
+
 _PARSES = {
     'Test': _parse_test,
     'Check': _parse_check,
@@ -162,5 +166,6 @@ _PARSES = {
     'PartModel': _parse_part_model,
     'Cavity': _parse_cavity,
     'Part': _parse_part,
-    'Question': _parse_question
+    'Question': _parse_question,
+    'RemoteObject': _parse_remote_object
 }
@@ -1,5 +1,6 @@
 import os
 import datetime
+import json
 import cherrypy
 from quactrl.rest.parsing import parse
 from quactrl.helpers import is_num
@@ -10,6 +11,25 @@ def try_int(cavity):
         return int(cavity)
 
 
+def parse_event(event):
+    """Return event as dict, None if it's not notified to clients
+    """
+    if event[0] not in ('done', 'walking', 'walked'):
+        event_dict = {'state': event[0],
+                      'obj': parse(event[1])}
+        if len(event) > 2:  # Event is an exception
+            event_dict['trace'] = '/n'.join(event[2])
+        return event_dict
+
+
+def serialize_event(event):
+    """Return event as json text, None if it's not notified to clients
+    """
+    event_dict = parse_event(event)
+    if event_dict is not None:
+        return json.dumps(event_dict, default=str)
+
+
 @cherrypy.expose
 class Resource:
     def __init__(self, part_manager):
@@ -103,16 +123,40 @@ class PartResource(Resource):
 class EventsResource(Resource):
 
     @cherrypy.tools.json_out()
-    def GET(self, cavity=None, word=None):
+    def GET(self, cavity=None, word=None, since=None, client=None):
+        """Events of current test, last ones if cavity or word is 'last'
+        or events after sequence number since
+
+        Last events are the ones since previous call of the same client,
+        given by client or else by its address
+        """
         service = self.part_manager.test_service
-        get_events = service.get_events
-        if cavity == 'last' or word == 'last':
-            get_events = service.get_last_events
         key = try_int(cavity)
-        events = get_events(cavity)
+        if since is not None:
+            return self._parse_sequenced(
+                service.get_events_since(key, int(since)))
+
+        if cavity == 'last' or word == 'last':
+            events = service.get_last_events(
+                key, client or cherrypy.request.remote.ip)
+        else:
+            events = service.get_events(key)
 
         return self._parse_events(events)
 
+    def _parse_sequenced(self, result):
+        if 'events' not in result:  # Result by cavity
+            return {cavity: self._parse_sequenced(cav_result)
+                    for cavity, cav_result in result.items()}
+
+        events = []
+        for sequence, event in result['events']:
+            event_dict = parse_event(event)
+            if event_dict:
+                event_dict['seq'] = sequence
+                events.append(event_dict)
+        return dict(result, events=events)
+
     def _parse_events(self, events):
         if type(events) is dict:
             result = {cavity: self._parse_events(cav_events)
@@ -120,15 +164,65 @@ class EventsResource(Resource):
         else:
             result = []
             for event in events:
-                if event[0] not in ('done', 'walking', 'walked'):
-                    event_dict = {'state': event[0],
-                                  'obj': parse(event[1])}
-                    if len(event) > 2:  # Event is an exception
-                        event_dict['trace'] = '/n'.join(event[2])
+                event_dict = parse_event(event)
+                if event_dict:
                     result.append(event_dict)
         return result
 
 
+class StreamResource(Resource):
+    """Events of a cavity pushed as they happen, as server-sent events if
+    client accepts text/event-stream or else as a long-poll
+
+    Each event is serialized once for all clients. Every streaming client
+    holds a server thread, size cherrypy thread pool accordingly
+    """
+    timeout = 25  # Seconds without events before answering or keep-alive
+
+    def GET(self, cavity=None, since=0, timeout=None):
+        service = self.part_manager.test_service
+        key = try_int(cavity)
+        if key not in service.active_cavities:
+            raise cherrypy.NotFound()
+
+        since = int(cherrypy.request.headers.get('Last-Event-ID', since))
+        timeout = float(timeout) if timeout else self.timeout
+        if 'text/event-stream' in cherrypy.request.headers.get('Accept', ''):
+            cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+            cherrypy.response.headers['Cache-Control'] = 'no-cache'
+            return self._stream(service, key, since, timeout)
+
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        try:
+            result = service.wait_events(key, since, timeout, serialize_event)
+        except KeyError:  # Cavity removed while waiting
+            raise cherrypy.NotFound()
+        return self._join(result).encode()
+
+    GET._cp_config = {'response.stream': True}
+
+    def _stream(self, service, cavity, since, timeout):
+        while cavity in service.active_cavities:
+            try:
+                result = service.wait_events(cavity, since, timeout,
+                                             serialize_event)
+            except KeyError:  # Cavity removed while waiting
+                return
+            chunks = ['id: {}\ndata: {}\n\n'.format(sequence, data)
+                      for sequence, data in result['events'] if data]
+            yield ''.join(chunks).encode() if chunks else b': keep-alive\n\n'
+            since = result['sequence']
+
+    def _join(self, result):
+        """Join serialized events into the json text of result
+        """
+        events = ','.join('{{"seq": {}, "event": {}}}'.format(sequence, data)
+                          for sequence, data in result['events'] if data)
+        return ('{{"sequence": {}, "missed": {}, "dropped": {}, '
+                '"events": [{}]}}').format(result['sequence'], result['missed'],
+                                           result['dropped'], events)
+
+
 class ResponsibleResource(Resource):
     @cherrypy.tools.json_out()
     def GET(self):
@@ -146,6 +240,7 @@ class ResponsibleResource(Resource):
 
 _RESOURCES = {
     'events': EventsResource,
+    'stream': StreamResource,
     'cavities': CavitiesResource,
     'part': PartResource,
     'part_model': PartModelResource,
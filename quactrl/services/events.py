@@ -0,0 +1,76 @@
+import collections
+import threading
+
+
+class EventBuffer:
+    """Bounded buffer of events with increasing sequence numbers
+
+    Events are not consumed when read, each reader keeps the sequence of
+    the last event it has read and asks for the events since it. Readers
+    can ask for serialized events, each event is serialized only once
+    (all readers must use the same serialize function)
+
+    serialize: function serializing events when they are put, so readers
+    get them as they were then and not as their objects are when read
+    """
+    def __init__(self, maxlen=1000, serialize=None):
+        self.sequence = 0  # Sequence of last event
+        self.dropped = 0  # Events discarded because buffer was full
+        self.serialize = serialize
+        self._events = collections.deque(maxlen=maxlen)
+        self._condition = threading.Condition()
+        self._serialized = {}
+        self._serialize_lock = threading.Lock()
+
+    @property
+    def last(self):
+        """Last event or None if there are no events
+        """
+        with self._condition:
+            return self._events[-1][1] if self._events else None
+
+    def put(self, event):
+        """Append event and return its sequence number
+        """
+        serialize = self.serialize
+        serialized = serialize(event) if serialize is not None else None
+        with self._condition:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+                self._serialized.pop(self._events[0][0], None)
+            self.sequence += 1
+            self._events.append((self.sequence, event))
+            if serialize is not None:
+                with self._serialize_lock:
+                    self._serialized[self.sequence] = serialized
+            self._condition.notify_all()
+            return self.sequence
+
+    def get_since(self, sequence=0, serialize=None):
+        """Return events after sequence as (sequence, event) pairs and the
+        number of them missed because they were dropped
+        """
+        with self._condition:
+            first = self._events[0][0] if self._events else self.sequence + 1
+            missed = max(0, first - sequence - 1)
+            start = max(0, sequence + 1 - first)
+            events = [self._events[index]
+                      for index in range(start, len(self._events))]
+
+        if serialize is not None:
+            events = [(sequence_, self._serialize(sequence_, event, serialize))
+                      for sequence_, event in events]
+        return events, missed
+
+    def wait(self, sequence, timeout=None):
+        """Wait until there are events after sequence, returns if there are
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.sequence > sequence,
+                                            timeout)
+
+    def _serialize(self, sequence, event, serialize):
+        with self._serialize_lock:
+            if sequence not in self._serialized:
+                self._serialized[sequence] = serialize(event)
+            return self._serialized[sequence]
@@ -22,11 +22,19 @@ class Cavity:
             self.test_service.start_inspector(key)
 
         self.inspector = part_manager.test_service.inspectors[key]
+        self.inspector.state_listeners.append(
+            lambda inspector: part_manager.wake_up())
         self.get_part_info = lambda key: part_manager.get_part_info(key)
         self.part_is_present = lambda key: part_manager.part_is_present(key)
         self.part_manager = part_manager
         self.part = None
 
+    @property
+    def awaits_presence(self):
+        """Next state depends on presence of part
+        """
+        return self.state in ('empty', 'success', 'failed', 'cancelled')
+
     def restart(self, reinsert_orders=True):
         self.part_manager.test_service.restart_inspector(self.key,
                                                          reinsert_orders)
@@ -68,6 +76,7 @@ class Cavity:
 
         if state != self.state:
             self.state = state
+            self.part_manager.record_transition()
             self.part_manager.cavity_state_has_changed(self.key)
 
     def __del__(self):
@@ -76,35 +85,92 @@ class Cavity:
 
 class MultiPartManager(threading.Thread):
     """Base class for all part managers
+
+    Cavities are refreshed when an inspector changes its state or when
+    presence_changed is called. If hardware can not notify presence edges
+    (has_presence_events is False) cavities waiting for parts are polled
+    every refresh_time seconds
     """
-    def __init__(self, test_service, refresh_time=0):
-        super().__init__()
+    has_presence_events = False
+
+    def __init__(self, test_service, refresh_time=0.1):
+        super().__init__(daemon=True)
         self.test_service = test_service
         self.data = test_service.db
         self.refresh_time = refresh_time
 
         self._continue = True
-        self.setDaemon(True)
+        self._wakeup = threading.Event()
+        self._woken_on = None
+        self._refreshed_on = time.monotonic()
 
         self.responsible = None
         self.cavities = {}
+        self.metrics = {'cpu': 0.0, 'elapsed': 0.0, 'refreshes': 0,
+                        'transitions': 0, 'latency': 0.0,
+                        'max_latency': 0.0}
 
     def add_cavity(self, key=None):
         self.cavities[key] = Cavity(self, key)
+        self.wake_up()
 
     def remove_cavity(self, key=None):
         cavity = self.cavities.pop(key)
         del(cavity)
 
     def run(self):
+        started_on = time.monotonic()
+        cpu_started_on = time.thread_time()
         while self._continue:
+            self._wakeup.clear()
+            self._refreshed_on = self._woken_on or time.monotonic()
+            self._woken_on = None
+            transitions = self.metrics['transitions']
             cavities = list(self.cavities.values())
             for cavity in cavities:
                 cavity.refresh()
+            self.metrics['refreshes'] += 1
+            self.metrics['cpu'] = time.thread_time() - cpu_started_on
+            self.metrics['elapsed'] = time.monotonic() - started_on
+
+            if self.metrics['transitions'] != transitions:
+                continue  # A transition may enable next one
+            must_poll = (not self.has_presence_events and
+                         any(cavity.awaits_presence for cavity in cavities))
+            self._wakeup.wait(self.refresh_time if must_poll else None)
 
     def stop(self):
         self._continue = False
-        self.join()
+        self.wake_up()
+        if self.is_alive():
+            self.join()
+
+    def wake_up(self):
+        """Refresh cavities as soon as possible
+        """
+        if self._woken_on is None:
+            self._woken_on = time.monotonic()
+        self._wakeup.set()
+
+    def presence_changed(self, cavity_key=None):
+        """Called on presence sensor edges
+        """
+        self.wake_up()
+
+    def record_transition(self):
+        """Count a cavity state transition and its latency since wake up
+        """
+        latency = time.monotonic() - self._refreshed_on
+        self.metrics['transitions'] += 1
+        self.metrics['latency'] += latency
+        self.metrics['max_latency'] = max(self.metrics['max_latency'], latency)
+
+    @property
+    def cpu_usage(self):
+        """Fraction of a core used by the manager thread
+        """
+        elapsed = self.metrics['elapsed']
+        return self.metrics['cpu'] / elapsed if elapsed else 0.0
 
     def is_ready(self):
         """Return true if it's properly configured
@@ -130,6 +196,7 @@ class MultiPartManager(threading.Thread):
             self.responsible = None
         else:
             self.responsible = self.data.Persons().get(key)
+        self.wake_up()
 
     def __del__(self):
         self.stop()
@@ -138,7 +205,7 @@ class MultiPartManager(threading.Thread):
 class MonoPartManager(MultiPartManager):
     """Launcher for a tool with only one cavity
     """
-    def __init__(self, test_service, refresh_time=0):
+    def __init__(self, test_service, refresh_time=0.1):
         super().__init__(test_service, refresh_time)
         self.add_cavity(None)
 
@@ -0,0 +1,358 @@
+import datetime
+import decimal
+import io
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+from sqlalchemy import inspect, select
+from sqlalchemy.orm.state import InstanceState
+from quactrl.data.sqlalchemy.tables import journal as journal_table
+
+
+logger = logging.getLogger(__name__)
+
+
+_PLAIN_TYPES = (str, bytes, int, float, bool, complex, type(None),
+                decimal.Decimal, datetime.datetime, datetime.date,
+                datetime.time, datetime.timedelta,
+                list, tuple, dict, set, frozenset)
+
+
+def _get_state(obj):
+    state = inspect(obj, raiseerr=False)
+    return state if isinstance(state, InstanceState) else None
+
+
+class _ChangesPickler(pickle.Pickler):
+    """New objects are pickled with their mapped state, persistent ones
+    as references and objects of other classes (callbacks, devices,
+    threads...) are dropped
+    """
+    def __init__(self, file, new):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.new = {id(obj) for obj in new}
+
+    def persistent_id(self, obj):
+        if type(obj) in _PLAIN_TYPES or isinstance(obj, type):
+            return None
+        if type(obj).__module__.startswith('sqlalchemy.'):
+            # States and collections of other objects are not pickled
+            if isinstance(obj, InstanceState):
+                return self._get_reference(obj.obj(), 'state')
+            adapter = getattr(obj, '_sa_adapter', None)
+            if adapter is not None:
+                return self._get_reference(adapter.owner_state.obj(),
+                                           'collection', adapter._key)
+            return None
+
+        state = _get_state(obj)
+        return ('dropped',) if state is None else self._get_reference(obj)
+
+    def _get_reference(self, obj, kind='persistent', *args):
+        if id(obj) in self.new:
+            return None
+        key = _get_state(obj).key
+        return (kind, key) + args if key else ('dropped',)
+
+
+class _ChangesUnpickler(pickle.Unpickler):
+    def __init__(self, file, session):
+        super().__init__(file)
+        self.session = session
+
+    def persistent_load(self, pid):
+        if pid[0] == 'dropped':
+            return None
+        cls, identity = pid[1][:2]
+        obj = self.session.query(cls).get(identity)
+        if pid[0] == 'state':
+            return inspect(obj)
+        elif pid[0] == 'collection':
+            return getattr(obj, pid[2])
+        return obj
+
+
+def _get_changes(state):
+    """Changed attributes of a persistent object
+    """
+    changes = {}
+    for attr in state.mapper.attrs:
+        if not hasattr(attr, 'columns') and not hasattr(attr, 'direction'):
+            continue  # Synonyms
+        history = state.attrs[attr.key].history
+        if not history.has_changes():
+            continue
+        if getattr(attr, 'uselist', False):
+            changes[attr.key] = (list(history.added), list(history.deleted))
+        else:
+            changes[attr.key] = getattr(state.obj(), attr.key)
+    return changes
+
+
+def dump_changes(session):
+    """Serialize what a flush of session would write, returns None if
+    there is nothing to write
+    """
+    new = list(session.new)
+    dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+    deleted = list(session.deleted)
+    if not (new or dirty or deleted):
+        return None
+
+    changes = {
+        'new': new,
+        'dirty': [(_get_state(obj).key, _get_changes(_get_state(obj)))
+                  for obj in dirty],
+        'deleted': [_get_state(obj).key for obj in deleted]
+    }
+    file = io.BytesIO()
+    _ChangesPickler(file, new).dump(changes)
+    return file.getvalue()
+
+
+def discard_changes(session):
+    """Forget pending changes of session without any query, dumped changes
+    are written by other session.
+
+    Changed objects are expired, until that session commits them they are
+    read again as they are on database, readers must wait for the key of
+    the changes (see PersistenceQueue.wait_for)
+    """
+    for obj in list(session.new) + list(session.deleted):
+        if obj in session:  # Not expunged by cascade
+            session.expunge(obj)
+    for obj in list(session.dirty):
+        session.expire(obj)  # Reloaded once written
+
+
+def load_changes(data, session):
+    """Apply on session changes serialized by dump_changes
+    """
+    changes = _ChangesUnpickler(io.BytesIO(data), session).load()
+    for key, attributes in changes['dirty']:
+        obj = session.query(key[0]).get(key[1])
+        for name, value in attributes.items():
+            if type(value) is tuple:  # Collection
+                collection = getattr(obj, name)
+                added, deleted = value
+                for item in deleted:
+                    if item in collection:
+                        collection.remove(item)
+                for item in added:
+                    if item not in collection:
+                        collection.append(item)
+            else:
+                setattr(obj, name, value)
+    session.add_all(changes['new'])
+    for key in changes['deleted']:
+        session.delete(session.query(key[0]).get(key[1]))
+
+
+class PersistenceQueue(threading.Thread):
+    """Write-behind persistence, changes of inspector sessions are queued
+    and written by one writer thread
+
+    durability: 'enqueue' returns once changes are queued (and journaled),
+        'commit' once they are commited on database
+    maxsize: backlog of changes, put blocks while it is full
+    journal: directory where changes are kept until they are written,
+        they are replayed when the queue is started again. The sequence of
+        the last entry written is commited with it, so entries already
+        written are not replayed
+    fsync: journal entries are synced to disk before being queued
+
+    Changes that fail to be written are kept on journal and their key is
+    kept pending, wait_for raises their error
+    """
+    def __init__(self, database, durability='enqueue', maxsize=100,
+                 journal=None, fsync=True):
+        super().__init__(name='PersistenceQueue', daemon=True)
+        if durability not in ('enqueue', 'commit'):
+            raise ValueError('Unknown durability "{}"'.format(durability))
+
+        self.db = database
+        self.durability = durability
+        self.journal = journal
+        self.fsync = fsync
+        self.metrics = {'queued': 0, 'written': 0, 'failed': 0,
+                        'replayed': 0, 'skipped': 0, 'blocked': 0,
+                        'blocked_time': 0.0, 'max_backlog': 0}
+
+        self._queue = queue.Queue(maxsize)
+        self._pending = {}  # Number of queued changes by key
+        self._failed = {}  # Write error by key of changes not written
+        self._condition = threading.Condition()
+        self._sequence = 0
+        self._written = 0  # Sequence of last journal entry written
+        self._replay = []
+        if journal:
+            os.makedirs(journal, exist_ok=True)
+            self._replay = sorted(name for name in os.listdir(journal)
+                                  if name.endswith('.pkl'))
+            self._written = self._get_written()
+            self._sequence = max([self._written] +
+                                 [int(name[:-4]) for name in self._replay])
+
+    @property
+    def backlog(self):
+        return self._queue.qsize()
+
+    def put(self, session, key=None):
+        """Queue pending changes of session and discard them from it,
+        key identifies changes that must be written before reading the
+        same data again (see wait_for)
+        """
+        data = dump_changes(session)
+        discard_changes(session)
+        session.commit()  # Ends transaction, there is nothing to flush
+        if data is None:
+            return
+
+        with self._condition:
+            self._sequence += 1
+            sequence = self._sequence
+            if key is not None:
+                self._pending[key] = self._pending.get(key, 0) + 1
+        path = self._write_journal(sequence, data)
+
+        done = threading.Event() if self.durability == 'commit' else None
+        entry = {'data': data, 'key': key, 'path': path, 'done': done,
+                 'error': None, 'sequence': sequence}
+        self._enqueue(entry)
+
+        if done is not None:
+            done.wait()
+            if entry['error'] is not None:
+                raise entry['error']
+
+    def wait_for(self, key, timeout=None):
+        """Wait until queued changes with key are written, returns False
+        on timeout and raises the error of changes that failed
+        """
+        with self._condition:
+            written = self._condition.wait_for(
+                lambda: key not in self._pending or key in self._failed,
+                timeout)
+            if key in self._failed:
+                raise self._failed[key]
+            return written
+
+    def join_queue(self):
+        """Wait until all queued changes are written
+        """
+        self._queue.join()
+
+    def _enqueue(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:  # Backpressure
+            started_on = time.monotonic()
+            self._queue.put(entry)
+            self.metrics['blocked'] += 1
+            self.metrics['blocked_time'] += time.monotonic() - started_on
+        self.metrics['queued'] += 1
+        self.metrics['max_backlog'] = max(self.metrics['max_backlog'],
+                                          self._queue.qsize())
+
+    def _write_journal(self, sequence, data):
+        if not self.journal:
+            return None
+        path = os.path.join(self.journal, '{:012d}.pkl'.format(sequence))
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        return path
+
+    def _get_written(self):
+        """Sequence of last journal entry written on database
+        """
+        session = self.db.db.Session()
+        try:
+            sequence = session.execute(
+                select([journal_table.c.sequence]).where(
+                    journal_table.c.name == self._journal_name)).scalar()
+        finally:
+            session.close()
+        return sequence or 0
+
+    @property
+    def _journal_name(self):
+        return os.path.abspath(self.journal)[-255:]
+
+    def _set_written(self, session, sequence):
+        """Keep sequence of journal entry on the transaction writing it
+        """
+        columns = journal_table.c
+        updated = session.execute(journal_table.update().where(
+            columns.name == self._journal_name).values(sequence=sequence))
+        if not updated.rowcount:
+            session.execute(journal_table.insert().values(
+                name=self._journal_name, sequence=sequence))
+
+    def run(self):
+        session = self.db.Session()
+        session.expire_on_commit = False  # Referenced objects are kept
+        for name in self._replay:
+            path = os.path.join(self.journal, name)
+            sequence = int(name[:-4])
+            if sequence <= self._written:  # Written before removing it
+                os.remove(path)
+                self.metrics['skipped'] += 1
+                continue
+            with open(path, 'rb') as file:
+                entry = {'data': file.read(), 'key': None, 'path': path,
+                         'done': None, 'error': None, 'sequence': sequence}
+            if self._write(session, entry):
+                self.metrics['replayed'] += 1
+        self._replay = []
+
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                self._queue.task_done()
+                break
+            self._write(session, entry)
+            self._queue.task_done()
+
+    def _write(self, session, entry):
+        try:
+            load_changes(entry['data'], session)
+            if entry['path']:
+                self._set_written(session, entry['sequence'])
+            session.commit()
+            if entry['path']:
+                self._written = entry['sequence']
+                os.remove(entry['path'])
+            self.metrics['written'] += 1
+            return True
+        except Exception as e:  # Kept on journal for next start
+            session.rollback()
+            logger.exception(e)
+            entry['error'] = e
+            self.metrics['failed'] += 1
+            return False
+        finally:
+            if entry['done'] is not None:
+                entry['done'].set()
+            with self._condition:
+                key = entry['key']
+                if key is not None:
+                    if entry['error'] is not None:  # Kept pending
+                        self._failed[key] = entry['error']
+                    else:
+                        self._pending[key] -= 1
+                        if not self._pending[key]:
+                            del self._pending[key]
+                self._condition.notify_all()
+
+    def stop(self):
+        """Write queued changes and stop writer
+        """
+        self._queue.put(None)
+        self.join()
@@ -0,0 +1,390 @@
+import itertools
+import logging
+import os
+import threading
+from multiprocessing.managers import BaseManager
+from quactrl.data import Data, NotFoundResource
+from quactrl.models.devices import Toolbox
+from quactrl.models.scheduling import DeviceScheduler
+from quactrl.rest.parsing import parse
+from quactrl.services.events import EventBuffer
+from quactrl.services.testing import Inspector
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_data_args(database):
+    """Arguments for building the same data container on other process
+    """
+    return (database.module_name.rsplit('.', 1)[1],
+            database.connection_string)
+
+
+class RemoteObject:
+    """Picklable snapshot of a model object of an inspector process, it
+    is parsed as the original object
+    """
+    def __init__(self, obj):
+        self.class_name = obj.__class__.__name__
+        self.state = getattr(obj, 'state', None)
+        try:
+            self.parsed = parse(obj)
+        except Exception:
+            logger.exception('{} is sent unparsed'.format(self.class_name))
+            self.parsed = {'class': self.class_name, 'description': str(obj)}
+
+
+class DeviceHub:
+    """Owner of the hardware connections of a location, devices are
+    reached by name and only one caller uses a device at a time
+
+    Devices are reserved on the scheduler of the hub, so reservations of
+    all inspector processes exclude each other. Part models of DUTs are
+    loaded in advance, calls are served by threads without session
+    """
+    instance = None  # Hub served by the broker process
+
+    def __init__(self, toolbox, dut_models=None):
+        self.toolbox = toolbox
+        self.dut_models = dut_models or {}  # {part number: part model}
+        self.scheduler = DeviceScheduler()
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def get_methods(self, name):
+        device = self._get_device(name)
+        return [attribute for attribute in dir(device)
+                if attribute[0] != '_' and callable(getattr(device, attribute))]
+
+    def call(self, name, method, args=(), kwargs=None):
+        device = self._get_device(name)
+        with self.scheduler.get_lock(name):
+            return getattr(device, method)(*args, **(kwargs or {}))
+
+    def get(self, name, attribute):
+        return getattr(self._get_device(name), attribute)
+
+    def reserve(self, names, owner, holders=()):
+        return self.scheduler.reserve(names, owner, holders)
+
+    def release(self, names, owner):
+        self.scheduler.release(names, owner)
+
+    def wait_release(self, generation, timeout=None):
+        return self.scheduler.wait_release(generation, timeout)
+
+    def get_generation(self):
+        return self.scheduler.generation
+
+    def get_owner(self, name):
+        return self.scheduler.get_owner(name)
+
+    def _get_device(self, name):
+        with self._lock:
+            if name not in self._devices:
+                if type(name) is tuple:  # ('dut', part_number, cavity)
+                    _, part_number, cavity = name
+                    if part_number not in self.dut_models:
+                        raise NotFoundResource(
+                            'Not found DUT model {}'.format(part_number))
+                    self._devices[name] = self.toolbox.dut(
+                        self.dut_models[part_number], cavity)
+                else:
+                    self._devices[name] = getattr(self.toolbox, name)()
+            return self._devices[name]
+
+
+def load_hub(data_args, location_key):
+    """Load the hub of the devices of a location on broker process
+    """
+    database = Data(*data_args)
+    devices = database.Devices().get_all_from(location_key)
+    dut_models = {
+        model.key: model
+        for control_plan in database.ControlPlans().get_all_from(location_key)
+        for model in control_plan.outputs if model.is_device()
+    }
+    DeviceHub.instance = DeviceHub(Toolbox(devices), dut_models)
+
+
+def get_hub():
+    return DeviceHub.instance
+
+
+class DeviceBroker(BaseManager):
+    """Process serving the device hub to inspector processes
+    """
+
+
+DeviceBroker.register('hub', callable=get_hub)
+
+
+class RemoteDevice:
+    """Device of the broker, attributes are got and methods are called
+    on the broker process
+    """
+    def __init__(self, hub, name):
+        self._hub = hub
+        self._name = name
+        self._methods = set(hub.get_methods(name))
+
+    def __getattr__(self, attribute):
+        if attribute[0] == '_':
+            raise AttributeError(attribute)
+        if attribute in self._methods:
+            return lambda *args, **kwargs: self._hub.call(
+                self._name, attribute, args, kwargs)
+        return self._hub.get(self._name, attribute)
+
+
+class RemoteScheduler(DeviceScheduler):
+    """Scheduler of an inspector process, devices are reserved on the hub
+    of the broker and durations of steps are estimated locally
+
+    Owners are sent as keys of the process, unique while they are alive
+    """
+    def __init__(self, hub):
+        super().__init__()
+        self.hub = hub
+
+    @property
+    def generation(self):
+        return self.hub.get_generation()
+
+    @generation.setter
+    def generation(self, generation):
+        pass  # Kept by the hub
+
+    def reserve(self, devices, owner, holders=()):
+        return self.hub.reserve(list(devices), self._get_key(owner),
+                                [self._get_key(holder) for holder in holders])
+
+    def release(self, devices, owner):
+        self.hub.release(list(devices), self._get_key(owner))
+
+    def wait_release(self, generation, timeout=None):
+        return self.hub.wait_release(generation, timeout)
+
+    def get_owner(self, device):
+        return self.hub.get_owner(device)
+
+    def _get_key(self, owner):
+        return (os.getpid(), id(owner))
+
+
+class RemoteToolbox:
+    """Toolbox of an inspector process, devices are on the broker
+    """
+    def __init__(self, hub):
+        self.hub = hub
+        self.scheduler = RemoteScheduler(hub)
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name[0] == '_':
+            raise AttributeError(name)
+        return lambda: self._get_device(name)
+
+    def dut(self, model, cavity=None):
+        return self._get_device(('dut', model.key, cavity))
+
+    def _get_device(self, name):
+        with self._lock:
+            if name not in self._devices:
+                self._devices[name] = RemoteDevice(self.hub, name)
+            return self._devices[name]
+
+
+class ForwardingInspector(Inspector):
+    """Inspector of an inspector process, its events, states and parts are
+    sent to the service process
+    """
+    def __init__(self, messages, key, *args, **kwargs):
+        self.messages = messages
+        self.key = key
+        super().__init__(*args, **kwargs)
+        self.state_listeners.append(
+            lambda inspector: self.send('state', inspector.state))
+
+    def send(self, kind, payload):
+        self.messages.put((self.key, kind, payload))
+
+    def get_part(self, serial_number, pars):
+        part = super().get_part(serial_number, pars)
+        self.send('part', RemoteObject(part))
+        return part
+
+    def update(self, state, obj, *args):
+        self.send('event', [state, RemoteObject(obj)] + list(args))
+
+
+def serve(data_args, location_key, broker_address, tff, deferred,
+          commands, messages):
+    """Entry point of an inspector process, inspectors are started and
+    driven by commands of the service process
+    """
+    database = Data(*data_args)
+    broker = DeviceBroker(broker_address)
+    broker.connect()
+    toolbox = RemoteToolbox(broker.hub())
+
+    inspectors = {}
+    while True:
+        key, command, payload = commands.get()
+        if command == 'start':
+            inspectors[key] = inspector = ForwardingInspector(
+                messages, key, database, toolbox, location_key, payload,
+                tff, deferred
+            )
+            inspector.daemon = True
+            inspector.start()
+        elif command == 'order':
+            inspectors[key].orders.put(payload)
+        elif command == 'stop':
+            messages.put((key, 'stopped', inspectors.pop(key).stop()))
+        elif command == 'answer':
+            inspectors[key].answer(**payload)
+        elif command == 'cancel':
+            inspectors[key].cancel()
+        elif command == 'exit':
+            break
+
+
+class InspectorProcess:
+    """Process hosting the inspectors of some cavities
+    """
+    def __init__(self, context, data_args, location_key, broker_address,
+                 tff=True, deferred=False):
+        self.commands = context.Queue()
+        self.messages = context.Queue()
+        self.inspectors = {}
+
+        self.process = context.Process(
+            target=serve, args=(data_args, location_key, broker_address,
+                                tff, deferred, self.commands, self.messages),
+            daemon=True
+        )
+        self.process.start()
+        self._dispatcher = threading.Thread(target=self._dispatch,
+                                            daemon=True)
+        self._dispatcher.start()
+
+    def send(self, key, command, payload=None):
+        self.commands.put((key, command, payload))
+
+    def _dispatch(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                break
+            key, kind, payload = message
+            inspector = self.inspectors.get(key)
+            if inspector is not None:
+                inspector.receive(kind, payload)
+
+    def stop(self, timeout=5):
+        self.send(None, 'exit')
+        self.process.join(timeout)
+        self.messages.put(None)
+
+
+class RemoteOrders:
+    """Orders of an inspector of other process
+    """
+    def __init__(self, inspector):
+        self.inspector = inspector
+
+    def put(self, order):
+        self.inspector.send('order', order)
+
+
+class RemoteTest:
+    """Test running on an inspector process
+    """
+    def __init__(self, snapshot, inspector):
+        self.snapshot = snapshot
+        self.inspector = inspector
+
+    @property
+    def state(self):
+        return self.snapshot.state
+
+    def answer(self, **kwargs):
+        self.inspector.answer(**kwargs)
+
+    def cancel(self):
+        self.inspector.cancel()
+
+
+class ProcessInspector:
+    """Inspector of a cavity running on an inspector process, with the
+    same interface as a local one
+    """
+    stop_timeout = 5
+    _keys = itertools.count()
+
+    def __init__(self, process, cavity=None):
+        self.process = process
+        self.cavity = cavity
+        self.key = next(self._keys)
+        self.name = 'Inspector'
+        if cavity is not None:
+            self.name += '_{}'.format(cavity)
+
+        self.orders = RemoteOrders(self)
+        self.events = EventBuffer()
+        self.state_listeners = []
+        self.state = 'avalaible'
+        self.part = None
+        self.test = None
+
+        self._pending_orders = []
+        self._stopped = threading.Event()
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        for listener in list(self.state_listeners):
+            listener(self)
+
+    def send(self, command, payload=None):
+        self.process.send(self.key, command, payload)
+
+    def start(self):
+        self.process.inspectors[self.key] = self
+        self.send('start', self.cavity)
+
+    def receive(self, kind, payload):
+        """Apply a message of the inspector process
+        """
+        if kind == 'event':
+            if payload[1].class_name == 'Test':
+                self.test = RemoteTest(payload[1], self)
+            self.events.put(payload)
+        elif kind == 'state':
+            self.state = payload
+        elif kind == 'part':
+            self.part = payload
+        elif kind == 'stopped':
+            self._pending_orders = payload
+            self._stopped.set()
+
+    def stop(self):
+        """Stop remote inspector and return unprocessed orders"""
+        self.send('stop')
+        if not self._stopped.wait(self.stop_timeout):
+            logger.warning('Inspector {} has not stopped'.format(self.name))
+        self.process.inspectors.pop(self.key, None)
+        return self._pending_orders
+
+    def answer(self, **kwargs):
+        self.send('answer', kwargs)
+
+    def cancel(self):
+        self.send('cancel')
@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+
+class OrderQueue(Queue):
+    """Thread safe queue calling on_put after each put
+    """
+    def __init__(self, on_put, maxsize=0):
+        super().__init__(maxsize)
+        self.on_put = on_put
+
+    def _put(self, item):
+        super()._put(item)
+        self.on_put()
+
+
+class AsyncRuntime:
+    """Event loop running inspectors as coroutines on one thread, blocking
+    calls (tests and their devices) are run on a bounded set of workers.
+
+    A test blocks its worker until it ends, so at most `workers` cavities
+    are tested at the same time, give as many workers as cavities to test
+    all of them at once. Callers can be pinned to a worker, so the objects
+    they load on its thread local session are kept between calls
+    """
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.loop = asyncio.new_event_loop()
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1,
+                               thread_name_prefix='InspectorWorker-{}'.format(n))
+            for n in range(workers)
+        ]
+        self._next = itertools.count()  # Round robin over workers
+        self._local = threading.local()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start event loop thread if it is not running
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='InspectorRuntime',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def spawn(self, coroutine):
+        """Schedule coroutine on the loop, returns a concurrent future
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call_soon(self, callback, *args):
+        """Call callback on the loop thread, it can be called from any thread
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def assign(self):
+        """Return the worker next caller has to be pinned to
+        """
+        return next(self._next) % self.workers
+
+    async def run_blocking(self, function, *args, worker=None):
+        """Run function on a worker and wait for its result, on the given
+        one if any
+        """
+        if worker is None:
+            worker = self.assign()
+        return await self.loop.run_in_executor(self.executors[worker],
+                                               function, *args)
+
+    @property
+    def worker_cache(self):
+        """Dict local to current worker thread
+        """
+        if not hasattr(self._local, 'cache'):
+            self._local.cache = {}
+        return self._local.cache
+
+    def stop(self):
+        """Stop the loop and its workers
+        """
+        with self._lock:
+            if self._thread is not None:
+                self.call_soon(self.loop.stop)
+                self._thread.join()
+                self._thread = None
+        for executor in self.executors:
+            executor.shutdown(wait=False)
@@ -0,0 +1,49 @@
+import collections
+import threading
+
+
+class SerialAllocator:
+    """Serial numbers of parts by part model and batch. Sequences come
+    from a counter of the database, so a serial number is given only once
+    by all cavities and processes
+
+    block_size: sequences reserved on each database call, the ones not
+        given when the allocator is dropped are lost
+    template: format of serial numbers from batch_number and sequence
+    pos: position of batch number on legacy serial numbers, new counters
+        continue after the last serial number of its batch on database
+    """
+    def __init__(self, data, block_size=1,
+                 template='{batch_number}{sequence:05d}', pos=0):
+        self.data = data
+        self.block_size = block_size
+        self.template = template
+        self.pos = pos
+        self._blocks = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def get_next(self, part_model, batch_number):
+        """Return next serial number of a batch
+        """
+        with self._lock:
+            block = self._blocks[(part_model.key, batch_number)]
+            if not block:
+                block.extend(self._reserve(part_model, batch_number,
+                                           self.block_size))
+            sequence = block.popleft()
+        return self.format(batch_number, sequence)
+
+    def reserve(self, part_model, batch_number, count):
+        """Return count consecutive serial numbers of a batch, for
+        stations testing several parts at once
+        """
+        return [self.format(batch_number, sequence) for sequence
+                in self._reserve(part_model, batch_number, count)]
+
+    def format(self, batch_number, sequence):
+        return self.template.format(batch_number=batch_number,
+                                    sequence=sequence)
+
+    def _reserve(self, part_model, batch_number, count):
+        return self.data.Parts().reserve_serial_numbers(
+            part_model, batch_number, count, pos=self.pos)
@@ -1,12 +1,18 @@
+import asyncio
+import multiprocessing
 import threading
 import sys
 import traceback
-from queue import Queue
+from queue import Queue, Empty
+from quactrl.helpers import resolver
 from quactrl.models.devices import Toolbox
 from quactrl.data import NotFoundPath, NotFoundItem, NotFoundResource
 import quactrl.models.operations as op
 import quactrl.models.products as prd
 from quactrl.models.quality import DefectFound
+from quactrl.services.events import EventBuffer
+from quactrl.services.runtime import AsyncRuntime, OrderQueue
+from quactrl.services.serials import SerialAllocator
 import logging
 
 
@@ -25,23 +31,105 @@ class InspectorException(Exception):
     pass
 
 
+def is_test_end(event):
+    """Event notifies the end of a test
+    """
+    class_name = getattr(event[1], 'class_name',  # Remote objects
+                         event[1].__class__.__name__)
+    return event[0] in ('success', 'failed', 'cancelled') and class_name == 'Test'
+
+
 class Service:
-    """Test parts from a location"""
-    def __init__(self, database, location, till_first_failure=True):
+    """Test parts from a location
+
+    By default every cavity has its own inspector thread, when workers is
+    given inspectors run as coroutines on an event loop and their tests on
+    that number of threads, so at most workers cavities are tested at the
+    same time. When processes is given inspectors
+    are distributed on that number of processes and devices are used
+    through a broker process. When persistence (PersistenceQueue) is given
+    executed tests are written behind by it. When serialize is given events
+    are serialized by it as soon as inspectors put them
+    """
+    def __init__(self, database, location, till_first_failure=True,
+                 deferred=False, workers=None, processes=None,
+                 persistence=None, serialize=None):
 
         self.db = database
         self.tff = till_first_failure
+        self.deferred = deferred
         self.location_key = location
+        self.persistence = persistence
+        self.serialize = serialize
+        if persistence is not None and not persistence.is_alive():
+            persistence.start()
+        self.runtime = AsyncRuntime(workers) if workers else None
+        self.broker = None
+        self.processes = []
 
-        self.events = {}
         self.inspectors = {}
+        self._cursors = {}  # Sequence of last event read by (client, cavity)
         self._lock = threading.Lock()
 
         all_devices = self.db.Devices().get_all_from(self.location_key)
         logger.info('Sesssion on main is {}'.format(self.db.Session()))
         logger.info('Sesssion on main is {}'.format(self.db.Session()))
+        self.prewarm(all_devices)
+        if processes:
+            self.check_sampling()
         self.toolbox = Toolbox(all_devices)
 
+        if processes:
+            self._start_processes(processes)
+
+    def _start_processes(self, count):
+        """Start device broker and inspector processes
+        """
+        from quactrl.services import processes
+
+        context = multiprocessing.get_context('spawn')
+        data_args = processes.get_data_args(self.db)
+        self.broker = processes.DeviceBroker(ctx=context)
+        self.broker.start(processes.load_hub, (data_args, self.location_key))
+        self.processes = [
+            processes.InspectorProcess(context, data_args, self.location_key,
+                                       self.broker.address, self.tff,
+                                       self.deferred)
+            for _ in range(count)
+        ]
+
+    def check_sampling(self):
+        """Raises IncorrectSetup if any control of location has a sampling
+        plan, their state is kept by process so inspector processes can not
+        share it
+        """
+        sampled = [
+            control.requirement.key
+            for control_plan in self.db.ControlPlans().get_all_from(
+                self.location_key)
+            for control in control_plan.steps
+            if control.method_pars.get('sampling', '100%') != '100%'
+        ]
+        if sampled:
+            raise IncorrectSetup(
+                'Sampling plans can not be used with processes: {}'.format(
+                    ', '.join(sorted(sampled))))
+
+    def prewarm(self, devices):
+        """Resolve in advance all components used on location,
+        raises IncorrectSetup if any of them can not be resolved
+        """
+        names = {device.model.class_name for device in devices}
+        for control_plan in self.db.ControlPlans().get_all_from(self.location_key):
+            names |= control_plan.get_component_names()
+
+        errors = resolver.prewarm(names)
+        if errors:
+            raise IncorrectSetup('Not resolved components: {}'.format(
+                ', '.join('{} ({})'.format(name, error)
+                          for name, error in sorted(errors.items()))
+            ))
+
     @property
     def tests(self):
         """List tests by cavity"""
@@ -65,12 +153,34 @@ class Service:
         elif cavity in self.inspectors:
             self.restart_inspector(cavity)
         else:
-            self.inspectors[cavity] = inspector = Inspector(
-                self.db, self.toolbox,
-                self.location_key, cavity, self.tff
-            )
-            self.events[cavity] = []
-            inspector.setDaemon(True)
+            if self.processes:
+                from quactrl.services.processes import ProcessInspector
+                process = min(self.processes,
+                              key=lambda process: len(process.inspectors))
+                inspector = ProcessInspector(process, cavity)
+            elif self.runtime:
+                if len(self.inspectors) >= self.runtime.workers:
+                    logger.warning(
+                        'Cavity {} shares a worker, only {} cavities are '
+                        'tested at the same time'.format(cavity,
+                                                         self.runtime.workers))
+                inspector = AsyncInspector(
+                    self.db, self.toolbox, self.location_key, cavity,
+                    self.tff, self.deferred, self.persistence,
+                    runtime=self.runtime
+                )
+            else:
+                inspector = Inspector(
+                    self.db, self.toolbox,
+                    self.location_key, cavity, self.tff, self.deferred,
+                    self.persistence
+                )
+                inspector.daemon = True
+            inspector.events.serialize = self.serialize
+            self.inspectors[cavity] = inspector
+            with self._lock:  # Clients read the new inspector from start
+                self._cursors = {key: sequence for key, sequence
+                                 in self._cursors.items() if key[1] != cavity}
             inspector.start()
 
     def stop_inspector(self, cavity=None):
@@ -126,74 +236,117 @@ class Service:
     #     self.inspectors[cavity].notify(info)
 
     def get_events(self, cavity=None):
-        """Get events from inspector from current test"""
+        """Get events of current test, or last one if it has finished
+        """
         if cavity not in self.active_cavities:
-            for _cavity in self.active_cavities:
-                self.get_last_events(_cavity)
-            return self.events
-        else:
-            self.get_last_events(cavity)
-            return self.events.get(cavity)
+            return {_cavity: self.get_events(_cavity)
+                    for _cavity in self.active_cavities}
+
+        events = [event for _, event in
+                  self.inspectors[cavity].events.get_since()[0]]
+        for index in range(len(events) - 2, -1, -1):
+            if is_test_end(events[index]):
+                return events[index + 1:]
+        return events
 
-    def get_last_events(self, cavity=None):
-        """Retrieve last events since previous call
+    def get_last_events(self, cavity=None, client=None):
+        """Retrieve last events since previous call of client, till the end
+        of a test
         """
         if cavity not in self.active_cavities:  # Asking to all cavities
-            last_events = {}
-            for _cavity in self.active_cavities:
-                last_events[_cavity] = self.get_last_events(_cavity)
-        else:
-            last_events = self.inspectors[cavity].get_last_events()
-            if self.test_has_finished(cavity) and last_events:
-                self.events[cavity] = last_events
-            else:
-                self.events[cavity].extend(last_events)
-
+            return {_cavity: self.get_last_events(_cavity, client)
+                    for _cavity in self.active_cavities}
+
+        with self._lock:
+            cursor = self._cursors.get((client, cavity), 0)
+        events, _ = self.inspectors[cavity].events.get_since(cursor)
+        last_events = []
+        for sequence, event in events:
+            last_events.append(event)
+            cursor = sequence
+            if is_test_end(event):
+                break
+        with self._lock:
+            self._cursors[(client, cavity)] = cursor
         return last_events
 
-    def test_has_finished(self, cavity):
-        if cavity not in self.events:
-            return True
+    def get_events_since(self, cavity=None, sequence=0, serialize=None):
+        """Return events after sequence, without consuming them, with
+        the number of missed and dropped events
+        """
+        if cavity not in self.active_cavities:
+            return {_cavity: self.get_events_since(_cavity, sequence,
+                                                   serialize)
+                    for _cavity in self.active_cavities}
+
+        buffer = self.inspectors[cavity].events
+        events, missed = buffer.get_since(sequence, serialize)
+        return {'sequence': events[-1][0] if events else sequence,
+                'missed': missed, 'dropped': buffer.dropped,
+                'events': events}
+
+    def wait_events(self, cavity, sequence=0, timeout=None, serialize=None):
+        """Wait until there are events after sequence on cavity or timeout
+        expires, returns them as get_events_since
+        """
+        self.inspectors[cavity].events.wait(sequence, timeout)
+        return self.get_events_since(cavity, sequence, serialize)
 
-        if not self.events[cavity]:
+    def test_has_finished(self, cavity):
+        if cavity not in self.inspectors:
             return True
 
-        event = self.events[cavity][-1]
-        is_finished = event[0] in ('success', 'failed', 'cancelled')
-        is_finished &= event[1].__class__.__name__ == 'Test'
-        return is_finished
+        event = self.inspectors[cavity].events.last
+        return event is None or is_test_end(event)
 
     def __del__(self):
         for inspector in self.inspectors.values():
             inspector.stop()
+        if self.runtime:
+            self.runtime.stop()
+        for process in self.processes:
+            process.stop()
+        if self.broker:
+            self.broker.shutdown()
 
 
-class Inspector(threading.Thread):
-    """Inspector of one cavity sharing some devices on a location
+class BaseInspector:
+    """Inspector of one cavity sharing some devices on a location,
+    subclasses define how orders are received and run
     """
     def __init__(self, database, toolbox, location_key,
-                 cavity=None, tff=True):
+                 cavity=None, tff=True, deferred=False, persistence=None):
         """Args:
         database(Container): Persistence layer container of providers
         toolbox(Container): Container of devices
         location_key: where is located the test station and all its devices
         cavity: cavity number, None is the station is not multicavity
         tff(Boolean): Till first failure, stops test when first failure is found
+        deferred(Boolean): Test is added to session once executed and loaded
+            master data is not expired on commit
+        persistence(PersistenceQueue): Executed tests are queued on it to be
+            written behind instead of commited, it implies deferred
+
+        Orders without serial number get the next one of their batch_number
+        from serials (SerialAllocator)
         """
-        name = 'Inspector'
+        self.name = 'Inspector'
         if cavity is not None:
-            name += '_{}'.format(cavity)
-        super().__init__(name=name)
+            self.name += '_{}'.format(cavity)
 
         self.db = database
         self.toolbox = toolbox
         self.location_key = location_key
         self.cavity = cavity
         self.tff = tff
+        self.deferred = deferred or persistence is not None
+        self.persistence = persistence
+        self.serials = SerialAllocator(database)
 
         # Inputs and Outputs of inspector
         self.orders = Queue()
-        self.events = Queue()
+        self.events = EventBuffer()
+        self.state_listeners = []  # Called with inspector on state changes
         self.state = 'avalaible'
 
         # Batch variables
@@ -201,10 +354,22 @@ class Inspector(threading.Thread):
         self.part_model = None
         self.part = None
         self.control_plan = None
+        self.plan = None
         self.test = None
+        self._plans = {}  # Execution plans by (part number, location key)
 
         self._stop_event = threading.Event()
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        for listener in list(self.state_listeners):
+            listener(self)
+
     def set_responsible(self, responsible_key):
         """Loads responsible if it has changed
         """
@@ -212,50 +377,54 @@ class Inspector(threading.Thread):
             self.responsible = self.db.Persons().get(responsible_key)
 
     def set_part_model(self, part_number):
+        """Loads part model and the execution plan of its control plan,
+        plans are compiled once and reused until master data changes
+        """
         if (self.part_model is None
                 or self.part_model.key != part_number):
             self.part_model = self.db.PartModels().get(part_number)
             if self.part_model is None:
                 raise NotFoundResource('Not found part model for partnumber{}'.format(part_number))
 
-        if (self.control_plan is None
-            or self.part_model not in
-            self.control_plan.outputs):
-            self.control_plan = (self.db.ControlPlans()
-                                 .get_by(self.part_model, self.location))
-            if self.control_plan is None:
-                raise NotFoundPath('Not found control plan for {}'.format(part_number))
-
-    def run(self):
-        """Thread activation processing order by order"""
+        plan_key = (part_number, self.location_key)
+        plan = self._plans.get(plan_key)
+        if plan is None or plan.is_expired:
+            if (self.control_plan is None
+                or self.part_model not in
+                self.control_plan.outputs):
+                self.control_plan = (self.db.ControlPlans()
+                                     .get_by(self.part_model, self.location))
+                if self.control_plan is None:
+                    raise NotFoundPath('Not found control plan for {}'.format(part_number))
+            plan = self._plans[plan_key] = self.control_plan.compile()
+
+        self.plan = plan
+        self.control_plan = plan.route
+
+    def prepare(self):
+        """Load location and its devices on session of current thread
+        """
+        if self.deferred:
+            self.db.Session().expire_on_commit = False
         self.location = self.db.Locations().get(self.location_key)
         self.devices = {device.tracking: device
                         for device in self.db.Devices().get_all_from(self.location_key)}
 
-        while not self._stop_event.is_set():
-            try:
-                self.state = 'idle'
-                logger.info('Inspector {} is idle'.format(self.name))
-                order = self.orders.get()
-                if order is None:
-                    self.orders.task_done()
-                    break
-                else:
-                    self.state = 'busy'
-                    self.run_test(order)
-                    self.orders.task_done()
-                    logger.info('Inspector {} has finished'.format(self.name))
-            except Exception as e:
-                trc = sys.exc_info()
-                self.update('loop_error', e, traceback.format_tb(trc[2]))
-                logger.exception(e)
-                raise e
-        logger.info('Inspector {} has stopped'.format(self.name))
-        self.state = 'stopped'
+    def get_serial_number(self, part_info):
+        """Return serial number of order, a new one of its batch if it has
+        none
+        """
+        serial_number = part_info.pop('serial_number', None)
+        if serial_number is None:
+            serial_number = self.serials.get_next(self.part_model,
+                                                  part_info['batch_number'])
+        return serial_number
 
     def get_part(self, serial_number, pars):
         """Get part from data layer if exist or create a new one
         """
+        if self.persistence:  # Previous tests of part must be written
+            self.persistence.wait_for((self.part_model.key, serial_number))
 
         part = self.db.Parts().get_by(self.part_model, serial_number)
         if part and part.location != self.location:
@@ -269,11 +438,19 @@ class Inspector(threading.Thread):
             part = prd.Part(self.part_model, serial_number,
                             pars=pars)
 
-        if part.model.is_device():
-            part.dut = self.toolbox.dut(part.model, self.cavity)
+        part.dut = (self.toolbox.dut(part.model, self.cavity)
+                    if part.model.is_device() else None)
 
         return part
 
+    def add_test(self, test, part):
+        """Add test and part to session, on deferred mode they are added
+        once test is executed so its objects are persisted in one step
+        """
+        self.db.Tests().add(test)
+        self.db.Parts().add(part)
+        logger.info('Test has been added on cavity {}'.format(self.cavity))
+
     def run_test(self, order):
         """Process a full test  from an order
         """
@@ -284,16 +461,15 @@ class Inspector(threading.Thread):
 
             part_number = part_info.pop('part_number')
             self.set_part_model(part_number)
-            serial_number = part_info.pop('serial_number')
+            serial_number = self.get_serial_number(part_info)
             self.part = part = self.get_part(serial_number, part_info)
             self.test = test = self.control_plan.implement(self.responsible,
                                                            self.update)
 
-            self.db.Tests().add(test)
-            self.db.Parts().add(part)
-            logger.info('Test has been added on cavity {}'.format(self.cavity))
+            if not self.deferred:
+                self.add_test(test, part)
             test.start(part=part, toolbox=self.toolbox, devices=self.devices,
-                       cavity=self.cavity, tff=self.tff)
+                       cavity=self.cavity, tff=self.tff, plan=self.plan)
             try:
                 if part.dut and hasattr(part.dut, 'supply_voltage'):
                     self.toolbox.dyncir().switch_on_dut(
@@ -301,6 +477,9 @@ class Inspector(threading.Thread):
                         wait_after=1, cavity=self.cavity
                     )
                 test.walk()
+                if hasattr(test, 'utilization'):
+                    logger.info('Device utilization on cavity {}: {}'.format(
+                        self.cavity, test.utilization))
                 test.execute()
                 test.close()
             except DefectFound:
@@ -311,7 +490,13 @@ class Inspector(threading.Thread):
                 self.update('test_error', e, traceback.format_tb(trc[2]))
                 test.cancel()
             finally:
-                self.db.Session().commit()
+                if self.deferred:
+                    self.add_test(test, part)
+                if self.persistence:
+                    self.persistence.put(self.db.Session(),
+                                         (part.model.key, part.serial_number))
+                else:
+                    self.db.Session().commit()
                 if part.dut and hasattr(part.dut, 'supply_voltage'):
                     self.toolbox.dyncir().switch_off_dut(
                         voltage=part.dut.supply_voltage,
@@ -327,9 +512,7 @@ class Inspector(threading.Thread):
     def update(self, state, obj, *args):
         """Receive from test notications of states
         """
-        self.events.put(
-            [state, obj] + list(args)
-        )
+        self.events.put([state, obj] + list(args))
 
     def stop(self):
         """Stop thread and return unprocessed orders"""
@@ -348,19 +531,110 @@ class Inspector(threading.Thread):
         if hasattr(self.test, 'question'):
             self.test.question.answer(**kwargs)
 
-    def get_last_events(self):
-        """Retrieve a list of last events of current test
-        """
-        events = []
-        for _ in range(self.events.qsize()):
-            event = self.events.get()
-            events.append(event)
-            if event[0] in ('success', 'failed', 'cancelled') \
-               and event[1].__class__.__name__ == 'Test':
-                break
-
-        return events
-
     def cancel(self):
         if self.state == 'busy':
             self.test.cancel()
+
+
+class Inspector(BaseInspector, threading.Thread):
+    """Inspector running on its own thread
+    """
+    def __init__(self, *args, **kwargs):
+        threading.Thread.__init__(self)
+        BaseInspector.__init__(self, *args, **kwargs)
+
+    def run(self):
+        """Thread activation processing order by order"""
+        self.prepare()
+
+        while not self._stop_event.is_set():
+            try:
+                self.state = 'idle'
+                logger.info('Inspector {} is idle'.format(self.name))
+                order = self.orders.get()
+                if order is None:
+                    self.orders.task_done()
+                    break
+                else:
+                    self.state = 'busy'
+                    self.run_test(order)
+                    self.orders.task_done()
+                    logger.info('Inspector {} has finished'.format(self.name))
+            except Exception as e:
+                trc = sys.exc_info()
+                self.update('loop_error', e, traceback.format_tb(trc[2]))
+                logger.exception(e)
+                raise e
+        logger.info('Inspector {} has stopped'.format(self.name))
+        self.state = 'stopped'
+
+
+class AsyncInspector(BaseInspector):
+    """Inspector running as a coroutine on an AsyncRuntime, its tests are
+    run on the worker of the runtime it is pinned to.
+
+    Sessions are thread local, so pinning keeps the objects loaded on the
+    session of the worker from test to test, they are prepared once.
+    Execution plans are shared by all inspectors of the same worker
+    """
+    def __init__(self, *args, runtime, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.runtime = runtime
+        self._has_orders = asyncio.Event()
+        self.orders = OrderQueue(
+            lambda: runtime.call_soon(self._has_orders.set))
+        self.worker = runtime.assign()
+        self._prepared = False
+        self.future = None
+
+    def start(self):
+        """Schedule inspector on the runtime
+        """
+        self.future = self.runtime.spawn(self.run())
+
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
+    async def run(self):
+        """Coroutine processing order by order"""
+        while not self._stop_event.is_set():
+            try:
+                self.state = 'idle'
+                logger.info('Inspector {} is idle'.format(self.name))
+                order = await self.get_order()
+                if order is None:
+                    self.orders.task_done()
+                    break
+                else:
+                    self.state = 'busy'
+                    await self.runtime.run_blocking(self.run_order, order,
+                                                    worker=self.worker)
+                    self.orders.task_done()
+                    logger.info('Inspector {} has finished'.format(self.name))
+            except Exception as e:
+                trc = sys.exc_info()
+                self.update('loop_error', e, traceback.format_tb(trc[2]))
+                logger.exception(e)
+                raise e
+        logger.info('Inspector {} has stopped'.format(self.name))
+        self.state = 'stopped'
+
+    async def get_order(self):
+        """Wait for next order without blocking the event loop
+        """
+        while True:
+            try:
+                return self.orders.get_nowait()
+            except Empty:
+                self._has_orders.clear()
+                await self._has_orders.wait()
+
+    def run_order(self, order):
+        """Run test of order on the worker of inspector, preparing it on
+        first order
+        """
+        if not self._prepared:
+            self.prepare()
+            self._plans = self.runtime.worker_cache.setdefault('plans', {})
+            self._prepared = True
+        self.run_test(order)
@@ -12,3 +12,22 @@ def start(cntx, resources, url):
     app = App()
     app.add_resource(Resource(), name)
     app.run()
+
+
+@task
+def stock(cntx, connection_string, rebuild=False):
+    """Check current stock against token history, rebuild it if asked
+    """
+    from quactrl.data import Data
+
+    db = Data('sqlalchemy', connection_string).db
+    if rebuild:
+        db.rebuild_stock()
+    missing, unexpected = db.check_stock()
+    for row in missing:
+        print('Missing on stock: item {} node {} qty {} token {}'.format(*row))
+    for row in unexpected:
+        print('Not on history: item {} node {} qty {} token {}'.format(*row))
+    if missing or unexpected:
+        raise SystemExit(1)
+    print('Stock matches token history')
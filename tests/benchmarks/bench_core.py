@@ -0,0 +1,36 @@
+"""Microbenchmarks of core model
+
+Run it with: python -m tests.benchmarks.bench_core
+"""
+import timeit
+import quactrl.models.core as c
+
+
+def lookup_cost(history_size, number=10000):
+    """Return microseconds per current stock lookup of an item
+    with history_size tokens on its history
+    """
+    item = c.Item()
+    nodes = [c.Node(key=str(index)) for index in range(10)]
+    for index in range(history_size):
+        item.update_qty(index + 1, nodes[index % len(nodes)], index)
+
+    node = nodes[0]
+
+    def lookup():
+        item.get_token(node)
+        item.qty
+        item.stocks
+
+    seconds = timeit.timeit(lookup, number=number)
+    return seconds / number * 1e6
+
+
+def main():
+    print('{:>10} {:>12}'.format('tokens', 'us/lookup'))
+    for size in (10, 100, 1000, 10000, 100000):
+        print('{:>10} {:>12.2f}'.format(size, lookup_cost(size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Microbenchmarks of quality model
+
+Run it with: python -m tests.benchmarks.bench_quality
+"""
+import timeit
+from unittest.mock import Mock
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+import quactrl.models.quality as qua
+
+
+def create_requirements(size):
+    mode = qua.Mode('hi')
+    requirements = []
+    for index in range(size):
+        characteristic = prd.Characteristic(
+            prd.Attribute('a{}'.format(index)), prd.Element('e')
+        )
+        characteristic.add_failure_mode(mode)
+        requirements.append(
+            prd.Requirement(characteristic,
+                            '{}>{}'.format(characteristic.key, index))
+        )
+    return requirements
+
+
+def lookup_cost(size):
+    """Return microseconds per measurement and defect lookup on a subject
+    with size characteristics already checked
+    """
+    requirements = create_requirements(size)
+    subject = qua.Subject(tracking='1234')
+
+    def check_all():
+        for requirement in requirements:
+            subject.get_measurement(requirement)
+            subject.get_defect(requirement, 'hi')
+
+    check_all()  # Subject is populated
+    number = max(1, 10000 // size)
+    seconds = timeit.timeit(check_all, number=number)
+    return seconds / (number * size) * 1e6
+
+
+def clear_cost(depth, width=3, cavities=8, number=100):
+    """Return microseconds per clear of defects of a deep requirement tree
+    on a subject with defects of the tree and of other requirements
+    """
+    location = op.Location('station')
+    location.sub_locations = {
+        str(cavity): op.Location('station_{}'.format(cavity))
+        for cavity in range(cavities)
+    }
+    subject = qua.Subject(tracking='1234')
+
+    tree = create_requirements(depth * width)
+    root = tree[0]
+    for level in range(depth - 1):
+        parent = tree[level * width]
+        for child in tree[(level + 1) * width:(level + 2) * width]:
+            parent.add_requi(child)
+
+    # Defects from other checks
+    for requirement in create_requirements(10 * depth * width):
+        subject.get_defect(requirement, 'hi')
+
+    check = Mock()
+    check.location = location
+    check.control.requirement = root
+    check.sub_locations = location.sub_locations
+    check.subtree_keys = frozenset(root.subtree_keys)
+    defects = [subject.get_defect(requi, 'hi') for requi in tree]
+    node = location.sub_locations['0']
+
+    def clear():
+        for defect in defects:
+            defect.update_qty(1, node, check)
+        subject.clear_defects(check)
+
+    seconds = timeit.timeit(clear, number=number)
+    return seconds / number * 1e6
+
+
+def main():
+    print('{:>10} {:>12}'.format('chars', 'us/check'))
+    for size in (10, 100, 400, 1000, 5000):
+        print('{:>10} {:>12.2f}'.format(size, lookup_cost(size)))
+
+    print()
+    print('{:>10} {:>12} {:>12}'.format('depth', 'defects', 'us/clear'))
+    for depth in (2, 8, 32, 128):
+        print('{:>10} {:>12} {:>12.2f}'.format(
+            depth, 11 * depth * 3, clear_cost(depth)
+        ))
+
+
+if __name__ == '__main__':
+    main()
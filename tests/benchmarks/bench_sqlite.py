@@ -0,0 +1,124 @@
+"""Benchmark of tests saved per second by sqlite TestSaver, row by row
+(one insert and lastrowid per object, as save did before) or in batches
+of tests with executemany, and of part upserts on growing Parts tables
+
+Run it with: python -m tests.benchmarks.bench_sqlite
+"""
+import datetime
+import os
+import tempfile
+import time
+from quactrl.data.sqlite import TestSaver
+
+
+class Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Check(Obj):
+    pass
+
+
+def create_test(serial_number, measurements):
+    now = datetime.datetime.now()
+    part = Obj(model=Obj(key='part_number'), serial_number=serial_number)
+    test = Obj(part=part, started_on=now, finished_on=now, state='success',
+               responsible=Obj(key='responsible'), cavity=1, actions=[])
+    for index in range(measurements):
+        characteristic = Obj(key='char{}'.format(index))
+        test.actions.append(Check(
+            test=test, started_on=now, finished_on=now, state='ok',
+            control=Obj(requirement=Obj(description='requirement')),
+            measurements=[Obj(characteristic=characteristic,
+                              tracking='', value=1.0)],
+            defects=[]
+        ))
+    return test
+
+
+def save_row_by_row(test_saver, tests):
+    for test in tests:
+        test_saver.upsert_part(test.part)
+        test_saver.insert_test(test)
+        for check in test.actions:
+            test_saver.insert_check(check)
+            for measurement in check.measurements:
+                test_saver.insert_measurement(measurement, check)
+        test_saver.conn.commit()
+
+
+def save_in_batches(test_saver, tests, batch):
+    for index in range(0, len(tests), batch):
+        test_saver.save_all(tests[index:index + batch])
+
+
+def tests_per_second(measurements, batch=None, number=50):
+    """Return tests saved per second, row by row if batch is None
+    """
+    tests = [create_test(str(serial_number), measurements)
+             for serial_number in range(number)]
+    with tempfile.TemporaryDirectory() as directory:
+        test_saver = TestSaver(os.path.join(directory, 'tests.db'))
+        started_on = time.perf_counter()
+        if batch is None:
+            save_row_by_row(test_saver, tests)
+        else:
+            save_in_batches(test_saver, tests, batch)
+        seconds = time.perf_counter() - started_on
+        test_saver.conn.close()
+    return number / seconds
+
+
+def upserts_per_second(parts, indexed=True, number=1000):
+    """Return part upserts per second on a Parts table of parts rows, on
+    a legacy table (without index) if not indexed
+    """
+    test_saver = TestSaver()
+    test_saver.conn.executemany(
+        'insert into Parts (part_number, serial_number) values (?, ?)',
+        (('part_number', str(index)) for index in range(parts))
+    )
+    if not indexed:
+        test_saver.conn.execute('drop index ix_parts_number')
+    test_saver.conn.commit()
+
+    step = max(parts // number, 1)
+    existing = [Obj(model=Obj(key='part_number'), serial_number=str(index))
+                for index in range(0, parts, step)][:number]
+    started_on = time.perf_counter()
+    for part in existing:
+        if indexed:
+            test_saver.upsert_part(part)
+        else:
+            test_saver.c.execute(
+                'select id from Parts where part_number=? and serial_number=?',
+                (part.model.key, part.serial_number)
+            )
+            test_saver.c.fetchone()
+    seconds = time.perf_counter() - started_on
+    test_saver.conn.close()
+    return len(existing) / seconds
+
+
+def main():
+    print('{:>14} {:>12} {:>12} {:>12}'.format(
+        'measurements', 'row by row', 'batch 1', 'batch 10'))
+    for measurements in (10, 100, 400):
+        print('{:>14} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            measurements, tests_per_second(measurements),
+            tests_per_second(measurements, 1),
+            tests_per_second(measurements, 10)
+        ))
+
+    print()
+    print('{:>14} {:>12} {:>12}'.format('parts', 'legacy scan', 'upsert'))
+    for parts in (10000, 100000, 1000000):
+        print('{:>14} {:>12.1f} {:>12.1f}'.format(
+            parts, upserts_per_second(parts, False, 100),
+            upserts_per_second(parts, True, 100)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark of CPU time per test executed and persisted on sqlalchemy,
+with test objects added to session before execution (default inspector
+mode) or once executed and master data kept loaded (deferred mode)
+
+Run it with: python -m tests.benchmarks.bench_testing
+"""
+import time
+from quactrl.data.sqlalchemy import Db
+import quactrl.models.hhrr as hr
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+import quactrl.models.quality as qua
+
+
+def measure(check, value):
+    check.add_measurement(check.control.requirement, value, check.part)
+
+
+def create_master_data(session, checks):
+    role = hr.Role('tester', 'tester')
+    person = hr.Person('person', 'person', 'person')
+    person.add_role(role)
+    part_model = prd.PartModel('part_number')
+    control_plan = qua.ControlPlan(role, source=op.Location('station'),
+                                   destination=op.Location('ok'),
+                                   outputs=[part_model])
+    element = prd.Element('e')
+    for index in range(checks):
+        characteristic = prd.Characteristic(
+            prd.Attribute('a{}'.format(index)), element
+        )
+        characteristic.add_failure_mode(qua.Mode('hi{}'.format(index)))
+        requirement = prd.Requirement(characteristic,
+                                      '{}>X'.format(characteristic.key),
+                                      {'limits': [0, 10]})
+        control_plan.steps.append(
+            qua.Control(control_plan, requirement,
+                        'tests.benchmarks.bench_testing.measure',
+                        {'value': 5})
+        )
+    session.add(control_plan)
+    session.add(person)
+    session.commit()
+    return control_plan, person, part_model
+
+
+def cost_per_test(checks, deferred, number=20):
+    """Return CPU milliseconds per test of checks controls, as executed
+    by Inspector.run_test
+    """
+    db = Db('sqlite://')
+    db.create_schema()
+    session = db.Session()
+    session.expire_on_commit = not deferred
+    control_plan, person, part_model = create_master_data(session, checks)
+    plan = control_plan.compile()
+
+    started_on = time.process_time()
+    for serial_number in range(number):
+        part = prd.Part(part_model, str(serial_number))
+        test = control_plan.implement(person)
+        if not deferred:
+            session.add(test)
+            session.add(part)
+        test.start(part=part, toolbox=None, devices={}, cavity=None,
+                   tff=False, plan=plan)
+        test.walk()
+        test.execute()
+        test.close()
+        if deferred:
+            session.add(test)
+            session.add(part)
+        session.commit()
+
+    seconds = time.process_time() - started_on
+    db.drop_all()
+    return seconds / number * 1e3
+
+
+def main():
+    print('{:>10} {:>14} {:>14}'.format('checks', 'ms/test', 'ms/test defer'))
+    for checks in (10, 50, 200):
+        print('{:>10} {:>14.2f} {:>14.2f}'.format(
+            checks, cost_per_test(checks, False), cost_per_test(checks, True)
+        ))
+
+
+if __name__ == '__main__':
+    main()
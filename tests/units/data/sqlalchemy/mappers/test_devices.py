@@ -1,4 +1,5 @@
-from quactrl.data.sqlalchemy.mappers import core, devices
+from quactrl.data.sqlalchemy.mappers import (core, products, operations,
+                                             quality, devices)
 from quactrl.models.devices import DeviceModel, Device
 from . import TestMapper
 
@@ -25,3 +25,14 @@ class A_OperationMapper(TestMapper):
         # session.add(operation)
 
         # session.commit()
+
+    def should_expire_plans_when_routes_change(self):
+        route = op.Route(None)
+        step = op.Step(route, 'quactrl.helpers.is_num', {'par': 1})
+        route.steps.append(step)
+        other = op.Route(None)
+        plan, other_plan = route.compile(), other.compile()
+
+        step.method_pars['par'] = 2
+        assert plan.is_expired
+        assert not other_plan.is_expired
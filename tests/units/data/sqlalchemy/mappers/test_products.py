@@ -42,6 +42,21 @@ class A_ProductsMapper(TestMapper):
         req = session.query(prd.Requirement).filter(prd.Requirement.key == 'req_key').first()
         req.requirements['sub_key'].specs['max_abs'] == 1
 
+    def should_invalidate_requirement_when_specs_change(self):
+        characteristic = prd.Characteristic(prd.Attribute('inv_a'),
+                                            prd.Element('inv_e'))
+        requirement = prd.Requirement(characteristic, 'inv_a@inv_e>A',
+                                      specs={'limits': [1, 2]})
+        session = self.Session()
+        session.add(requirement)
+        session.commit()
+
+        evaluator = requirement.evaluator
+        requirement.specs['limits'] = [0, 5]
+
+        assert requirement.evaluator is not evaluator
+        assert requirement.evaluator.high_limit == 5
+
 
     def should_link_failure_modes_to_characteristics(self):
         session = self.Session()
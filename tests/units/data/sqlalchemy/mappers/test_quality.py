@@ -32,3 +32,18 @@ class A_QualityMapper(TestMapper):
         assert subject.measurements[0].tracking == '1234/a@e>A'
 
         assert subject.measurements[0].subject == subject
+
+    def should_reindex_subjects_when_items_are_removed(self):
+        subject = qua.Subject(tracking='1234')
+        characteristic = prd.Characteristic(prd.Attribute('a'),
+                                            prd.Element('e'))
+        measurements = [qua.Measurement(characteristic, '1234/' + key, None)
+                        for key in 'abc']
+        subject.measurements.extend(measurements)
+        assert subject.measurement_index.get('1234/b') is measurements[1]
+
+        subject.measurements[1] = qua.Measurement(characteristic, '1234/d',
+                                                  None)
+
+        assert subject.measurement_index.get('1234/b') is None
+        assert subject.measurement_index.get('1234/d') is not None
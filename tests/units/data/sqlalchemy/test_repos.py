@@ -0,0 +1,188 @@
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import event
+from quactrl.data import Data
+import quactrl.models.devices as dev
+import quactrl.models.hhrr as hr
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+import quactrl.models.quality as qua
+
+
+def check(check):
+    pass
+
+
+def run_on_thread(function):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(function()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+class A_KeyRepo:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = Data('sqlalchemy', 'sqlite:///' + os.path.join(
+            self.directory.name, 'db'), cache_ttl=0.5)
+        self.data.create_schema()
+        session = self.data.Session()
+        session.add(hr.Person('person', 'name', 'person'))
+        session.commit()
+        session.close()
+
+        self.statements = []
+        event.listen(self.data.db.engine, 'before_cursor_execute',
+                     self.record)
+
+    def teardown_method(self, method):
+        self.directory.cleanup()
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append(statement)
+
+    def get_person(self):
+        person = self.data.Persons().get('person')
+        return person, person.name, person in self.data.Session()
+
+    def should_share_resources_between_sessions_without_queries(self):
+        person, name, in_session = self.get_person()
+        assert len(self.statements) == 1
+
+        other, other_name, other_in_session = run_on_thread(self.get_person)
+        self.data.Session().commit()  # Expires person
+        assert self.get_person()[:2] == (person, 'name')
+
+        assert len(self.statements) == 1
+        assert other is not person
+        assert in_session and other_in_session and other_name == 'name'
+        assert self.data.db.cache.metrics == {
+            'hits': 2, 'misses': 1, 'invalidations': 0}
+
+    def should_drop_resources_changed_by_any_session(self):
+        person = self.data.Persons().get('person')
+        person.name = 'new name'
+        self.data.Session().commit()
+
+        other, name, _ = run_on_thread(self.get_person)
+
+        assert name == 'new name'
+        assert self.data.db.cache.metrics['invalidations'] == 1
+        assert self.data.db.cache.metrics['misses'] == 2
+
+    def should_read_again_resources_after_ttl_or_invalidation(self):
+        self.data.Persons().get('person')
+        time.sleep(0.5)
+        run_on_thread(self.get_person)
+        self.data.db.cache.invalidate(hr.Person)
+        run_on_thread(self.get_person)
+
+        assert self.data.db.cache.metrics['misses'] == 3
+        assert self.data.db.cache.hit_ratio == 0.0
+
+
+class A_ControlPlanRepo:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = Data('sqlalchemy', 'sqlite:///' + os.path.join(
+            self.directory.name, 'db'))
+        self.data.create_schema()
+        session = self.data.Session()
+        self.location = op.Location('station')
+        model = prd.PartModel('model')
+        group = prd.PartGroup('group', 'group')
+        group.models.append(model)
+        other_model = prd.PartModel('other')
+        group.models.append(other_model)
+        session.add_all([
+            self.create_plan('group', [group], 5),
+            self.create_plan('model', [model], 1)
+        ])
+        session.commit()
+        session.close()
+
+        self.statements = []
+        event.listen(self.data.db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     self.statements.append(statement))
+
+    def teardown_method(self, method):
+        self.directory.cleanup()
+
+    def create_plan(self, key, outputs, checks):
+        control_plan = qua.ControlPlan(
+            hr.Role(key, key), source=self.location,
+            destination=op.Location(key), outputs=outputs)
+        element = prd.Element(key)
+        for index in range(checks):
+            name = '{}{}'.format(key, index)
+            characteristic = prd.Characteristic(prd.Attribute(name), element)
+            characteristic.add_failure_mode(qua.Mode(name))
+            control_plan.steps.append(qua.Control(
+                control_plan, prd.Requirement(
+                    characteristic, '{}>X'.format(characteristic.key),
+                    {'limits': [0, 10]}),
+                'tests.units.data.sqlalchemy.test_repos.check', {}))
+        return control_plan
+
+    def get_plan(self, part_number):
+        part_model = self.data.PartModels().get(part_number)
+        location = self.data.Locations().get('station')
+        del self.statements[:]
+        control_plan = self.data.ControlPlans().get_by(part_model, location)
+        control_plan.compile()
+        return control_plan, len(self.statements)
+
+    def should_prefer_plan_of_part_model_to_plan_of_groups(self):
+        control_plan, _ = self.get_plan('model')
+
+        assert control_plan.role.key == 'model'
+
+    def should_load_plans_with_a_fixed_number_of_queries(self):
+        control_plan, queries = self.get_plan('other')
+        _, model_queries = run_on_thread(lambda: self.get_plan('model'))
+
+        assert control_plan.role.key == 'group'
+        assert len(control_plan.steps) == 5
+        assert queries == model_queries
+
+
+class A_DeviceRepo:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = Data('sqlalchemy', 'sqlite:///' + os.path.join(
+            self.directory.name, 'db'))
+        self.data.create_schema()
+        self.session = self.data.Session()
+        station, other = op.Location('station'), op.Location('other')
+        model = dev.DeviceModel('meter', 'meter', pars={'class': 'Meter'})
+        self.devices = {tracking: dev.Device(model, tracking)
+                        for tracking in ('kept', 'moved', 'away')}
+        self.devices['kept'].add(station)
+        self.devices['moved'].add(station)
+        self.devices['moved'].move(station, other, None)
+        self.devices['away'].add(other)
+        self.session.add_all(list(self.devices.values()))
+        self.session.commit()
+        self.session.close()
+
+    def teardown_method(self, method):
+        self.directory.cleanup()
+
+    def should_get_devices_with_current_stock_on_location(self):
+        statements = []
+        event.listen(self.data.db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     statements.append(statement))
+
+        devices = self.data.Devices().get_all_from('station')
+
+        assert [device.tracking for device in devices] == ['kept']
+        assert devices[0].model.class_name == 'Meter'
+        assert len(statements) == 1
+        assert self.data.Devices().get_all_from('missing') == []
@@ -0,0 +1,85 @@
+import os
+import tempfile
+from sqlalchemy import event, text
+from quactrl.data import Data
+import quactrl.models.hhrr as hr
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+import quactrl.models.quality as qua
+
+
+class A_SamplingState:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = Data('sqlalchemy', 'sqlite:///' + os.path.join(
+            self.directory.name, 'db'))
+        self.data.create_schema()
+        self.session = self.data.Session()
+        role = hr.Role('role', 'role')
+        self.person = hr.Person('person', 'person', 'person')
+        self.person.add_role(role)
+        self.location = op.Location('station')
+        self.control_plan = qua.ControlPlan(role, source=self.location)
+        requirement = prd.Requirement(
+            prd.Characteristic(prd.Attribute('a'), prd.Element('e')), 'a@e')
+        self.control = qua.Control(
+            self.control_plan, requirement, 'quactrl.helpers.is_num',
+            sampling={'plan': 'units', 'quantity': 1, 'frequency': 3})
+        self.control_plan.steps.append(self.control)
+        self.session.add_all([self.control_plan, self.person])
+        self.session.commit()
+
+        self.statements = []
+        event.listen(self.data.db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     self.statements.append(statement))
+
+    def teardown_method(self, method):
+        qua.Sampling._registry.clear()
+        self.session.close()
+        self.directory.cleanup()
+
+    def should_be_saved_with_tests_apart_from_controls(self):
+        for _ in range(2):
+            test = self.control_plan.implement(self.person)
+            self.control.implement(test)
+            self.session.add(test)
+        self.session.commit()
+
+        assert self.session.execute(text(
+            'select path_id, node_id, state from sampling_state'
+        )).fetchall() == [(self.control.id, self.location.id,
+                           '{"counter": 2}')]
+        assert not [statement for statement in self.statements
+                    if statement.startswith('UPDATE path')]
+
+    def should_be_restored_by_new_processes(self):
+        test = self.control_plan.implement(self.person)
+        assert self.control.implement(test)
+        self.session.add(test)
+        self.session.commit()
+        qua.Sampling._registry.clear()  # As a restarted process
+        self.session.close()
+
+        control = self.session.query(qua.Control).one()
+        person = self.session.query(hr.Person).one()
+        test = control.control_plan.implement(person)
+
+        assert control.get_sampling_state(
+            control.control_plan.source) == {'counter': 1}
+        assert control.implement(test) is None
+
+    def should_be_counted_by_planned_controls_without_loading_them(self):
+        plan = self.control_plan.compile()
+        test = self.control_plan.implement(self.person)
+        assert plan.steps[0].implement(test)
+        self.session.commit()  # Expires control plan and its controls
+        key = (self.control.id, self.location.id)
+        del self.statements[:]
+
+        test = qua.Test(plan.route, self.person)
+        checks = [plan.steps[0].implement(test) for _ in range(2)]
+
+        assert checks == [None, None]
+        assert test.sampling_states == {key: {'counter': 0}}
+        assert self.statements == []
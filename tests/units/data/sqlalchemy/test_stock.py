@@ -0,0 +1,88 @@
+import os
+import tempfile
+from sqlalchemy import text
+from quactrl.data import Data
+import quactrl.models.core as core
+import quactrl.models.hhrr as hr
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+
+
+class A_Stock:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = Data('sqlalchemy', 'sqlite:///' + os.path.join(
+            self.directory.name, 'db'))
+        self.data.create_schema()
+        self.session = self.data.Session()
+        self.store, self.line = op.Location('store'), op.Location('line')
+        self.part = prd.Part(prd.PartModel('part_number'), '1')
+        self.part.add(self.store)
+        self.session.add(self.part)
+        self.session.commit()
+
+    def teardown_method(self, method):
+        self.session.close()
+        self.directory.cleanup()
+
+    def get_stock(self):
+        return self.session.execute(text(
+            'select node.key, stock.qty from stock '
+            'join node on node.id = stock.node_id order by node.key'
+        )).fetchall()
+
+    def should_follow_current_tokens_on_same_transaction(self):
+        assert self.get_stock() == [('store', 1)]
+
+        flow = core.Flow(hr.Person('person', 'person', 'person'))
+        self.part.move(self.store, self.line, flow)
+        self.session.flush()
+        assert self.get_stock() == [('line', 1)]
+
+        self.part.undo_flow(flow)
+        self.session.flush()
+        assert self.get_stock() == [('store', 1)]
+
+        self.session.rollback()
+        assert self.get_stock() == [('store', 1)]
+        assert self.data.db.check_stock() == ([], [])
+
+    def should_be_rebuilt_from_token_history(self):
+        self.session.execute(text('update stock set qty=2'))
+        self.session.commit()
+        missing, unexpected = self.data.db.check_stock()
+        assert len(missing) == len(unexpected) == 1
+
+        self.data.db.rebuild_stock()
+
+        assert self.data.db.check_stock() == ([], [])
+        assert self.get_stock() == [('store', 1)]
+
+    def should_be_created_on_databases_of_previous_versions(self):
+        self.session.execute(text('drop table stock'))
+        self.session.commit()
+
+        self.data.create_schema()
+
+        assert self.get_stock() == [('store', 1)]
+
+    def should_be_created_when_databases_of_previous_versions_are_opened(self):
+        self.session.execute(text('drop table stock'))
+        self.session.execute(text('drop table sampling_state'))
+        self.session.execute(text('drop table serial_counter'))
+        self.session.commit()
+
+        db = Data('sqlalchemy', str(self.data.db.engine.url)).db
+
+        for name in ('stock', 'sampling_state', 'serial_counter'):
+            assert db.engine.has_table(name)
+        assert self.get_stock() == [('store', 1)]
+        assert db.check_stock() == ([], [])
+
+    def should_be_created_when_rebuilt(self):
+        self.session.execute(text('drop table stock'))
+        self.session.commit()
+
+        self.data.db.rebuild_stock()
+
+        assert self.get_stock() == [('store', 1)]
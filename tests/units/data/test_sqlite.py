@@ -1,8 +1,38 @@
 from unittest.mock import Mock
 import datetime
+import sqlite3
+import pytest
 from quactrl.data.sqlite import TestSaver
 
 
+class Check:
+    def __init__(self, test, measurements=1, defects=1):
+        self.test = test
+        self.started_on = self.finished_on = datetime.datetime.now()
+        self.control = Mock()
+        self.control.requirement.description = 'requirement'
+        self.state = 'ok'
+        self.measurements = [Mock(tracking=str(index), value=1.0)
+                             for index in range(measurements)]
+        for measurement in self.measurements:
+            measurement.characteristic.key = 'char'
+        self.defects = [Mock(tracking=str(index)) for index in range(defects)]
+        for defect in self.defects:
+            defect.failure_mode.key = 'fa'
+
+
+def create_test(serial_number, checks=2):
+    test = Mock(_id=None, started_on=datetime.datetime.now(),
+                finished_on=None, state='success', cavity=1)
+    test.responsible.key = 'sruiz'
+    test.part.serial_number = serial_number
+    test.part.model.key = 'part_number'
+    action = Mock(started_on=None, finished_on=None, state='done')
+    action.step.method_name = 'method'
+    test.actions = [Check(test) for _ in range(checks)] + [action]
+    return test
+
+
 class A_TestSaver:
     def setup_method(self, method):
         test = Mock()
@@ -123,3 +153,143 @@ class A_TestSaver:
     def should_clear(self):
         test_saver = TestSaver()
         test_saver.save(self.test)
+
+
+class A_BatchedTestSaver:
+    def should_save_many_tests_with_bulk_ids(self):
+        test_saver = TestSaver()
+        tests = [create_test('1'), create_test('2'), create_test('1')]
+
+        test_saver.save_all(tests)
+
+        assert [test._id for test in tests] == [1, 2, 3]
+        assert [test.part._id for test in tests] == [1, 2, 1]
+        assert [action._id for action in tests[1].actions] == [4, 5, 6]
+        assert tests[2].actions[1].measurements[0]._id == 6
+        test_saver.c.execute('select fk_check from Measurements where id=6')
+        assert test_saver.c.fetchone() == (8,)
+        test_saver.c.execute('select count(*) from Actions')
+        assert test_saver.c.fetchone() == (9,)
+
+    def should_continue_ids_of_previous_rows(self):
+        test_saver = TestSaver()
+        test_saver.save(create_test('1'))
+        test_saver.c.execute('delete from Tests')
+        test_saver.conn.commit()
+
+        test = create_test('1')
+        test_saver.save(test)
+
+        assert test._id == 2
+        assert test.part._id == 1
+
+    def should_rollback_all_tests_when_one_fails(self):
+        test_saver = TestSaver()
+        wrong = create_test('2')
+        wrong.cavity = object()
+
+        with pytest.raises(Exception):
+            test_saver.save_all([create_test('1'), wrong])
+
+        test_saver.c.execute('select count(*) from Parts')
+        assert test_saver.c.fetchone() == (0,)
+        assert wrong._id is None
+
+
+class A_MigratedTestSaver:
+    def create_legacy_file(self, path):
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE Parts (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'part_number TEXT, serial_number TEXT)')
+        conn.execute('CREATE TABLE Tests (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'fk_part INTEGER, started_on TEXT, finished_on TEXT, '
+                     'responsible_key TEXT, state TEXT, cavity INTEGER)')
+        conn.execute('CREATE TABLE Actions (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'fk_test INTEGER, started_on TEXT, finished_on TEXT, '
+                     'description TEXT, state TEXT)')
+        conn.execute('CREATE TABLE Measurements (id INTEGER PRIMARY KEY '
+                     'AUTOINCREMENT, fk_check INTEGER, char_key TEXT, '
+                     'tracking TEXT, value REAL)')
+        conn.execute('CREATE TABLE Defects (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'fk_check INTEGER, failure_key TEXT, tracking TEXT)')
+        conn.executemany('insert into Parts values (?, ?, ?)', [
+            (1, 'part_number', '1'), (2, 'part_number', '2'),
+            (3, 'part_number', '1')
+        ])
+        conn.executemany('insert into Tests (id, fk_part) values (?, ?)',
+                         [(1, 1), (2, 2), (3, 3)])
+        conn.commit()
+        conn.close()
+
+    def should_merge_repeated_parts_of_legacy_files(self, tmpdir):
+        path = str(tmpdir.join('tests.db'))
+        self.create_legacy_file(path)
+
+        test_saver = TestSaver(path, create_schema=True, keep_data=True)
+
+        test_saver.c.execute('select id from Parts order by id')
+        assert test_saver.c.fetchall() == [(1,), (2,)]
+        test_saver.c.execute('select fk_part from Tests order by id')
+        assert test_saver.c.fetchall() == [(1,), (2,), (1,)]
+        test_saver.c.execute('PRAGMA user_version')
+        assert test_saver.c.fetchone() == (TestSaver.SCHEMA_VERSION,)
+
+    def should_look_up_parts_by_index(self):
+        test_saver = TestSaver()
+        test_saver.c.execute(
+            'explain query plan select id from Parts '
+            'where part_number=? and serial_number=?', ('part_number', '1'))
+
+        assert 'ix_parts_number' in test_saver.c.fetchone()[-1]
+
+    def should_keep_parts_unique(self):
+        test_saver = TestSaver()
+        test = create_test('1')
+        test_saver.save(test)
+
+        with pytest.raises(sqlite3.IntegrityError):
+            test_saver.c.execute(
+                'insert into Parts (part_number, serial_number) values (?, ?)',
+                ('part_number', '1'))
+
+        test_saver.conn.rollback()
+        test_saver.upsert_part(test.part)
+        assert test.part._id == 1
+
+
+    def should_keep_data_of_existing_files_unless_asked(self, tmpdir):
+        path = str(tmpdir.join('tests.db'))
+        test_saver = TestSaver(path)
+        test_saver.save(create_test('1'))
+        test_saver.reserve_serial_numbers('pn', '1906')
+
+        test_saver = TestSaver(path)
+        test_saver.c.execute('select count(*) from Tests')
+        assert test_saver.c.fetchone() == (1,)
+        assert test_saver.reserve_serial_numbers('pn', '1906') == range(2, 3)
+
+        test_saver = TestSaver(path, keep_data=False)
+        test_saver.c.execute('select count(*) from Tests')
+        assert test_saver.c.fetchone() == (0,)
+
+
+class A_SerialCounter:
+    def should_reserve_sequences_once_for_all_connections(self, tmpdir):
+        path = str(tmpdir.join('tests.db'))
+        test_saver = TestSaver(path)
+        other = TestSaver(path, keep_data=True)
+
+        assert test_saver.reserve_serial_numbers('pn', '1906', 2) == range(1, 3)
+        assert other.reserve_serial_numbers('pn', '1906') == range(3, 4)
+        assert test_saver.reserve_serial_numbers('pn', '1907') == range(1, 2)
+
+    def should_start_new_counters_after_last_serial_number(self):
+        test_saver = TestSaver()
+        test_saver.save(create_test('190600012'))
+
+        assert test_saver.reserve_serial_numbers(
+            'part_number', '1906', pos=0) == range(13, 14)
+        assert test_saver.reserve_serial_numbers(
+            'part_number', '1906', pos=0) == range(14, 15)
+        assert test_saver.reserve_serial_numbers(
+            'part_number', '1907') == range(1, 2)
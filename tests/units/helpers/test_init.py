@@ -1,4 +1,5 @@
-from quactrl.helpers import get_class
+from unittest.mock import patch
+from quactrl.helpers import get_class, Resolver
 
 class FakeClass:
     pass
@@ -6,3 +7,25 @@ class FakeClass:
 
 def test_get_class():
     assert get_class('tests.unit.helpers.test_init.FakeClass') == FakeClass
+
+
+class A_Resolver:
+    def should_cache_resolved_components(self):
+        resolver = Resolver()
+        name = 'tests.units.helpers.test_init.FakeClass'
+
+        assert resolver.get(name) is FakeClass
+        with patch('quactrl.helpers._get') as mock_get:
+            assert resolver.get(name) is FakeClass
+            mock_get.assert_not_called()
+
+    def should_return_errors_on_prewarm(self):
+        resolver = Resolver()
+        errors = resolver.prewarm([
+            'tests.units.helpers.test_init.FakeClass',
+            'tests.units.helpers.test_init.Missing',
+            'not_a_module.function'
+        ])
+
+        assert set(errors) == {'tests.units.helpers.test_init.Missing',
+                               'not_a_module.function'}
@@ -0,0 +1,74 @@
+from unittest.mock import Mock
+import quactrl.models.core as c
+
+
+class An_Item:
+    def should_update_qty_on_a_node(self):
+        item = c.Item()
+        node = Mock()
+        item.update_qty(3, node, 'flow_1')
+        item.update_qty(5, node, 'flow_2')
+
+        assert item.qty == 5
+        assert item.stocks == {node: 5}
+        assert len(item.tokens) == 2
+        assert not item.tokens[0].current
+        assert item.get_token(node) is item.tokens[1]
+
+    def should_move_qty_between_nodes(self):
+        item = c.Item()
+        from_node = Mock()
+        to_node = Mock()
+        item.update_qty(5, from_node, 'flow_1')
+
+        item.move(from_node, to_node, 'flow_2', 2)
+
+        assert item.stocks == {from_node: 3, to_node: 2}
+        assert item.qty == 5
+
+    def should_clear_a_node(self):
+        item = c.Item()
+        node = Mock()
+        item.clear(node, 'flow_1')
+        item.update_qty(5, node, 'flow_2')
+        item.clear(node, 'flow_3')
+
+        assert item.stocks == {}
+        assert item.get_token(node).qty == 0
+
+    def should_undo_a_flow(self):
+        item = c.Item()
+        node = Mock()
+        item.update_qty(3, node, 'flow_1')
+        item.update_qty(5, node, 'flow_2')
+
+        item.undo_flow('flow_2')
+
+        assert item.stocks == {node: 3}
+        assert item.tokens[0].current
+        assert len(item.tokens) == 1
+
+    def should_index_current_tokens_from_history(self):
+        node = Mock()
+        item = c.Item()
+        old_token = c.Token(item, node, 3, 'flow_1')
+        old_token.current = False
+        item.tokens = [old_token, c.Token(item, node, 4, 'flow_2')]
+
+        assert item.stocks == {node: 4}
+
+
+class An_UnitaryItem:
+    def should_move_its_location(self):
+        item = c.UnitaryItem()
+        from_node = Mock()
+        to_node = Mock()
+        item.add(from_node, 'flow_1')
+        assert item.location == from_node
+
+        item.move(from_node, to_node, 'flow_2')
+        assert item.location == to_node
+        assert item.stocks == {to_node: 1}
+
+        item.undo_flow('flow_2')
+        assert item.location == from_node
@@ -1,5 +1,45 @@
 from unittest.mock import Mock, patch
+import threading
+import time
+import pytest
 import quactrl.models.operations as o
+import quactrl.models.hhrr as h
+from quactrl.models.scheduling import DeviceScheduler
+
+
+_calls = []
+_calls_lock = threading.Lock()
+
+
+def record(action, name, wait=0, fail=False):
+    """Step method recording its start and end"""
+    with _calls_lock:
+        _calls.append(('start', name))
+    time.sleep(wait)
+    if fail:
+        raise ValueError(name)
+    with _calls_lock:
+        _calls.append(('end', name))
+
+
+def create_route(*steps_pars):
+    role = h.Role('role', 'role')
+    route = o.Route(role)
+    for pars in steps_pars:
+        step = o.Step(route, 'tests.units.models.test_operations.record', pars)
+        route.steps.append(step)
+    return route, role
+
+
+def walk(route, role, **inputs):
+    del _calls[:]
+    operation = route.implement(role)
+    operation.start(**inputs)
+    try:
+        operation.walk()
+    finally:
+        result = list(_calls)
+    return operation, result
 
 
 class An_Operation:
@@ -131,3 +171,217 @@ class A_Route:
 
         mock_Operation.assert_called_with(route, parent_op, None)
         assert operation is mock_Operation.return_value
+
+
+class A_ConcurrentWalk:
+    def should_be_sequential_without_dependencies(self):
+        route, role = create_route({'name': 'a'}, {'name': 'b'})
+        assert route.get_dependencies() is None
+
+        operation, calls = walk(route, role)
+        assert calls == [('start', 'a'), ('end', 'a'),
+                         ('start', 'b'), ('end', 'b')]
+        assert operation.status == 'walked'
+
+    def should_run_independent_steps_concurrently(self):
+        route, role = create_route(
+            *[{'name': name, 'wait': 0.2, 'depends_on': []}
+              for name in 'abc']
+        )
+
+        started = time.time()
+        operation, calls = walk(route, role)
+
+        assert time.time() - started < 0.5
+        assert [action.step for action in operation.actions] == route.steps
+        assert all(action.status == 'closed' for action in operation.actions)
+        assert operation.status == 'walked'
+
+    def should_respect_dependencies(self):
+        route, role = create_route(
+            {'name': 'a', 'wait': 0.1, 'depends_on': []},
+            {'name': 'b', 'depends_on': []},
+            {'name': 'c', 'depends_on': [0]}
+        )
+        assert route.get_dependencies() == [set(), set(), {0}]
+
+        operation, calls = walk(route, role)
+        assert calls.index(('end', 'a')) < calls.index(('start', 'c'))
+        assert [action.step for action in operation.actions] == route.steps
+
+    def should_raise_first_failure_once_running_actions_finish(self):
+        route, role = create_route(
+            {'name': 'a', 'fail': True, 'depends_on': []},
+            {'name': 'b', 'wait': 0.1, 'depends_on': []},
+            {'name': 'c', 'depends_on': [0]}
+        )
+
+        with pytest.raises(ValueError):
+            walk(route, role)
+
+        assert ('end', 'b') in _calls
+        assert ('start', 'c') not in _calls
+
+    def should_start_and_close_actions_on_walking_thread(self):
+        route, role = create_route(
+            *[{'name': name, 'wait': 0.1, 'depends_on': []} for name in 'ab']
+        )
+        threads = []
+        close = o.Action.close
+
+        def record_close(action):
+            threads.append(threading.current_thread())
+            close(action)
+
+        with patch.object(o.Action, 'close', record_close):
+            operation, calls = walk(route, role)
+
+        assert threads == [threading.current_thread()] * 2
+        assert len(calls) == 4
+
+    def should_not_depend_on_next_steps(self):
+        route, role = create_route({'name': 'a', 'depends_on': [5]},
+                                   {'name': 'b'})
+        with pytest.raises(ValueError):
+            route.get_dependencies()
+
+
+class A_DeviceScheduledWalk:
+    def should_wait_for_device_steps_on_next_step_without_devices(self):
+        route, role = create_route(
+            {'name': 'a'},
+            {'name': 'b', 'devices': ['dmm']},
+            {'name': 'c', 'devices': ['source']},
+            {'name': 'd'}
+        )
+        assert route.get_dependencies() == [set(), {0}, {0}, {1, 2}]
+
+    def should_run_steps_with_different_devices_concurrently(self):
+        route, role = create_route(
+            {'name': 'a', 'wait': 0.2, 'devices': ['dmm']},
+            {'name': 'b', 'wait': 0.2, 'devices': ['source']}
+        )
+
+        started = time.time()
+        operation, calls = walk(route, role)
+
+        assert time.time() - started < 0.35
+        assert set(operation.utilization['actual']['devices']) == {
+            'dmm', 'source'}
+        assert operation.utilization['planned']['time'] == 1.0
+
+    def should_not_overlap_steps_sharing_a_device(self):
+        route, role = create_route(
+            {'name': 'a', 'wait': 0.1, 'devices': ['dmm']},
+            {'name': 'b', 'devices': ['dmm', 'source']},
+            {'name': 'c', 'devices': ['source']}
+        )
+
+        operation, calls = walk(route, role)
+
+        assert calls.index(('end', 'a')) < calls.index(('start', 'b'))
+        assert calls[:2] == [('start', 'a'), ('start', 'c')]
+        assert [action.step for action in operation.actions] == route.steps
+
+    def should_share_devices_between_operations(self):
+        toolbox = Mock(scheduler=DeviceScheduler())
+        route, role = create_route({'name': 'a', 'devices': ['dmm']})
+        toolbox.scheduler.reserve(['dmm'], 'other')
+        threading.Timer(
+            0.2, toolbox.scheduler.release, (['dmm'], 'other')
+        ).start()
+
+        started = time.time()
+        walk(route, role, toolbox=toolbox)
+
+        assert time.time() - started >= 0.2
+        assert toolbox.scheduler.get_owner('dmm') is None
+
+    def should_reserve_devices_of_sequential_routes(self):
+        toolbox = Mock(scheduler=DeviceScheduler())
+        route, role = create_route({'name': 'a'}, {'name': 'b'})
+        route.method_pars['devices'] = ['dmm']
+        assert route.get_dependencies() is None
+        toolbox.scheduler.reserve(['dmm'], 'other')
+        threading.Timer(
+            0.2, toolbox.scheduler.release, (['dmm'], 'other')
+        ).start()
+
+        started = time.time()
+        walk(route, role, toolbox=toolbox)
+
+        assert time.time() - started >= 0.2
+        assert toolbox.scheduler.get_owner('dmm') is None
+
+    def should_run_steps_on_devices_reserved_for_their_route(self):
+        toolbox = Mock(scheduler=DeviceScheduler())
+        route, role = create_route(
+            {'name': 'a', 'wait': 0.1, 'devices': ['dmm']},
+            {'name': 'b', 'devices': ['dmm']}
+        )
+        route.method_pars['devices'] = ['dmm']
+
+        operation, calls = walk(route, role, toolbox=toolbox)
+
+        assert calls == [('start', 'a'), ('end', 'a'),
+                         ('start', 'b'), ('end', 'b')]
+        assert operation.status == 'walked'
+        assert toolbox.scheduler.get_owner('dmm') is None
+
+
+class An_ExecutionPlan:
+    def should_resolve_step_methods(self):
+        route, role = create_route({'name': 'a', 'devices': ['dmm']})
+        plan = route.compile()
+
+        planned = plan.steps[0]
+        assert planned.step is route.steps[0]
+        assert planned.method is record
+        assert planned.kwargs == {'name': 'a'}
+        assert planned.devices == ('dmm',)
+        assert plan.dependencies == (frozenset(),)
+
+    def should_be_used_by_operations_of_its_route(self):
+        route, role = create_route({'name': 'a'})
+        plan = route.compile()
+        route.steps[0].method_pars['name'] = 'changed'
+
+        operation, calls = walk(route, role, plan=plan)
+
+        assert calls == [('start', 'a'), ('end', 'a')]
+        assert operation.actions[0].planned is plan.steps[0]
+
+    def should_expire_when_master_data_changes(self):
+        route, role = create_route({'name': 'a'})
+        plan = route.compile()
+        assert not plan.is_expired
+
+        o.ExecutionPlan.expire_all()
+        assert plan.is_expired
+
+    def should_expire_after_its_ttl(self):
+        route, role = create_route({'name': 'a'})
+        plan = route.compile()
+
+        plan.compiled_on -= o.ExecutionPlan.ttl + 1
+
+        assert plan.is_expired
+
+    def should_prune_keys_of_collected_plans(self):
+        routes = [create_route({'name': 'a'})[0] for _ in range(100)]
+        for route in routes:
+            route.compile()
+
+        empty = [key for key, plans in o.ExecutionPlan._plans.items()
+                 if not plans]
+        assert len(empty) <= o.ExecutionPlan._prune_at < 200
+
+    def should_only_expire_when_its_route_or_steps_change(self):
+        route, role = create_route({'name': 'a'})
+        other, _ = create_route({'name': 'b'})
+        plan, other_plan = route.compile(), other.compile()
+
+        o.ExecutionPlan.expire(route.steps[0])
+
+        assert plan.is_expired
+        assert not other_plan.is_expired
@@ -0,0 +1,58 @@
+import quactrl.models.products as p
+import quactrl.models.quality as q
+
+
+def create_requirement(key='a@e>A', specs=None):
+    characteristic = p.Characteristic(p.Attribute('a'), p.Element('e'))
+    characteristic.add_failure_mode(q.Mode('hi'))
+    return p.Requirement(characteristic, key, specs)
+
+
+class A_Requirement:
+    def should_compile_eid_and_trackings(self):
+        requirement = create_requirement()
+
+        assert requirement.eid == 'A'
+        assert requirement.requi_key == ('a@e', 'A')
+        assert requirement.get_tracking() == 'a@e>A'
+        assert requirement.get_tracking(index=2) == 'a@e>A_02'
+        assert requirement.get_tracking('hi') == 'hi-a@e>A'
+        assert requirement.get_tracking('hi', 12) == 'hi-a@e>A_12'
+
+        requirement.key = 'a@e'
+        assert requirement.eid == ''
+        assert requirement.get_tracking('hi') == 'hi-a@e'
+
+    def should_compile_specs_once(self):
+        requirement = create_requirement(specs={'limits': [1, 2]})
+
+        evaluator = requirement.evaluator
+        assert requirement.evaluator is evaluator
+        assert evaluator.eval(3) == 'hi'
+
+        requirement.specs = {'max_abs': 5}
+        assert requirement.evaluator is not evaluator
+        assert requirement.evaluator.eval(-6) == 'hi'
+        assert requirement.evaluator.eval(3) is None
+
+    def should_invalidate_compiled_state(self):
+        requirement = create_requirement(specs={'limits': [1, 2]})
+        evaluator = requirement.evaluator
+
+        requirement.specs['limits'] = [0, 5]
+        requirement.invalidate()
+
+        assert requirement.evaluator is not evaluator
+        assert requirement.evaluator.eval(3) is None
+
+    def should_list_keys_of_its_subtree(self):
+        requirement = create_requirement()
+        assert requirement.subtree_keys == [('a@e', 'A')]
+
+        child = create_requirement('a@e>B')
+        requirement.add_requi(child)
+        assert requirement.subtree_keys == [('a@e', 'A'), ('a@e', 'B')]
+
+        child.add_requi(create_requirement('a@e>C'))
+        assert requirement.subtree_keys == [
+            ('a@e', 'A'), ('a@e', 'B'), ('a@e', 'C')]
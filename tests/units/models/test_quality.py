@@ -1,7 +1,223 @@
 from unittest.mock import Mock, patch
+import threading
+import timeit
+import pytest
 import quactrl.models.quality as q
+import quactrl.models.products as p
+import quactrl.models.operations as o
+import quactrl.models.hhrr as h
 
 
+def create_characteristic(key='a', modes=('hi',)):
+    characteristic = p.Characteristic(p.Attribute(key), p.Element('e'))
+    for mode in modes:
+        characteristic.add_failure_mode(q.Mode(mode))
+    return characteristic
+
+
+def create_requirement(key='a', eid='A', specs=None):
+    return p.Requirement(create_characteristic(key),
+                         '{}@e>{}'.format(key, eid), specs)
+
+
+def create_check(requirement):
+    role = h.Role('role', 'role')
+    person = h.Person('person', 'person', 'person')
+    person.add_role(role)
+    control_plan = q.ControlPlan(role)
+    control = q.Control(control_plan, requirement, 'method')
+    test = control_plan.implement(person)
+    check = q.Check(test, control)
+    check.measurements = []
+    check.defects = []
+    return check
+
+
+class A_Subject:
+    def should_get_or_create_measurements_by_tracking(self):
+        subject = q.Subject(tracking='1234')
+        requirement = create_requirement()
+
+        measurement = subject.get_measurement(requirement)
+        assert measurement.tracking == '1234/a@e>A'
+        assert subject.measurements == [measurement]
+        assert subject.get_measurement(requirement) is measurement
+
+        indexed = subject.get_measurement(requirement, 3)
+        assert indexed.tracking == '1234/a@e>A_03'
+        assert subject.measurements == [measurement, indexed]
+
+    def should_get_or_create_defects_by_tracking(self):
+        subject = q.Subject(tracking='1234')
+        requirement = create_requirement()
+
+        defect = subject.get_defect(requirement, 'hi')
+        assert defect.tracking == '1234/hi-a@e>A'
+        assert subject.get_defect(requirement, 'hi') is defect
+        assert subject.defects == [defect]
+
+    def should_have_a_lock_of_its_own(self):
+        subject, other = q.Subject(tracking='1'), q.Subject(tracking='2')
+
+        assert subject._lock is subject._lock
+        assert subject._lock is not other._lock
+
+    def should_keep_index_synced_with_lists(self):
+        subject = q.Subject(tracking='1234')
+        requirement = create_requirement()
+        measurement = q.Measurement(requirement.characteristic,
+                                    '1234/a@e>A', subject)
+        subject.measurements.append(measurement)
+        assert subject.get_measurement(requirement) is measurement
+
+        subject.measurements = []
+        other = subject.get_measurement(requirement)
+        assert other is not measurement
+        assert subject.measurements == [other]
+
+    def should_clear_defects_of_requirement_subtree(self):
+        requirements = [create_requirement(key) for key in ('a', 'b', 'c')]
+        parent, child, other = requirements
+        parent.add_requi(child)
+
+        location = o.Location('station')
+        location.sub_locations = {'station_1': o.Location('station_1')}
+        subject = q.Subject(tracking='1234')
+        defects = [subject.get_defect(requi, 'hi') for requi in requirements]
+        for defect in defects:
+            defect.update_qty(1, location.sub_locations['station_1'], 'flow')
+
+        check = Mock()
+        check.location = location
+        check.sub_locations = location.sub_locations
+        check.subtree_keys = parent.subtree_keys
+        subject.clear_defects(check)
+
+        assert [defect.qty for defect in defects] == [0, 0, 1]
+
+    def should_clear_defects_at_a_cost_independent_of_other_defects(self):
+        requirement = create_requirement()
+        failure_mode = requirement.characteristic.failure_modes['hi']
+        check = Mock(location=o.Location('station'), sub_locations={})
+        check.subtree_keys = ['{}@e'.format(index) for index in range(128)]
+
+        def get_cost(size):
+            subject = q.Subject(tracking='1234')
+            subject.defects.extend(
+                q.Defect(failure_mode, '1234/hi-a@e>A_{}'.format(index), None)
+                for index in range(size))
+            return min(timeit.repeat(lambda: subject.clear_defects(check),
+                                     number=10, repeat=5))
+
+        assert get_cost(5000) < 3 * get_cost(10)
+
+    def should_group_loaded_defects_by_requirement(self):
+        requirement = create_requirement()
+        failure_mode = requirement.characteristic.failure_modes['hi']
+        subject = q.Subject(tracking='1234')
+        subject.defects.append(
+            q.Defect(failure_mode, '1234/hi-a@e>A_02', subject)
+        )
+
+        defects = subject.defect_index.get_by_requi(('a@e', 'A'))
+        assert defects == subject.defects
+
+    def should_get_items_at_a_cost_independent_of_list_size(self):
+        characteristic = create_requirement().characteristic
+
+        def get_cost(size):
+            subject = q.Subject(tracking='1234')
+            subject.measurements.extend(
+                q.Measurement(characteristic, '1234/{}'.format(index), None)
+                for index in range(size))
+            index = subject.measurement_index
+            return min(timeit.repeat(lambda: index.get('1234/0'),
+                                     number=1000, repeat=5))
+
+        assert get_cost(5000) < 3 * get_cost(10)
+
+    def should_reindex_lists_changed_without_growing(self):
+        failure_mode = create_requirement().characteristic.failure_modes['hi']
+        subject = q.Subject(tracking='1234')
+        first = q.Defect(failure_mode, '1234/hi-a@e>A_01', None)
+        second = q.Defect(failure_mode, '1234/hi-a@e>A_02', None)
+        subject.defects.append(first)
+        assert subject.defect_index.get(first.tracking) is first
+
+        subject.defects.remove(first)
+        subject.defects.append(second)
+
+        assert subject.defect_index.get(first.tracking) is None
+        assert subject.defect_index.get_by_requi(('a@e', 'A')) == [second]
+
+
+class A_MeasurementBatch:
+    SPECS = [{}, {'limits': [3, 8]}, {'limits': [None, 8]},
+             {'limits': [3, None]}, {'limits': [8, 3]}, {'max_abs': 5}]
+    VALUES = [-9, -5.5, -5, -4.5, 0, 2.5, 3, 3.5, 5, 7.5, 8, 8.5, 100,
+              float('nan')]
+
+    def should_eval_values_as_scalar_eval_value(self):
+        characteristic = create_characteristic(modes=('fail', 'other'))
+        failure_modes = characteristic.failure_modes
+        measurement = q.Measurement(characteristic, 'tracking',
+                                    q.Subject(tracking='1234'))
+        for specs in self.SPECS:
+            for uncertainty in (0, 0.5, 1):
+                expected = [
+                    measurement.eval_value(value, specs, uncertainty)
+                    for value in self.VALUES
+                ]
+                mode_keys = q.eval_values(self.VALUES, specs, failure_modes,
+                                          uncertainty)
+                assert mode_keys.tolist() == expected
+
+    def should_add_measurements_and_defects_in_bulk(self):
+        requirement = create_requirement(specs={'limits': [0, 10]})
+        check = create_check(requirement)
+        subject = q.Subject(tracking='1234')
+
+        mode_keys = check.add_measurement(requirement, [1, 11, 5], subject,
+                                          index=[1, 2, 3])
+
+        assert mode_keys == [None, 'hi', None]
+        assert [m.tracking for m in check.measurements] == [
+            '1234/a@e>A_01', '1234/a@e>A_02', '1234/a@e>A_03'
+        ]
+        assert [m.value for m in check.measurements] == [1, 11, 5]
+        assert [d.tracking for d in check.defects] == ['1234/hi-a@e>A_02']
+
+    def should_index_values_in_bulk_from_a_scalar_index(self):
+        requirement = create_requirement(specs={'limits': [0, 10]})
+        check = create_check(requirement)
+        subject = q.Subject(tracking='1234')
+
+        mode_keys = check.add_measurement(requirement, [1, 11], subject,
+                                          index=4)
+
+        assert mode_keys == [None, 'hi']
+        assert [m.tracking for m in check.measurements] == [
+            '1234/a@e>A_04', '1234/a@e>A_05'
+        ]
+        assert [d.tracking for d in check.defects] == ['1234/hi-a@e>A_05']
+
+    def should_keep_results_added_out_of_its_thread_until_close(self):
+        requirement = create_requirement(specs={'limits': [0, 10]})
+        check = create_check(requirement)
+        subject = q.Subject(tracking='1234')
+        check.status = 'cancelled'  # Only kept results are added on close
+        check.keep_results()
+
+        assert check.add_measurement(requirement, 11, subject) == 'hi'
+        assert check.add_measurement(requirement, [1, 12], subject) == [
+            None, 'hi']
+        assert subject.measurements == subject.defects == []
+
+        check.close()
+        assert [m.value for m in check.measurements] == [11, 1, 12]
+        assert [d.tracking for d in check.defects] == [
+            '1234/hi-a@e>A', '1234/hi-a@e>A_01']
+
 
 class A_Check:
     def should_start(self):
@@ -176,6 +392,93 @@ class A_Control:
         assert control.create_operation(operation) is None
 
 
+class A_Sampling:
+    def create_control(self, sampling):
+        check = create_check(create_requirement())
+        control = check.control
+        control.method_pars['sampling'] = sampling
+        self.test = check.test
+        return control
+
+    def should_check_all_units_by_default(self):
+        control = self.create_control('100%')
+        assert all(control.implement(self.test) for _ in range(5))
+        assert self.test.sampling_states == {}
+
+    def should_check_quantity_of_each_frequency_units(self):
+        sampling = q.Sampling.create(
+            {'plan': 'units', 'quantity': 2, 'frequency': 5}
+        )
+        counts = [sampling.count(Mock()) for _ in range(10)]
+        assert counts == [True, True, False, False, False] * 2
+
+    @patch('quactrl.models.quality.time')
+    def should_check_quantity_units_every_period(self, mock_time):
+        sampling = q.Sampling.create(
+            {'plan': 'time', 'quantity': 1, 'period': 60}
+        )
+        counts = []
+        for now in (0, 10, 59, 60, 100, 130):
+            mock_time.time.return_value = now
+            counts.append(sampling.count(Mock()))
+
+        assert counts == [True, False, False, True, False, True]
+
+    def should_skip_lots_once_cleared(self):
+        sampling = q.Sampling.create(
+            {'plan': 'skip_lot', 'clearance': 2, 'frequency': 2}
+        )
+        operation = Mock()
+        results = []
+        for lot in ('a', 'a', 'b', 'c', 'c', 'd', 'e', 'f'):
+            operation.part.pars = {'batch_number': lot}
+            results.append(sampling.count(operation))
+            if lot == 'd':
+                check = Mock()
+                check.status = 'nok'
+                sampling.register(check)
+
+        assert results == [True, True, True, False, False, True, True, True]
+
+    def should_keep_state_on_tests_and_restore_it(self):
+        control = self.create_control(
+            {'plan': 'units', 'quantity': 1, 'frequency': 3}
+        )
+        assert control.implement(self.test)
+        assert control.implement(self.test) is None
+        assert self.test.sampling_states == {
+            (control, self.test.route.source): {'counter': 2}}
+        assert 'sampling_state' not in control.method_pars
+
+        control._sampling = None  # As a restarted inspector
+        control.sampling_states = [q.SamplingState(
+            control, self.test.route.source, {'counter': 2})]
+        assert control.implement(self.test) is None
+        assert control.implement(self.test)
+
+    def should_share_sampling_between_instances_of_a_control(self):
+        control = self.create_control(
+            {'plan': 'units', 'quantity': 1, 'frequency': 2}
+        )
+        other = self.create_control(
+            {'plan': 'units', 'quantity': 1, 'frequency': 2}
+        )
+        control.id = other.id = -1
+        location = o.Location('station')
+        location.id = -1
+        control.route.source = other.route.source = location
+        try:
+            assert control.implement(self.test)
+            assert other.implement(self.test) is None
+        finally:
+            q.Sampling._registry.pop((-1, -1))
+
+    def should_not_pass_control_pars_to_method(self):
+        control = self.create_control('100%')
+        control.method_pars.update({'reaction_name': 'reaction', 'par': 1})
+        assert control.method_kwargs == {'par': 1}
+
+
 class A_FailureMode:
     def should_insert_into_characteristic(self):
         characteristic = Mock()
@@ -195,3 +498,123 @@ class Sampling:
 
         assert sampling.count(operation)
         assert control.last_count == 2
+
+
+class A_ControlPlan:
+    def should_list_its_components(self):
+        requirement = create_requirement()
+        check = create_check(requirement)
+        control_plan = check.test.route
+        control_plan.method_name = 'plan.method'
+        control_plan.steps.append(check.control)
+        check.control.method_pars['reaction_name'] = 'reactions.mail'
+        model = p.PartModel('model', pars={'device_class': 'duts.Dut'})
+        control_plan.outputs.append(model)
+
+        assert control_plan.get_component_names() == {
+            'plan.method', 'method', 'reactions.mail', 'duts.Dut'}
+
+
+class An_InspectionPlan:
+    def should_resolve_check_locations_and_evaluators(self):
+        requirement = create_requirement(specs={'limits': [0, 1]})
+        check = create_check(requirement)
+        control_plan = check.test.route
+        check.control.method_name = 'quactrl.helpers.is_num'
+        control_plan.steps.append(check.control)
+        station = o.Location('station')
+        station.sub_locations = {'station_1': o.Location('station_1')}
+        control_plan.source = station
+
+        planned = control_plan.compile().steps[0]
+        assert planned.location is station
+        assert planned.cavity_locations['1'] is station.sub_locations['station_1']
+        assert planned.evaluator is requirement.evaluator
+
+        check.planned = planned
+        check.cavity = 1
+        check.tff = False
+        check.add_measurement(requirement, 3, q.Subject(tracking='1234'))
+        check.status = 'done'
+        check.close()
+
+        assert list(check.defects[0].stocks) == [
+            station.sub_locations['station_1']]
+
+    @patch('quactrl.models.quality.get_function')
+    def should_react_with_a_detached_snapshot_of_checks(self, mock_get):
+        requirement = create_requirement(specs={'limits': [0, 1]})
+        check = create_check(requirement)
+        control_plan = check.test.route
+        check.control.method_name = 'quactrl.helpers.is_num'
+        check.control.method_pars.update({'reaction_name': 'reactions.mail',
+                                          'reaction_blocking': True})
+        control_plan.steps.append(check.control)
+        control_plan.source = o.Location('station')
+
+        check.planned = control_plan.compile().steps[0]
+        check.cavity = None
+        check.tff = False
+        check.add_measurement(requirement, 3, q.Subject(tracking='1234'))
+        check.status = 'done'
+        check.close()
+
+        mock_get.assert_called_with('reactions.mail')
+        snapshot = mock_get.return_value.call_args[0][0]
+        assert snapshot['status'] == 'nok'
+        assert snapshot['location'] == 'station'
+        assert snapshot['part'] is None
+        assert snapshot['measurements'] == [{
+            'characteristic': requirement.characteristic.key,
+            'tracking': '1234/a@e>A', 'value': 3}]
+        assert snapshot['defects'] == [{
+            'failure_mode': 'hi-' + requirement.characteristic.key,
+            'tracking': '1234/hi-a@e>A'}]
+
+
+class A_ReactionDispatcher:
+    def should_deliver_reactions_on_background(self):
+        dispatcher = q.ReactionDispatcher()
+        event = threading.Event()
+        reached = []
+
+        def reaction(check):
+            event.wait(1)
+            reached.append(check)
+
+        dispatcher.dispatch(reaction, 'check')
+        assert reached == []
+
+        event.set()
+        dispatcher.join()
+        assert reached == ['check']
+        assert dispatcher.metrics['dispatched'] == 1
+        assert dispatcher.metrics['delivered'] == 1
+
+    def should_count_failed_reactions(self):
+        dispatcher = q.ReactionDispatcher()
+        dispatcher.dispatch(Mock(side_effect=ValueError), 'check')
+        dispatcher.join()
+
+        assert dispatcher.metrics['failed'] == 1
+        assert dispatcher.metrics['delivered'] == 0
+
+    def should_execute_blocking_reactions_on_caller(self):
+        dispatcher = q.ReactionDispatcher()
+        reaction = Mock(side_effect=ValueError)
+
+        with pytest.raises(ValueError):
+            dispatcher.dispatch(reaction, 'check', blocking=True)
+        reaction.assert_called_with('check')
+        assert dispatcher.metrics['inline'] == 1
+
+    def should_execute_reaction_on_caller_when_queue_is_full(self):
+        dispatcher = q.ReactionDispatcher(maxsize=1, workers=0)
+        dispatcher.dispatch(Mock(), 'first')
+        reaction = Mock()
+
+        dispatcher.dispatch(reaction, 'second')
+
+        reaction.assert_called_with('second')
+        assert dispatcher.pending == 1
+        assert dispatcher.metrics['inline'] == 1
@@ -0,0 +1,80 @@
+from unittest.mock import Mock
+import pytest
+from quactrl.models.devices import DeviceProvider
+import quactrl.models.scheduling as s
+
+
+class Meter:
+    scheduler = None
+
+    def is_called_alone(self):
+        return self.scheduler.is_busy('meter')
+
+
+class A_DeviceScheduler:
+    def should_reserve_all_devices_or_none(self):
+        scheduler = s.DeviceScheduler()
+
+        assert scheduler.reserve(['dmm', 'source'], 'one')
+        assert not scheduler.reserve(['load', 'dmm'], 'other')
+        assert scheduler.get_owner('load') is None
+
+        generation = scheduler.generation
+        scheduler.release(['dmm', 'source'], 'one')
+        assert scheduler.wait_release(generation, 0) == generation + 1
+        assert scheduler.reserve(['load', 'dmm'], 'other')
+
+    def should_plan_with_estimated_durations(self):
+        scheduler = s.DeviceScheduler()
+        steps = [Mock(id=1, devices=['dmm']),
+                 Mock(id=2, devices=['dmm']),
+                 Mock(id=3, devices=['source'])]
+        scheduler.record(steps[0], 2.0)
+
+        plan = scheduler.plan(steps, [set(), set(), set()])
+
+        assert plan['time'] == 3.0
+        assert plan['devices'] == {'dmm': 1.0, 'source': 1 / 3}
+
+    def should_nest_reservations_of_holders(self):
+        scheduler = s.DeviceScheduler()
+        scheduler.reserve(['dmm'], 'operation')
+
+        assert scheduler.reserve(['dmm'], 'step', ['operation'])
+        assert not scheduler.reserve(['dmm'], 'other', ['operation'])
+        scheduler.release(['dmm'], 'step')
+        assert scheduler.get_owner('dmm') == 'operation'
+
+    def should_keep_call_locks_of_devices(self):
+        scheduler = s.DeviceScheduler()
+        lock = scheduler.get_lock('dmm')
+
+        assert scheduler.get_lock('dmm') is lock
+        with lock:
+            assert scheduler.is_busy('dmm')
+        assert not scheduler.is_busy('dmm')
+        scheduler.reserve(['dmm'], 'one')
+        assert scheduler.is_busy('dmm')
+
+    def should_not_plan_unsatisfiable_dependencies(self):
+        scheduler = s.DeviceScheduler()
+        steps = [Mock(id=index, devices=[]) for index in range(3)]
+
+        with pytest.raises(ValueError, match='unknown steps'):
+            scheduler.plan(steps, [set(), {3}, set()])
+        with pytest.raises(ValueError, match=r'Steps \[1, 2\]'):
+            scheduler.plan(steps, [set(), {2}, {1}])
+
+
+class A_DeviceProvider:
+    def should_call_devices_holding_their_lock_on_scheduler(self):
+        scheduler = Meter.scheduler = s.DeviceScheduler()
+        provider = DeviceProvider(Meter, 'M1',
+                                  lock=scheduler.get_lock('meter'))
+
+        meter = provider()
+
+        assert meter is provider()
+        assert meter.tracking == 'M1'
+        assert meter.is_called_alone()
+        assert not scheduler.is_busy('meter')
@@ -0,0 +1,40 @@
+import json
+from unittest.mock import Mock
+from quactrl.rest.resources import StreamResource, serialize_event
+
+
+class A_StreamResource:
+    def should_join_serialized_events_as_json(self):
+        resource = StreamResource(Mock())
+        result = {'sequence': 3, 'missed': 1, 'dropped': 1,
+                  'events': [(2, serialize_event(['asked', None])),
+                             (3, serialize_event(['walked', None]))]}
+
+        assert json.loads(resource._join(result)) == {
+            'sequence': 3, 'missed': 1, 'dropped': 1,
+            'events': [{'seq': 2, 'event': {'state': 'asked', 'obj': None}}]
+        }
+
+    def should_stream_events_while_cavity_is_active(self):
+        service = Mock(active_cavities=[1])
+        service.wait_events.side_effect = [
+            {'sequence': 1, 'events': [(1, '{}')]},
+            {'sequence': 1, 'events': []}
+        ]
+        stream = StreamResource(Mock(test_service=service))._stream(
+            service, 1, 0, 1)
+
+        assert next(stream) == b'id: 1\ndata: {}\n\n'
+        assert next(stream) == b': keep-alive\n\n'
+        service.wait_events.assert_called_with(1, 1, 1, serialize_event)
+
+    def should_end_stream_when_cavity_is_removed(self):
+        service = Mock(active_cavities=[1])
+        service.wait_events.side_effect = [
+            {'sequence': 1, 'events': [(1, '{}')]},
+            KeyError(1)
+        ]
+        stream = StreamResource(Mock(test_service=service))._stream(
+            service, 1, 0, 1)
+
+        assert list(stream) == [b'id: 1\ndata: {}\n\n']
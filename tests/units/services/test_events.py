@@ -0,0 +1,55 @@
+import threading
+from unittest.mock import Mock
+from quactrl.services.events import EventBuffer
+
+
+class An_EventBuffer:
+    def should_return_events_since_a_sequence(self):
+        buffer = EventBuffer()
+        assert buffer.get_since() == ([], 0)
+        assert buffer.last is None
+
+        assert buffer.put('a') == 1
+        assert buffer.put('b') == 2
+
+        assert buffer.get_since() == ([(1, 'a'), (2, 'b')], 0)
+        assert buffer.get_since(1) == ([(2, 'b')], 0)
+        assert buffer.get_since(2) == ([], 0)
+        assert buffer.last == 'b'
+
+    def should_count_dropped_and_missed_events(self):
+        buffer = EventBuffer(maxlen=2)
+        for event in 'abcd':
+            buffer.put(event)
+
+        assert buffer.dropped == 2
+        assert buffer.get_since(1) == ([(3, 'c'), (4, 'd')], 1)
+        assert buffer.get_since(3) == ([(4, 'd')], 0)
+
+    def should_wait_for_new_events(self):
+        buffer = EventBuffer()
+        buffer.put('a')
+        assert buffer.wait(0, 0)
+        assert not buffer.wait(1, 0.01)
+
+        threading.Timer(0.05, buffer.put, ('b',)).start()
+        assert buffer.wait(1, 1)
+
+    def should_serialize_each_event_once(self):
+        buffer = EventBuffer()
+        buffer.put('a')
+        serialize = Mock(side_effect=str.upper)
+
+        assert buffer.get_since(0, serialize) == ([(1, 'A')], 0)
+        assert buffer.get_since(0, serialize) == ([(1, 'A')], 0)
+        serialize.assert_called_once_with('a')
+
+    def should_serialize_events_when_they_are_put(self):
+        buffer = EventBuffer(serialize=str)
+        event = ['started', {'state': 'started'}]
+        buffer.put(event)
+
+        event[1]['state'] = 'finished'
+
+        assert buffer.get_since(0, str) == (
+            [(1, "['started', {'state': 'started'}]")], 0)
@@ -0,0 +1,79 @@
+import threading
+import time
+from unittest.mock import Mock
+from quactrl.services.partmngrs import MonoPartManager
+
+
+class FakeInspector:
+    def __init__(self):
+        self.state_listeners = []
+        self.state = 'idle'
+        self.part = None
+
+    def stop(self):
+        pass
+
+    def set_state(self, state):
+        self.state = state
+        for listener in self.state_listeners:
+            listener(self)
+
+
+class FakePartManager(MonoPartManager):
+    def __init__(self, refresh_time=0.1):
+        self.present = False
+        self.checks = 0
+        test_service = Mock()
+        test_service.inspectors = {None: FakeInspector()}
+        self.changed = threading.Event()
+        self.states = []
+        super().__init__(test_service, refresh_time)
+
+    def part_is_present(self, cavity_key):
+        self.checks += 1
+        return self.present
+
+    def cavity_state_has_changed(self, cavity):
+        self.states.append(self.cavities[cavity].state)
+        self.changed.set()
+
+
+class A_MultiPartManager:
+    def should_poll_presence_at_refresh_time(self):
+        manager = FakePartManager(refresh_time=0.05)
+        manager.start()
+        time.sleep(0.3)
+        manager.stop()
+
+        assert manager.checks < 15
+        assert manager.metrics['refreshes'] < 15
+        assert manager.cpu_usage < 0.5
+
+    def should_wake_up_on_presence_events(self):
+        manager = FakePartManager(refresh_time=10)
+        manager.responsible = Mock()
+        manager.start()
+        time.sleep(0.05)
+
+        manager.present = True
+        manager.presence_changed(None)
+
+        assert manager.changed.wait(1)
+        assert manager.states[0] == 'loaded'
+        assert manager.metrics['transitions'] >= 1
+        assert manager.metrics['max_latency'] < 1
+        manager.stop()
+
+    def should_wait_without_polling_while_inspector_works(self):
+        manager = FakePartManager(refresh_time=0.01)
+        manager.cavity.state = 'stacked'
+        manager.start()
+        time.sleep(0.05)
+        refreshes = manager.metrics['refreshes']
+        time.sleep(0.1)
+        assert manager.metrics['refreshes'] == refreshes
+
+        manager.cavity.inspector.set_state('busy')
+        assert manager.changed.wait(1)
+        assert manager.cavity.state == 'busy'
+        manager.stop()
@@ -0,0 +1,180 @@
+import os
+import shutil
+import threading
+import pytest
+from sqlalchemy import text
+from quactrl.data import Data
+from quactrl.services.persistence import PersistenceQueue
+import quactrl.models.hhrr as hr
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+import quactrl.models.quality as qua
+
+
+def measure(check, value):
+    check.add_measurement(check.control.requirement, value, check.part)
+
+
+class TestStation:
+    """Database with a control plan of some checks and tests executed on it
+    """
+    def __init__(self, path, checks=3):
+        self.db = Data('sqlalchemy', 'sqlite:///' + os.path.join(path, 'db'))
+        self.db.create_schema()
+        self.session = self.db.Session()
+        self.session.expire_on_commit = False
+
+        role = hr.Role('tester', 'tester')
+        self.person = hr.Person('person', 'person', 'person')
+        self.person.add_role(role)
+        self.part_model = prd.PartModel('part_number')
+        self.control_plan = qua.ControlPlan(
+            role, source=op.Location('station'),
+            destination=op.Location('ok'), outputs=[self.part_model]
+        )
+        element = prd.Element('e')
+        mode = qua.Mode('hi')
+        for index in range(checks):
+            characteristic = prd.Characteristic(
+                prd.Attribute('a{}'.format(index)), element)
+            characteristic.add_failure_mode(mode)
+            requirement = prd.Requirement(
+                characteristic, '{}>X'.format(characteristic.key),
+                {'limits': [0, 10]})
+            self.control_plan.steps.append(qua.Control(
+                self.control_plan, requirement,
+                'tests.units.services.test_persistence.measure',
+                {'value': 5 if index else 20}
+            ))
+        self.session.add(self.control_plan)
+        self.session.add(self.person)
+        self.session.commit()
+        self.plan = self.control_plan.compile()
+
+    def run_test(self, serial_number, persistence=None):
+        key = ('part_number', serial_number)
+        if persistence:
+            persistence.wait_for(key)
+        part = (self.db.Parts().get_by(self.part_model, serial_number)
+                or prd.Part(self.part_model, serial_number))
+        test = self.control_plan.implement(self.person)
+        test.start(part=part, toolbox=None, devices={}, cavity=None,
+                   tff=False, plan=self.plan)
+        test.walk()
+        test.execute()
+        test.close()
+        self.session.add(test)
+        self.session.add(part)
+        if persistence:
+            persistence.put(self.session, key)
+        else:
+            self.session.commit()
+
+    def count(self):
+        return [self.session.execute(text(sql)).fetchall() for sql in (
+            'select is_a, count(*) from flow group by is_a',
+            'select count(*), sum(current) from token',
+            'select count(*) from item',
+            'select count(*) from item_link'
+        )]
+
+
+class A_PersistenceQueue:
+    def should_write_as_commits_of_inspector(self, tmpdir):
+        station = TestStation(str(tmpdir.mkdir('committed')))
+        for serial_number in '1121':
+            station.run_test(serial_number)
+        expected = station.count()
+
+        station = TestStation(str(tmpdir.mkdir('behind')))
+        persistence = PersistenceQueue(station.db)
+        persistence.start()
+        for serial_number in '1121':
+            station.run_test(serial_number, persistence)
+        persistence.stop()
+
+        assert persistence.metrics['written'] == 4
+        assert not station.session.new and not station.session.dirty
+        assert station.count() == expected
+
+    def should_replay_journal_on_start(self, tmpdir):
+        station = TestStation(str(tmpdir))
+        journal = str(tmpdir.join('journal'))
+        crashed = PersistenceQueue(station.db, journal=journal)
+        for serial_number in '12':
+            station.run_test(serial_number, crashed)
+        assert len(os.listdir(journal)) == 2
+        assert station.count()[2] == [(0,)]
+
+        persistence = PersistenceQueue(station.db, journal=journal)
+        persistence.start()
+        persistence.stop()
+
+        assert persistence.metrics['replayed'] == 2
+        assert os.listdir(journal) == []
+        assert station.count()[0] == [('check', 6), ('test', 2)]
+
+    def should_not_replay_entries_already_written(self, tmpdir):
+        station = TestStation(str(tmpdir))
+        journal = str(tmpdir.join('journal'))
+        crashed = PersistenceQueue(station.db, journal=journal)
+        for serial_number in '12':
+            station.run_test(serial_number, crashed)
+        shutil.copytree(journal, str(tmpdir.join('copy')))
+        crashed.start()
+        crashed.stop()
+        for name in os.listdir(str(tmpdir.join('copy'))):  # Not removed
+            shutil.copy(str(tmpdir.join('copy', name)), journal)
+
+        persistence = PersistenceQueue(station.db, journal=journal)
+        persistence.start()
+        station.run_test('3', persistence)
+        persistence.stop()
+
+        assert persistence.metrics['skipped'] == 2
+        assert persistence.metrics['written'] == 1
+        assert os.listdir(journal) == []
+        assert station.count()[0] == [('check', 9), ('test', 3)]
+
+    def should_keep_keys_of_changes_not_written_pending(self, tmpdir):
+        station = TestStation(str(tmpdir))
+        persistence = PersistenceQueue(station.db)
+        persistence.start()
+        station.run_test('1', persistence)
+        station.session.add(prd.Part(station.part_model, '1'))  # Duplicated
+        persistence.put(station.session, ('part_number', '1'))
+        persistence.join_queue()
+
+        with pytest.raises(Exception):
+            persistence.wait_for(('part_number', '1'))
+        assert persistence.wait_for(('part_number', '2'))
+        persistence.stop()
+
+    def should_raise_write_errors_on_commit_durability(self, tmpdir):
+        station = TestStation(str(tmpdir))
+        journal = str(tmpdir.join('journal'))
+        persistence = PersistenceQueue(station.db, durability='commit',
+                                       journal=journal)
+        persistence.start()
+        station.run_test('1', persistence)
+        station.session.add(prd.Part(station.part_model, '1'))  # Duplicated
+
+        with pytest.raises(Exception):
+            persistence.put(station.session)
+
+        assert persistence.metrics['failed'] == 1
+        assert len(os.listdir(journal)) == 1
+        persistence.stop()
+
+    def should_block_when_backlog_is_full(self, tmpdir):
+        station = TestStation(str(tmpdir))
+        persistence = PersistenceQueue(station.db, maxsize=1)
+        station.run_test('1', persistence)
+        threading.Timer(0.1, persistence.start).start()
+
+        station.run_test('2', persistence)
+        persistence.stop()
+
+        assert persistence.metrics['blocked'] == 1
+        assert persistence.metrics['blocked_time'] > 0.05
+        assert station.count()[0] == [('check', 6), ('test', 2)]
@@ -0,0 +1,240 @@
+import multiprocessing
+import os
+import time
+from unittest.mock import Mock, patch
+import pytest
+from quactrl.data import Data, NotFoundResource
+from quactrl.rest.parsing import parse
+from quactrl.services.processes import (
+    DeviceBroker, DeviceHub, InspectorProcess, ProcessInspector,
+    RemoteObject, RemoteScheduler, RemoteToolbox, get_data_args)
+from quactrl.services.testing import is_test_end, Service, IncorrectSetup
+import quactrl.models.hhrr as hr
+import quactrl.models.operations as op
+import quactrl.models.products as prd
+import quactrl.models.quality as qua
+
+
+class Meter:
+    tracking = 'M1'
+
+    def measure(self, value):
+        return 2 * value
+
+    def get_pid(self):
+        return os.getpid()
+
+
+class FakeToolbox:
+    def meter(self):
+        return Meter()
+
+    def dut(self, model, cavity):
+        return (model, cavity)
+
+
+def load_fake_hub():
+    DeviceHub.instance = DeviceHub(FakeToolbox())
+
+
+def measure(check, value):
+    """Control method measuring on the meter of the broker"""
+    check.add_measurement(check.control.requirement,
+                          check.toolbox.meter().measure(value), check.part)
+
+
+def create_station(path):
+    """Database of a station with two controls using the meter"""
+    data = Data('sqlalchemy', 'sqlite:///' + os.path.join(path, 'db'))
+    data.create_schema()
+    session = data.Session()
+    role = hr.Role('tester', 'tester')
+    person = hr.Person('person', 'person', 'person')
+    person.add_role(role)
+    control_plan = qua.ControlPlan(
+        role, source=op.Location('station'), destination=op.Location('ok'),
+        outputs=[prd.PartModel('part_number')]
+    )
+    element = prd.Element('e')
+    for name in ('a', 'b'):
+        characteristic = prd.Characteristic(prd.Attribute(name), element)
+        characteristic.add_failure_mode(qua.Mode(name))
+        control_plan.steps.append(qua.Control(
+            control_plan, prd.Requirement(
+                characteristic, '{}>X'.format(characteristic.key),
+                {'limits': [0, 10]}),
+            'tests.units.services.test_processes.measure',
+            {'value': 3, 'devices': ['meter']}
+        ))
+    session.add_all([control_plan, person])
+    session.commit()
+    session.close()
+    return data
+
+
+def wait_test_end(inspector, timeout):
+    """Return the event ending the test of inspector, None on timeout"""
+    sequence = 0
+    deadline = time.time() + timeout
+    while inspector.events.wait(sequence, max(0, deadline - time.time())):
+        events, _ = inspector.events.get_since(sequence)
+        for sequence, event in events:
+            if is_test_end(event):
+                return event
+
+
+class Test:
+    state = 'success'
+
+
+class A_DeviceBroker:
+    def should_serve_devices_from_its_own_process(self):
+        broker = DeviceBroker(ctx=multiprocessing.get_context('spawn'))
+        broker.start(load_fake_hub)
+        try:
+            toolbox = RemoteToolbox(broker.hub())
+            meter = toolbox.meter()
+
+            assert meter is toolbox.meter()
+            assert meter.measure(2) == 4
+            assert meter.tracking == 'M1'
+            assert meter.get_pid() != os.getpid()
+            assert not hasattr(meter, 'missing')
+        finally:
+            broker.shutdown()
+
+    def should_host_reservations_of_all_processes(self):
+        broker = DeviceBroker(ctx=multiprocessing.get_context('spawn'))
+        broker.start(load_fake_hub)
+        try:
+            scheduler = RemoteScheduler(broker.hub())
+            other = RemoteScheduler(broker.hub())
+            owner, step = object(), object()
+
+            generation = scheduler.generation
+            assert scheduler.reserve(['meter'], owner)
+            assert not other.reserve(['meter'], object())
+            assert other.reserve(['meter'], step, [owner])
+            other.release(['meter'], step)
+            scheduler.release(['meter'], owner)
+
+            assert other.get_owner('meter') is None
+            assert other.wait_release(generation, 0) == generation + 2
+        finally:
+            broker.shutdown()
+
+
+class A_DeviceHub:
+    def should_get_duts_of_models_loaded_in_advance(self):
+        hub = DeviceHub(FakeToolbox(), {'part_number': 'model'})
+
+        assert hub.get(('dut', 'part_number', 1), 'count')('model') == 1
+        with pytest.raises(NotFoundResource):
+            hub.get(('dut', 'other', 1), 'count')
+
+
+class An_InspectorProcess:
+    def should_test_parts_with_devices_reserved_on_broker(self, tmpdir):
+        data = create_station(str(tmpdir))
+        context = multiprocessing.get_context('spawn')
+        broker = DeviceBroker(ctx=context)
+        broker.start(load_fake_hub)
+        process = InspectorProcess(context, get_data_args(data), 'station',
+                                   broker.address, tff=False)
+        try:
+            scheduler = RemoteScheduler(broker.hub())
+            owner = object()
+            assert scheduler.reserve(['meter'], owner)
+            inspector = ProcessInspector(process)
+            inspector.start()
+            inspector.orders.put(({'part_number': 'part_number',
+                                   'serial_number': '1'}, 'person'))
+
+            deadline = time.time() + 60
+            while inspector.state != 'busy' and time.time() < deadline:
+                time.sleep(0.05)
+            assert wait_test_end(inspector, 0.5) is None  # Waits for meter
+            scheduler.release(['meter'], owner)
+            event = wait_test_end(inspector, 60)
+
+            assert event[0] == 'success'
+            assert scheduler.get_owner('meter') is None
+            assert inspector.stop() == []
+        finally:
+            process.stop()
+            broker.shutdown()
+
+
+class A_ServiceOfProcesses:
+    def should_reject_sampling_plans(self, tmpdir):
+        data = create_station(str(tmpdir))
+        control = data.ControlPlans().get_all_from('station')[0].steps[0]
+        control.method_pars = dict(control.method_pars, sampling={
+            'plan': 'units', 'quantity': 1, 'frequency': 5})
+        data.Session().commit()
+
+        with pytest.raises(IncorrectSetup) as error:
+            Service(data, 'station', processes=2)
+        assert control.requirement.key in str(error.value)
+
+
+class A_RemoteObject:
+    def should_be_parsed_as_original_object(self):
+        error = RemoteObject(ValueError('wrong'))
+
+        assert parse(error) == {'class': 'Error', 'name': 'ValueError',
+                                'message': 'wrong'}
+        with patch('quactrl.services.processes.logger') as logger:
+            assert parse(RemoteObject(object()))['class'] == 'object'
+        assert logger.exception.called
+
+    def should_keep_class_name_and_state(self):
+        test = RemoteObject(Test())
+
+        assert test.class_name == 'Test'
+        assert test.state == 'success'
+        assert is_test_end(['success', test])
+        assert not is_test_end(['success', RemoteObject(ValueError())])
+
+
+class A_ProcessInspector:
+    def setup_method(self, method):
+        self.process = Mock()
+        self.process.inspectors = {}
+        self.inspector = ProcessInspector(self.process, 1)
+        self.inspector.start()
+
+    def should_send_commands_to_its_process(self):
+        key = self.inspector.key
+        assert self.process.inspectors[key] is self.inspector
+        self.process.send.assert_called_with(key, 'start', 1)
+
+        self.inspector.orders.put(('part_info', 'responsible'))
+        self.process.send.assert_called_with(
+            key, 'order', ('part_info', 'responsible'))
+
+        self.inspector.answer(value=1)
+        self.process.send.assert_called_with(key, 'answer', {'value': 1})
+
+    def should_apply_messages_of_its_process(self):
+        states = []
+        self.inspector.state_listeners.append(
+            lambda inspector: states.append(inspector.state))
+        test = RemoteObject(Test())
+
+        self.inspector.receive('state', 'busy')
+        self.inspector.receive('part', 'part')
+        self.inspector.receive('event', ['success', test])
+
+        assert states == ['busy']
+        assert self.inspector.part == 'part'
+        assert self.inspector.test.state == 'success'
+        assert self.inspector.events.last == ['success', test]
+
+    def should_return_pending_orders_on_stop(self):
+        self.process.send.side_effect = (
+            lambda key, command, payload=None:
+            self.inspector.receive('stopped', ['order']))
+
+        assert self.inspector.stop() == ['order']
+        assert self.process.inspectors == {}
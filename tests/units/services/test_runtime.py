@@ -0,0 +1,125 @@
+import threading
+import time
+from unittest.mock import Mock
+from quactrl.services.runtime import AsyncRuntime, OrderQueue
+from quactrl.services.testing import AsyncInspector
+
+
+class FakeInspector(AsyncInspector):
+    def __init__(self, cavity, runtime, running):
+        super().__init__(Mock(), Mock(), 'location', cavity, runtime=runtime)
+        self.db.Devices.return_value.get_all_from.return_value = []
+        self.running = running
+        self.workers = []
+
+    def run_test(self, order):
+        self.workers.append(threading.get_ident())
+        with self.running['lock']:
+            self.running['now'] += 1
+            self.running['max'] = max(self.running['max'],
+                                      self.running['now'])
+        time.sleep(0.05)
+        with self.running['lock']:
+            self.running['now'] -= 1
+
+
+class An_AsyncRuntime:
+    def should_run_blocking_calls_on_bounded_workers(self):
+        runtime = AsyncRuntime(workers=2)
+
+        async def collect():
+            return await runtime.run_blocking(threading.get_ident)
+
+        idents = {runtime.spawn(collect()).result(1) for _ in range(10)}
+
+        assert 1 <= len(idents) <= 2
+        assert threading.get_ident() not in idents
+        runtime.stop()
+
+    def should_keep_a_cache_by_worker(self):
+        runtime = AsyncRuntime(workers=1)
+
+        async def put():
+            return await runtime.run_blocking(
+                lambda: runtime.worker_cache.setdefault('a', object()))
+
+        assert runtime.spawn(put()).result(1) is runtime.spawn(put()).result(1)
+        assert 'a' not in runtime.worker_cache
+        runtime.stop()
+
+
+class An_OrderQueue:
+    def should_notify_puts(self):
+        on_put = Mock()
+        orders = OrderQueue(on_put)
+
+        orders.put('order')
+
+        on_put.assert_called_once_with()
+        assert orders.get() == 'order'
+
+
+class An_AsyncInspector:
+    def should_run_many_cavities_on_few_workers(self):
+        runtime = AsyncRuntime(workers=3)
+        running = {'lock': threading.Lock(), 'now': 0, 'max': 0}
+        inspectors = [FakeInspector(cavity, runtime, running)
+                      for cavity in range(12)]
+        for inspector in inspectors:
+            inspector.start()
+            inspector.orders.put(({}, 'responsible'))
+            inspector.orders.put(({}, 'responsible'))
+
+        for inspector in inspectors:
+            inspector.orders.join()
+
+        assert running['max'] == 3
+        workers = set()
+        for inspector in inspectors:
+            assert len(inspector.workers) == 2
+            assert len(set(inspector.workers)) == 1
+            workers.update(inspector.workers)
+        assert len(workers) == 3
+        assert threading.active_count() < 12
+
+        for inspector in inspectors:
+            assert inspector.stop() == []
+            inspector.future.result(1)
+            assert inspector.state == 'stopped'
+        runtime.stop()
+
+    def should_prepare_once_on_its_worker(self):
+        runtime = AsyncRuntime(workers=2)
+        running = {'lock': threading.Lock(), 'now': 0, 'max': 0}
+        inspector = FakeInspector(None, runtime, running)
+        inspector.start()
+
+        for _ in range(4):
+            inspector.orders.put(({}, 'responsible'))
+        inspector.orders.join()
+        inspector.stop()
+        inspector.future.result(1)
+
+        assert len(set(inspector.workers)) == 1
+        inspector.db.Locations.return_value.get.assert_called_once_with(
+            'location')
+        runtime.stop()
+
+    def should_notify_state_changes_and_prepare_on_worker(self):
+        runtime = AsyncRuntime(workers=1)
+        running = {'lock': threading.Lock(), 'now': 0, 'max': 0}
+        inspector = FakeInspector(None, runtime, running)
+        states = []
+        inspector.state_listeners.append(
+            lambda inspector: states.append(inspector.state))
+        inspector.start()
+
+        inspector.orders.put(({}, 'responsible'))
+        inspector.orders.join()
+        inspector.stop()
+        inspector.future.result(1)
+
+        assert states == ['idle', 'busy', 'idle', 'stopped']
+        inspector.db.Locations.return_value.get.assert_called_once_with(
+            'location')
+        runtime.stop()
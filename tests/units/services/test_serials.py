@@ -0,0 +1,68 @@
+import os
+import tempfile
+import threading
+from unittest.mock import Mock
+from quactrl.data import Data
+from quactrl.services.serials import SerialAllocator
+from quactrl.services.testing import Inspector
+import quactrl.models.products as prd
+
+
+class A_SerialAllocator:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = Data('sqlalchemy', 'sqlite:///' + os.path.join(
+            self.directory.name, 'db'))
+        self.data.create_schema()
+        session = self.data.Session()
+        self.part_model = prd.PartModel('part_number')
+        session.add(prd.Part(self.part_model, '190600012'))
+        session.add(prd.Part(self.part_model, '190700099'))
+        session.commit()
+
+    def teardown_method(self, method):
+        self.directory.cleanup()
+
+    def should_continue_serial_numbers_of_database(self):
+        allocator = SerialAllocator(self.data)
+
+        assert allocator.get_next(self.part_model, '1906') == '190600013'
+        assert allocator.get_next(self.part_model, '1906') == '190600014'
+        assert allocator.get_next(self.part_model, '1908') == '190800001'
+
+    def should_reserve_sequences_in_blocks(self):
+        allocator = SerialAllocator(self.data, block_size=10)
+        other = SerialAllocator(self.data)
+
+        assert allocator.get_next(self.part_model, '1907') == '190700100'
+        assert other.get_next(self.part_model, '1907') == '190700110'
+        assert allocator.get_next(self.part_model, '1907') == '190700101'
+        assert other.reserve(self.part_model, '1907', 3) == [
+            '190700111', '190700112', '190700113']
+
+    def should_give_each_serial_number_once(self):
+        serial_numbers = []
+
+        def allocate():
+            allocator = SerialAllocator(self.data, block_size=5)
+            for _ in range(20):
+                serial_numbers.append(
+                    allocator.get_next(self.part_model, '1906'))
+
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(serial_numbers) == [
+            '1906{:05d}'.format(sequence) for sequence in range(13, 93)]
+
+    def should_number_orders_of_inspectors_without_serial_number(self):
+        inspector = Inspector(self.data, Mock(), 'location')
+        inspector.part_model = self.part_model
+
+        assert inspector.get_serial_number(
+            {'batch_number': '1906'}) == '190600013'
+        assert inspector.get_serial_number(
+            {'batch_number': '1906', 'serial_number': '1'}) == '1'
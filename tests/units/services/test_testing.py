@@ -3,6 +3,7 @@ import time
 from ...units import TestWithPatches
 import threading
 import quactrl.services.testing as t
+from quactrl.services.events import EventBuffer
 import pytest
 
 
@@ -182,6 +183,30 @@ class A_TestingService(TestWithPatches):
         assert serv.test_has_finished(1)
 
 
+class A_ServiceOfEvents(TestWithPatches):
+    def setup_method(self, method):
+        self.create_patches(['quactrl.services.testing.Toolbox'])
+        db = Mock()
+        db.Devices.return_value.get_all_from.return_value = []
+        db.ControlPlans.return_value.get_all_from.return_value = []
+        self.service = t.Service(db, 'location')
+        self.service.inspectors[1] = Mock(events=EventBuffer())
+
+    def should_keep_last_events_read_by_each_client(self):
+        events = self.service.inspectors[1].events
+        test = Mock(class_name='Test')
+        for event in (['started', test], ['success', test],
+                      ['started', test]):
+            events.put(event)
+
+        assert self.service.get_last_events(1, 'a') == [
+            ['started', test], ['success', test]]
+        assert self.service.get_last_events(1, 'b') == [
+            ['started', test], ['success', test]]
+        assert self.service.get_last_events(1, 'a') == [['started', test]]
+        assert self.service.get_last_events(1, 'a') == []
+
+
 class An_Inspector(TestWithPatches):
 
     def setup_method(self, method):